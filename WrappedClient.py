@@ -1,11 +1,12 @@
 import numpy as np
 from client import Client
+from privacy_levels import PrivacyLevels
 
 class WrappeedClient:
     """This class is just a wrapper around client.py to make it suitable for multi-value
         data.
     """
-    def __init__(self, M, privacy_levels, selected_level,report_limit):
+    def __init__(self, M, privacy_levels, selected_level,report_limit, rng=None):
         """Initialize the wrapper client.
 
         Args:
@@ -13,13 +14,14 @@ class WrappeedClient:
             privacy_levels (float[]): An array of all levels of privacy.
             selected_level (int): An index of privacy_levels array which is indicating 
                 selected level of privacy for this client.
+            rng (RandomSource): Source of randomness which is shared by all bits.
         """
         self.M = M
-        self.privacy_levels = privacy_levels
+        self.privacy_levels = PrivacyLevels.of(privacy_levels)
         self.selected_level = selected_level
         self.epsilon = privacy_levels[selected_level]
         self.global_eps = report_limit * self.epsilon
-        self.clients = [Client(self.privacy_levels,self.selected_level, report_limit)\
+        self.clients = [Client(self.privacy_levels,self.selected_level, report_limit, rng)\
                          for i in range(M)]
         self.changes = 0
         self.prev_value = -1
@@ -0,0 +1,343 @@
+"""Benchmarks of hot paths of clients, server, replicators and combiner of Privacy Flow.
+
+Usage:
+    python benchmark.py run [--N 100000] [--M 8] [--levels 5] [--rounds 16] [--output path]
+    python benchmark.py compare baseline.json [current.json] [--threshold 0.2]
+
+`run` writes the results as JSON and `compare` checks results against a baseline. If the
+current results are not given, compare runs the benchmarks with the parameters of baseline.
+It exits with status 1 if any benchmark is slower than baseline by more than threshold.
+"""
+import argparse
+import json
+import platform
+import sys
+from time import perf_counter
+import numpy as np
+from client import Client
+from WrappedClient import WrappeedClient
+from client_population import ClientPopulation
+from randomness import RandomSource
+from server.manager import PrivacyFlow
+from server.estimator.estimator import WrappedServer
+from server.replicator.dr import DR
+from server.replicator.drs import DRS
+from server.replicator.drpp import DRPP
+from server.combiner.ac import AC
+from server.report_batch import BitSums, ReportBatch
+from server.wire import encode_batch, decode_batch
+
+
+# Minimum duration of a sample in seconds. Fast functions run several times in each sample.
+MIN_SAMPLE_TIME = 0.005
+
+
+def measure(run, setup=None, repeats=5):
+    """Measures wall time of a function.
+
+    Args:
+        run (callable): The measured function.
+        setup (callable): A function which is called before each sample and is not measured.
+            Samples with setup contain a single run.
+        repeats (int): Number of samples.
+
+    Returns:
+        {str: float}: Best and median time of a single run in seconds.
+    """
+    number = 1
+    if setup is None:
+        # Find the number of runs which takes at least MIN_SAMPLE_TIME.
+        while True:
+            start = perf_counter()
+            for _ in range(number):
+                run()
+            if perf_counter() - start >= MIN_SAMPLE_TIME:
+                break
+            number *= 2
+    times = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = perf_counter()
+        for _ in range(number):
+            run()
+        times.append((perf_counter() - start) / number)
+    return {'best': min(times), 'median': float(np.median(times)), 'repeats': repeats,
+            'number': number}
+
+
+class Fixture:
+    """Shared inputs of benchmarks which are built once for given parameters.
+    """
+
+    def __init__(self, N, M, L, rounds, client_users, seed=0):
+        """Build the inputs.
+
+        Args:
+            N (int): Number of users of vectorized clients and server.
+            M (int): Number of bits of data.
+            L (int): Number of privacy levels.
+            rounds (int): Number of rounds of reports.
+            client_users (int): Number of users of per-object clients.
+            seed (int): Seed of all randomness.
+        """
+        self.N, self.M, self.rounds, self.client_users = N, M, rounds, client_users
+        self.levels = [round(0.1 + 0.8 * i / max(L - 1, 1), 4) for i in range(L)]
+        generator = np.random.default_rng(seed)
+        self.rng = RandomSource(seed)
+        self.selected_levels = generator.integers(0, L, N)
+        self.values = generator.integers(0, 2 ** M, (rounds, N))
+        population = ClientPopulation(M, self.levels, self.selected_levels, rounds, self.rng)
+        self.batches = []
+        for values in self.values:
+            v, h = population.report(values)
+            self.batches.append(ReportBatch(np.arange(N), self.selected_levels, v, h))
+        self.batch = self.batches[-1]
+
+
+def bench_client(fixture, repeats):
+    """Measures Client.report of a single bit for client_users users. Clients keep their
+        round, so new clients are built before each sample."""
+    clients = []
+    def setup():
+        clients[:] = [Client(fixture.levels, level, fixture.rounds, fixture.rng)
+                      for level in fixture.selected_levels[:fixture.client_users].tolist()]
+    bits = (fixture.values[0, :fixture.client_users] & 1).tolist()
+    return measure(lambda: [client.report(bit) for client, bit in zip(clients, bits)],
+                   setup, repeats)
+
+
+def bench_wrapped_client(fixture, repeats):
+    """Measures WrappeedClient.report of M bits for client_users users. Clients keep their
+        round, so new clients are built before each sample."""
+    clients = []
+    def setup():
+        clients[:] = [WrappeedClient(fixture.M, fixture.levels, level, fixture.rounds,
+                                     fixture.rng)
+                      for level in fixture.selected_levels[:fixture.client_users].tolist()]
+    values = fixture.values[0, :fixture.client_users].tolist()
+    return measure(lambda: [client.report(value) for client, value in zip(clients, values)],
+                   setup, repeats)
+
+
+def bench_client_population(fixture, repeats):
+    """Measures ClientPopulation.report of all N users. The population keeps its round, so
+        a new population is built before each sample."""
+    populations = []
+    def setup():
+        populations[:] = [ClientPopulation(fixture.M, fixture.levels, fixture.selected_levels,
+                                           fixture.rounds, fixture.rng)]
+    return measure(lambda: populations[0].report(fixture.values[0]), setup, repeats)
+
+
+def bench_new_data_set(fixture, repeats):
+    """Measures PrivacyFlow.new_data_set of a round of N reports."""
+    flows = []
+    def setup():
+        flows[:] = [PrivacyFlow(None, fixture.levels, fixture.M, rng=fixture.rng)]
+    return measure(lambda: flows[0].new_data_set(fixture.batch), setup, repeats)
+
+
+def bench_estimate(fixture, repeats):
+    """Measures PrivacyFlow.estimate after new data, including replication and combination."""
+    flows = []
+    def setup():
+        flows[:] = [PrivacyFlow(None, fixture.levels, fixture.M, rng=fixture.rng)]
+        flows[0].new_data_set(fixture.batch)
+    return measure(lambda: flows[0].estimate(fixture.levels[-1]), setup, repeats)
+
+
+def bench_drs_recycle(fixture, repeats):
+    """Measures DRS.recycle which samples every level for all targets."""
+    drs = DRS(fixture.levels, fixture.rng)
+    return measure(lambda: drs.recycle(fixture.levels[0]),
+                   lambda: drs.new_data_set(fixture.batch), repeats)
+
+
+def bench_drpp_recycle(fixture, repeats):
+    """Measures DRPP.recycle of the strictest level."""
+    drpp = DRPP(fixture.levels, fixture.rng)
+    return measure(lambda: drpp.recycle(fixture.levels[0]),
+                   lambda: drpp.new_data_set(fixture.batch), repeats)
+
+
+def bench_derive(fixture, repeats):
+    """Measures DR.derive of a version at the strictest level for client_users users."""
+    dr = DR(fixture.levels, fixture.rng)
+    batch = fixture.batch
+    versions = [{fixture.levels[-1]: {'v': batch.v[i].tolist(), 'h': batch.h[i].tolist()}}
+                for i in range(fixture.client_users)]
+    return measure(lambda: [dr.derive(version, fixture.levels[0]) for version in versions],
+                   repeats=repeats)
+
+
+def bench_derive_batch(fixture, repeats):
+    """Measures DR.derive_batch of a version at the strictest level for N users."""
+    dr = DR(fixture.levels, fixture.rng)
+    return measure(lambda: dr.derive_batch(fixture.levels[0], fixture.levels[-1],
+                                           fixture.batch.v), repeats=repeats)
+
+
+def bench_weighted_estimate(fixture, repeats):
+    """Measures AC.weighted_estimate at the loosest level."""
+    generator = np.random.default_rng(0)
+    L = len(fixture.levels)
+    ac = AC(generator.random([L, fixture.M]) / 4, fixture.levels,
+            fixture.batch.level_counts(L))
+    return measure(lambda: ac.weighted_estimate(L - 1), repeats=repeats)
+
+
+def bench_weighted_estimate_all(fixture, repeats):
+    """Measures AC.weighted_estimate_all of every level."""
+    generator = np.random.default_rng(0)
+    L = len(fixture.levels)
+    ac = AC(generator.random([L, fixture.M]) / 4, fixture.levels,
+            fixture.batch.level_counts(L))
+    replicated = generator.random([L, fixture.M]) / 4
+    return measure(lambda: ac.weighted_estimate_all(replicated), repeats=repeats)
+
+
+def bench_finish(fixture, repeats):
+    """Measures WrappedServer.finish after all rounds of the fixture."""
+    server = WrappedServer(fixture.M, fixture.levels[-1])
+    for batch in fixture.batches:
+        server.new_values(BitSums.from_reports(batch.v, batch.h))
+        server.predicate(True)
+    return measure(server.finish, repeats=repeats)
+
+
+def bench_encode_batch(fixture, repeats):
+    """Measures wire.encode_batch of a round of N reports."""
+    return measure(lambda: encode_batch(fixture.batch), repeats=repeats)
+
+
+def bench_decode_batch(fixture, repeats):
+    """Measures wire.decode_batch of a round of N reports."""
+    frame = encode_batch(fixture.batch)
+    return measure(lambda: decode_batch(frame), repeats=repeats)
+
+
+# Benchmarks by name. Each one gets a Fixture and number of repeats and returns the result of
+#   measure.
+BENCHMARKS = {
+    'Client.report': bench_client,
+    'WrappeedClient.report': bench_wrapped_client,
+    'ClientPopulation.report': bench_client_population,
+    'PrivacyFlow.new_data_set': bench_new_data_set,
+    'PrivacyFlow.estimate': bench_estimate,
+    'DRS.recycle': bench_drs_recycle,
+    'DRPP.recycle': bench_drpp_recycle,
+    'DR.derive': bench_derive,
+    'DR.derive_batch': bench_derive_batch,
+    'AC.weighted_estimate': bench_weighted_estimate,
+    'AC.weighted_estimate_all': bench_weighted_estimate_all,
+    'WrappedServer.finish': bench_finish,
+    'wire.encode_batch': bench_encode_batch,
+    'wire.decode_batch': bench_decode_batch,
+}
+
+
+def run(parameters, names=None):
+    """Runs benchmarks.
+
+    Args:
+        parameters ({str: int}): N, M, levels, rounds, client_users, repeats and seed.
+        names ([str]): Names of benchmarks to run. All benchmarks run if it is not given.
+
+    Returns:
+        {str: object}: Parameters, environment and result of each benchmark.
+    """
+    fixture = Fixture(parameters['N'], parameters['M'], parameters['levels'],
+                      parameters['rounds'], parameters['client_users'], parameters['seed'])
+    results = {}
+    for name in names or BENCHMARKS:
+        results[name] = BENCHMARKS[name](fixture, parameters['repeats'])
+        print(f'{name:28s} best {results[name]["best"]:.6f}s '
+              f'median {results[name]["median"]:.6f}s')
+    return {
+        'parameters': parameters,
+        'environment': {'python': platform.python_version(), 'numpy': np.__version__,
+                        'machine': platform.machine(), 'processor': platform.processor()},
+        'results': results,
+    }
+
+
+def compare(baseline, current, threshold):
+    """Compares best times of benchmarks with a baseline.
+
+    Args:
+        baseline ({str: object}): Results of a previous run.
+        current ({str: object}): Results of this run.
+        threshold (float): Relative slowdown which is considered a regression.
+
+    Returns:
+        [str]: Names of benchmarks with regression.
+    """
+    if baseline['parameters'] != current['parameters']:
+        print('Warning! Parameters of baseline and current results are different.')
+    regressions = []
+    for name, result in current['results'].items():
+        if name not in baseline['results']:
+            print(f'{name:28s} new benchmark')
+            continue
+        ratio = result['best'] / baseline['results'][name]['best']
+        status = 'REGRESSION' if ratio > 1 + threshold else 'ok'
+        if status == 'REGRESSION':
+            regressions.append(name)
+        print(f'{name:28s} {baseline["results"][name]["best"]:.6f}s -> {result["best"]:.6f}s '
+              f'({ratio:.2f}x) {status}')
+    return regressions
+
+
+def main(arguments):
+    """Entrypoint of the command line.
+
+    Args:
+        arguments ([str]): Command line arguments.
+
+    Returns:
+        int: Exit status.
+    """
+    parser = argparse.ArgumentParser(description='Benchmarks of Privacy Flow.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='Run benchmarks and save results.')
+    run_parser.add_argument('--N', type=int, default=100000)
+    run_parser.add_argument('--M', type=int, default=8)
+    run_parser.add_argument('--levels', type=int, default=5)
+    run_parser.add_argument('--rounds', type=int, default=16)
+    run_parser.add_argument('--client-users', type=int, default=1000)
+    run_parser.add_argument('--repeats', type=int, default=5)
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS))
+    run_parser.add_argument('--output', default='benchmark.json')
+    compare_parser = commands.add_parser('compare', help='Compare results with a baseline.')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current', nargs='?')
+    compare_parser.add_argument('--threshold', type=float, default=0.2)
+    arguments = parser.parse_args(arguments)
+
+    if arguments.command == 'run':
+        parameters = {'N': arguments.N, 'M': arguments.M, 'levels': arguments.levels,
+                      'rounds': arguments.rounds, 'client_users': arguments.client_users,
+                      'repeats': arguments.repeats, 'seed': arguments.seed}
+        results = run(parameters, arguments.only)
+        with open(arguments.output, 'w') as file:
+            json.dump(results, file, indent=2)
+        return 0
+    with open(arguments.baseline) as file:
+        baseline = json.load(file)
+    if arguments.current:
+        with open(arguments.current) as file:
+            current = json.load(file)
+    else:
+        current = run(baseline['parameters'],
+                      [name for name in baseline['results'] if name in BENCHMARKS])
+    regressions = compare(baseline, current, arguments.threshold)
+    if regressions:
+        print('Regressions:', ', '.join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
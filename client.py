@@ -2,6 +2,82 @@
 """
 import math
 import numpy as np
+from randomness import RandomSource, default_source
+from privacy_levels import PrivacyLevels
+
+
+def bit_length(values):
+    """Computes number of bits required to represent each value using integer shifts.
+
+    Args:
+        values (int[]): Non-negative integers.
+
+    Returns:
+        int[]: Bit length of each value.
+    """
+    remaining = np.array(values, dtype=np.int64)
+    lengths = np.zeros(remaining.shape, dtype=np.int64)
+    while remaining.any():
+        lengths += remaining > 0
+        remaining >>= 1
+    return lengths
+
+
+class TreeSchedule:
+    """Precomputed decomposition of time into difference trees.
+        The decomposition only depends on t and so it is shared among all clients:
+        t = 2^(a_1) + ... + 2^(a_m_t) where a_1 is the largest set bit of t and a_m_t is the
+        smallest one.
+    """
+    def __init__(self, size=1024):
+        # a_1 of each t:
+        self.a_1 = np.zeros(0, dtype=np.int64)
+        # a_m_t of each t:
+        self.a_m_t = np.zeros(0, dtype=np.int64)
+        self.grow(size)
+
+    def grow(self, size):
+        """Extends the table to cover every t < size.
+
+        Args:
+            size (int): The number of rows of the table.
+        """
+        t = np.arange(size, dtype=np.int64)
+        self.a_1 = bit_length(t) - 1
+        self.a_m_t = bit_length(t & -t) - 1
+
+    def __len__(self):
+        return len(self.a_1)
+
+    def __getitem__(self, t):
+        """Returns a_1 and a_m_t of given time.
+
+        Args:
+            t (int): The time or number of reports gathered.
+
+        Returns:
+            (int, int): a_1 and a_m_t respectively.
+        """
+        if t >= len(self):
+            self.grow(max(2 * len(self), t + 1))
+        return int(self.a_1[t]), int(self.a_m_t[t])
+
+    def set_bits(self, t):
+        """Returns "a" values of all trees at given time from the largest tree to the smallest one.
+
+        Args:
+            t (int): The time or number of reports gathered.
+
+        Returns:
+            int[]: a_i values
+        """
+        a_1, _ = self[t]
+        return [a for a in range(a_1, -1, -1) if (t >> a) & 1]
+
+
+# The schedule which is shared among all clients.
+SCHEDULE = TreeSchedule()
+
 
 def leaf_nodes_per_tree(total_number_of_nodes):
     """Computes "a" values where a_i + 1 denotes the height of i'th tree and 
@@ -17,17 +93,15 @@ def leaf_nodes_per_tree(total_number_of_nodes):
     Returns:
         int[]: a_i values
     """
-    if total_number_of_nodes == 0:
-        return []
-    leaf_nodes_in_current_tree = math.floor(math.log2(total_number_of_nodes))
-    remaning_nodes = total_number_of_nodes - math.pow(2, leaf_nodes_in_current_tree)
-    return np.concatenate(([leaf_nodes_in_current_tree], leaf_nodes_per_tree(remaning_nodes)))
+    return np.array(SCHEDULE.set_bits(int(total_number_of_nodes)), dtype=np.int64)
 
 
 class Client:
     """Implements functionalities of Privacy Flow Client.
     """
-    def __init__(self, privacy_levels, selected_level, report_limit):
+    def __init__(self, privacy_levels, selected_level, report_limit, rng=None):
+        # Source of randomness:
+        self.rng = rng or default_source()
         # A list for storing key nodes of difference trees:
         self.R = []
         # Keep the previous data of client to compute the difference.
@@ -37,7 +111,7 @@ class Client:
         # Indicate the number of difference trees in the current time.
         self.m_t_1 = 0
         # List of all privacy levels
-        self.privacy_levels = privacy_levels
+        self.privacy_levels = PrivacyLevels.of(privacy_levels)
         # Selected privacy level for this client.
         self.selected_level = selected_level
         # Selected epsiolon based on selected level.
@@ -56,6 +130,9 @@ class Client:
         self.budget_consumed = False
         # Determines if budget is used in last report or not.
         self.budget_used = False
+        # Thresholds of reporting 1 for each value of a node when the budget is epsilon.
+        self.thresholds = dict(zip((-1, 0, 1), self.privacy_levels.set_to_one_thresholds[
+                                       self.selected_level].tolist()))
 
     def calcualte_budget(self):
         """Returns the privacy budget for current calculation.
@@ -81,15 +158,16 @@ class Client:
         """
         self.t = self.t + 1
         self.budget_used = False
-        aArray = leaf_nodes_per_tree(self.t)
-        aArray = aArray.astype(np.int64)
-        previousR = self.R.copy()
-        a_1 = aArray[0]
-        self.a_m_t = aArray[len(aArray) - 1]
-        self.R = [previousR[j] \
-                    if j > self.a_m_t \
-                    else np.sum(previousR[0:j]) + v - self.previous_value \
-                    for j  in range(a_1 + 1)]
+        a_1, self.a_m_t = SCHEDULE[self.t]
+        if len(self.R) < a_1 + 1:
+            self.R.extend([0] * (a_1 + 1 - len(self.R)))
+        # R[j] = R[0] + ... + R[j - 1] + v - previous_value for j <= a_m_t
+        delta = v - self.previous_value
+        prefix = 0
+        for j in range(self.a_m_t + 1):
+            node = self.R[j]
+            self.R[j] = prefix + delta
+            prefix += node
         if self.previous_value != v:
             self.changes+=1
         self.previous_value = v
@@ -104,7 +182,7 @@ class Client:
             [int, int]: The level of node to report and its value.
         """
         r_t = self.a_m_t
-        h_t = np.random.randint(0, 2)
+        h_t = self.rng.bit()
         if h_t >= 1:
             h_t = r_t
         else:
@@ -123,22 +201,36 @@ class Client:
         Returns:
            int: Either 1 or -1 is returned based on data changes and amount of budget usage.
         """
-        rand = np.random.random()
+        rand = self.rng.word()
         eps = self.calcualte_budget()
         if v == 0 or eps == 0:
-            if rand < 0.5:
-                return 1
-            else:
-                return -1
+            threshold = self.thresholds[0]
         else:
             self.count += 1
             self.budget_used = True
-            set_to_one_p = 0.5 + (v/2) * ( (math.exp(eps) - 1) / \
-                                (math.exp(eps) + 1) )
-            if rand < set_to_one_p:
-                return 1
+            if eps == self.epsilon and v in self.thresholds:
+                threshold = self.thresholds[v]
             else:
-                return -1
+                threshold = RandomSource.threshold(self.set_to_one_p(v, eps))
+        if rand < threshold:
+            return 1
+        else:
+            return -1
+
+    @staticmethod
+    def set_to_one_p(v, eps):
+        """Computes probability of reporting 1 for a node.
+
+        Args:
+            v (int): The value of node
+            eps (float): The budget to be used.
+
+        Returns:
+            float: The probability of reporting 1.
+        """
+        return 0.5 + (v/2) * ( (math.exp(eps) - 1) / \
+                            (math.exp(eps) + 1) )
+
     def report(self, data):
         """Outer function which bundles internal functionalities.
 
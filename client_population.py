@@ -0,0 +1,207 @@
+"""Vectorized Client Implementation of Privacy Flow framework
+"""
+import numpy as np
+from client import SCHEDULE
+from randomness import RandomSource, default_source
+from privacy_levels import PrivacyLevels
+
+
+class ClientPopulation:
+    """Implements functionalities of a whole population of multi-value Privacy Flow clients.
+        The state of every client is kept as arrays where the i'th row belongs to the i'th
+        user and the m'th column belongs to the m'th bit, so it can replace a list of
+        WrappeedClient objects and report all of them in a few NumPy passes.
+    """
+    def __init__(self, M, privacy_levels, selected_levels, report_limit, rng=None, height=None,
+                 state=None):
+        """Initialize the population.
+
+        Args:
+            M (int): Number of bits of data.
+            privacy_levels (float[]): An array of all levels of privacy.
+            selected_levels (int[]): For each user, an index of privacy_levels array which is
+                indicating selected level of privacy for that user.
+            report_limit (int): Number of reports each user can spend its budget on.
+            rng (RandomSource|np.random.Generator): Source of randomness. The shared source is
+                used if it is not given.
+            height (int): If given, difference trees have a fixed height, so rounds up to
+                2^(height + 1) - 1 are supported and state arrays never grow.
+            state ({str: ndarray}): Arrays of state_layout which keep the state of users, e.g.
+                views of memory mapped files. The arrays are updated in place. New arrays are
+                allocated if it is not given.
+        """
+        self.M = M
+        if isinstance(rng, np.random.Generator):
+            rng = RandomSource(rng)
+        self.rng = rng or default_source()
+        self.privacy_levels = PrivacyLevels.of(privacy_levels)
+        self.selected_levels = np.asarray(selected_levels, dtype=np.int64)
+        self.N = len(self.selected_levels)
+        # Selected epsilon of each user based on selected level.
+        self.epsilon = self.privacy_levels.epsilon[self.selected_levels]
+        # The global epsilon which determines how many reports each user can participate in.
+        self.global_eps = report_limit * self.epsilon
+        # Thresholds of reporting 1 for nodes with value -1, 0 and 1 at each level.
+        self.thresholds = self.privacy_levels.set_to_one_thresholds
+        if state is None:
+            state = self.new_state(self.N, M, height or 0)
+        self.height = state['R'].shape[2] - 1 if height is not None else None
+        # Key nodes of difference trees of each (user, bit): R[i, m, j] is the j'th node.
+        self.R = state['R']
+        # Keep track of time and number of reports. All users report in every round.
+        self.t = 0
+        # The root level of last difference tree.
+        self.a_m_t = 0
+        # Keep the previous bits of users to compute the difference.
+        self.previous_value = state['previous_value']
+        # Keep the previous value of users to count changes of multi-value data.
+        self.prev_value = state['prev_value']
+        # Stores number of changes in data for each user.
+        self.changes = state['changes']
+        # Stores number of changes in data for each (user, bit).
+        self.bit_changes = state['bit_changes']
+        # Stores how many times each (user, bit) has consumed budget.
+        self.count = state['count']
+        # Consumed budget of each user.
+        self.budget_usage = state['budget_usage']
+        # True if budget of user is exhausted in parallel composition.
+        self.budget_consumed = state['budget_consumed']
+        # Determines if budget is used in last report or not.
+        self.budget_used = state['budget_used']
+
+    @staticmethod
+    def state_layout(M, height):
+        """Describes arrays which keep the state of users.
+
+        Args:
+            M (int): Number of bits of data.
+            height (int): Height of difference trees.
+
+        Returns:
+            {str: (dtype, tuple)}: The dtype and shape of each array after the axis of users.
+        """
+        return {'R': (np.int32, (M, height + 1)), 'previous_value': (np.int8, (M,)),
+                'prev_value': (np.int64, ()), 'changes': (np.int64, ()),
+                'bit_changes': (np.int64, (M,)), 'count': (np.int64, (M,)),
+                'budget_usage': (np.float64, ()), 'budget_consumed': (bool, ()),
+                'budget_used': (bool, ())}
+
+    @classmethod
+    def new_state(cls, N, M, height):
+        """Allocates the state of users who have not reported yet.
+
+        Args:
+            N (int): Number of users.
+            M (int): Number of bits of data.
+            height (int): Height of difference trees.
+
+        Returns:
+            {str: ndarray}: Arrays of state_layout.
+        """
+        state = {name: np.zeros((N,) + shape, dtype=dtype)
+                 for name, (dtype, shape) in cls.state_layout(M, height).items()}
+        state['prev_value'][:] = -1
+        return state
+
+    def decompose(self, values):
+        """Break the values down to their bits, most significant bit first.
+
+        Args:
+            values (int[]): The value of each user.
+
+        Returns:
+            int8[][]: An N * M matrix of bits.
+        """
+        shifts = np.arange(self.M - 1, -1, -1, dtype=np.int64)
+        return ((values[:, np.newaxis] >> shifts) & 1).astype(np.int8)
+
+    def new_value(self, bits):
+        """Get the new bits of users and calculate new R arrays and a_mt.
+        Also it updates previous values.
+
+        Args:
+            bits (int8[][]): The N * M matrix of new bits.
+        """
+        self.t = self.t + 1
+        a_1, self.a_m_t = SCHEDULE[self.t]
+        if self.R.shape[2] < a_1 + 1:
+            if self.height is not None:
+                raise ValueError(f'Error! Round {self.t} needs difference trees of height {a_1}')
+            grown = np.zeros([self.N, self.M, a_1 + 1], dtype=self.R.dtype)
+            grown[:, :, :self.R.shape[2]] = self.R
+            self.R = grown
+        delta = bits.astype(np.int32) - self.previous_value
+        # R[j] = R[0] + ... + R[j - 1] + v - previous_value for j <= a_m_t
+        if self.a_m_t > 0:
+            prefix = np.cumsum(self.R[:, :, :self.a_m_t], axis=2)
+            self.R[:, :, 1:self.a_m_t + 1] = prefix + delta[:, :, np.newaxis]
+        self.R[:, :, 0] = delta
+        self.bit_changes += bits != self.previous_value
+        self.previous_value[:] = bits
+
+    def select(self):
+        """This is node selection strategy.
+            Each (user, bit) reports either root of associated difference tree or the leaf node.
+
+        Returns:
+            [int32[][], uint8[][]]: The values of selected nodes and their levels.
+        """
+        root = self.rng.bits([self.N, self.M])
+        values = np.where(root, self.R[:, :, self.a_m_t], self.R[:, :, 0])
+        heights = np.where(root, self.a_m_t, 0).astype(np.uint8)
+        return [values, heights]
+
+    def perturbation(self, values):
+        """The perturbation mechanism which is applied on all selected nodes.
+
+        Args:
+            values (int32[][]): The values of selected nodes which are -1, 0 or 1 since
+                they are differences of bits.
+
+        Returns:
+            int8[][]: Either 1 or -1 for each (user, bit).
+        """
+        rand = self.rng.words([self.N, self.M])
+        active = (values != 0) & (self.epsilon != 0)[:, np.newaxis]
+        threshold = self.thresholds[self.selected_levels[:, np.newaxis], values + 1]
+        self.count += active
+        self.budget_used[:] = active.any(axis=1)
+        return np.where(rand < threshold, 1, -1).astype(np.int8)
+
+    def report(self, values):
+        """Report the current value of every user.
+
+        Args:
+            values (int[]): The value of each user which is considered an integer here.
+
+        Returns:
+            [int8[][], uint8[][]]: Returns 2 N * M matrices where first one is representing
+                each reported bit and second one contains the height of each reported bit.
+        """
+        values = np.asarray(values, dtype=np.int64)
+        if values.shape != (self.N,):
+            raise ValueError(f'Error! Expected {self.N} values but got shape {values.shape}')
+        self.changes += values != self.prev_value
+        self.prev_value[:] = values
+        self.new_value(self.decompose(values))
+        [selected, heights] = self.select()
+        v = self.perturbation(selected)
+        self.budget_usage += np.where(self.budget_used, self.epsilon, 0)
+        self.budget_consumed |= self.budget_used & (self.budget_usage >= self.global_eps)
+        return [v, heights]
+
+    def how_many_changes(self):
+        """Returns number of changes in values of each user.
+
+        Returns:
+            int[]: Number of changes till now.
+        """
+        return self.changes
+
+    def budget_consumption(self):
+        """Returns the consumed budget of each user.
+
+        Returns:
+            float[]: The consumed budget till now.
+        """
+        return self.budget_usage
@@ -0,0 +1,196 @@
+"""Client population of Privacy Flow framework whose state is kept in memory mapped files,
+    so populations which do not fit in RAM can be simulated and resumed from disk.
+"""
+import json
+import os
+import numpy as np
+from client_population import ClientPopulation
+from randomness import default_source
+
+# Name of the file which keeps configuration and progress of the population.
+META_FILE = 'population.json'
+
+
+class MappedClientPopulation:
+    """Population of clients where each array of ClientPopulation.state_layout is a .npy file
+        of a directory which is opened with np.memmap. Each round is processed in chunks of
+        users, so only the state of a single chunk is resident at once. Difference trees have
+        a fixed height which is derived from the number of rounds.
+    """
+
+    def __init__(self, directory, M=None, privacy_levels=None, selected_levels=None,
+                 report_limit=None, rounds=None, chunk_size=None, rng=None):
+        """Create a new population in directory or open the population which is there if only
+            directory is given.
+
+        Args:
+            directory (str): Directory of the state files.
+            M (int): Number of bits of data.
+            privacy_levels (float[]): An array of all levels of privacy.
+            selected_levels (int[]): For each user, an index of privacy_levels array which is
+                indicating selected level of privacy for that user.
+            report_limit (int): Number of reports each user can spend its budget on.
+            rounds (int): Number of rounds which should be supported.
+            chunk_size (int): Number of users who are processed at once. It is 65536 for a new
+                population and the saved one for an opened population if it is not given.
+                Since chunks draw randomness in turn, the same chunk size reproduces the
+                same reports.
+            rng (RandomSource): Source of randomness. When a population is opened, the state
+                of randomness which is saved with it is restored into this source.
+        """
+        self.directory = directory
+        self.rng = rng or default_source()
+        path = os.path.join(directory, META_FILE)
+        if M is None:
+            with open(path) as file:
+                self.meta = json.load(file)
+            mode = 'r+'
+        else:
+            if os.path.exists(path):
+                raise ValueError(f'Error! {directory} already contains a population')
+            os.makedirs(directory, exist_ok=True)
+            height = max(int(rounds).bit_length() - 1, 0)
+            self.meta = {'M': M, 'privacy_levels': list(privacy_levels), 'N': len(selected_levels),
+                         'report_limit': report_limit, 'height': height, 't': 0,
+                         'chunk_size': chunk_size or 65536}
+            mode = 'w+'
+        self.chunk_size = chunk_size or self.meta['chunk_size']
+        self.M = self.meta['M']
+        self.N = self.meta['N']
+        self.privacy_levels = self.meta['privacy_levels']
+        self.report_limit = self.meta['report_limit']
+        self.height = self.meta['height']
+        # Number of rounds which are reported.
+        self.t = self.meta['t']
+        # Selected level of each user.
+        self.selected_levels = self.open('selected_levels', np.int64, (), mode)
+        # Memory mapped state of users.
+        self.state = {name: self.open(name, dtype, shape, mode)
+                      for name, (dtype, shape)
+                      in ClientPopulation.state_layout(self.M, self.height).items()}
+        if mode == 'w+':
+            self.selected_levels[:] = selected_levels
+            self.state['prev_value'][:] = -1
+            self.flush()
+        elif 'random' in self.meta:
+            self.rng.set_state(self.load_random())
+
+    def open(self, name, dtype, shape, mode):
+        """Opens the memory map of a state array.
+
+        Args:
+            name (str): Name of the array.
+            dtype (type): Type of elements.
+            shape (tuple): Shape of the array after the axis of users.
+            mode (str): 'w+' to create the file and 'r+' to open it.
+
+        Returns:
+            np.memmap: The array.
+        """
+        path = os.path.join(self.directory, f'{name}.npy')
+        if mode == 'w+':
+            return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(self.N,) + shape)
+        return np.lib.format.open_memmap(path, mode='r+')
+
+    def load_random(self):
+        """Reads the state of randomness which is saved by flush.
+
+        Returns:
+            {str: object}: State of RandomSource.
+        """
+        with np.load(os.path.join(self.directory, 'random.npz')) as words:
+            return {'generator': self.meta['random'], 'block': words['block'],
+                    'scalars': words['scalars']}
+
+    def chunks(self):
+        """Ranges of users of each chunk.
+
+        Returns:
+            [(int, int)]: Start and stop of each chunk.
+        """
+        return [(start, min(start + self.chunk_size, self.N))
+                for start in range(0, self.N, self.chunk_size)]
+
+    def chunk(self, start, stop):
+        """Creates a population of a chunk whose state is a view of the mapped state.
+
+        Args:
+            start (int): The first user of chunk.
+            stop (int): The user after the last one.
+
+        Returns:
+            ClientPopulation: Population of the chunk.
+        """
+        population = ClientPopulation(
+            self.M, self.privacy_levels, self.selected_levels[start:stop], self.report_limit,
+            self.rng, self.height, {name: array[start:stop] for name, array in self.state.items()})
+        population.t = self.t
+        return population
+
+    def report_chunks(self, values):
+        """Report the current value of every user chunk by chunk.
+
+        Args:
+            values (int[]): The value of each user.
+
+        Yields:
+            (int, int, int8[][], uint8[][]): Range of users of the chunk and their reported
+                bits and heights.
+        """
+        values = np.asarray(values)
+        if values.shape != (self.N,):
+            raise ValueError(f'Error! Expected {self.N} values but got shape {values.shape}')
+        for start, stop in self.chunks():
+            v, h = self.chunk(start, stop).report(values[start:stop])
+            yield start, stop, v, h
+        self.t += 1
+        self.flush()
+
+    def report(self, values):
+        """Report the current value of every user.
+
+        Args:
+            values (int[]): The value of each user.
+
+        Returns:
+            [int8[][], uint8[][]]: Reported bits and heights of all users like
+                ClientPopulation.report.
+        """
+        v = np.empty([self.N, self.M], dtype=np.int8)
+        h = np.empty([self.N, self.M], dtype=np.uint8)
+        for start, stop, chunk_v, chunk_h in self.report_chunks(values):
+            v[start:stop] = chunk_v
+            h[start:stop] = chunk_h
+        return [v, h]
+
+    def flush(self):
+        """Writes the state to disk, so the population can be opened after this round.
+        """
+        for array in self.state.values():
+            array.flush()
+        self.selected_levels.flush()
+        random = self.rng.get_state()
+        np.savez(os.path.join(self.directory, 'random.npz'), block=random['block'],
+                 scalars=random['scalars'])
+        self.meta['t'] = self.t
+        self.meta['random'] = random['generator']
+        path = os.path.join(self.directory, META_FILE)
+        with open(f'{path}.tmp', 'w') as file:
+            json.dump(self.meta, file)
+        os.replace(f'{path}.tmp', path)
+
+    def how_many_changes(self):
+        """Returns number of changes in values of each user.
+
+        Returns:
+            int[]: Number of changes till now.
+        """
+        return np.asarray(self.state['changes'])
+
+    def budget_consumption(self):
+        """Returns the consumed budget of each user.
+
+        Returns:
+            float[]: The consumed budget till now.
+        """
+        return np.asarray(self.state['budget_usage'])
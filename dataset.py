@@ -0,0 +1,96 @@
+"""Loader of datasets of Privacy Flow tests.
+    A dataset is a CSV file with a header row where each row belongs to a user and each
+    column belongs to a round. It is parsed once and cached as a .npy file of shape
+    (rounds, users) with the smallest integer dtype which holds its values, so every later
+    load is a read-only memory map which is shared by all processes which open it.
+"""
+import hashlib
+import os
+import numpy as np
+
+# Directory of datasets.
+DATASET_DIRECTORY = './hpcDatasets'
+# Directory of cached datasets inside the dataset directory.
+CACHE_DIRECTORY = '.cache'
+
+
+def file_hash(path, block_size=1 << 20):
+    """Computes hash of content of a file.
+
+    Args:
+        path (str): Path of the file.
+        block_size (int): Number of bytes which are read at once.
+
+    Returns:
+        str: Hexadecimal SHA-256 of the file.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def convert(csv_path, cache_path):
+    """Parses a CSV dataset and writes it as a .npy file of shape (rounds, users).
+
+    Args:
+        csv_path (str): Path of the CSV file.
+        cache_path (str): Path of the .npy file.
+    """
+    values = np.loadtxt(csv_path, delimiter=',', skiprows=1, dtype=np.int64, ndmin=2)
+    dtype = np.result_type(np.min_scalar_type(values.min(initial=0)),
+                           np.min_scalar_type(values.max(initial=0)))
+    # Each process writes its own file and the last one replaces the cache atomically.
+    temporary = f'{cache_path}.{os.getpid()}.tmp.npy'
+    np.save(temporary, np.ascontiguousarray(values.T, dtype=dtype))
+    os.replace(temporary, cache_path)
+
+
+def load(name, directory=DATASET_DIRECTORY):
+    """Opens a dataset and converts it to its cached format if it is not converted before.
+
+    Args:
+        name (str): Name of the dataset which is `{name}.csv` in directory.
+        directory (str): Directory of datasets.
+
+    Returns:
+        np.memmap: Read-only matrix of shape (rounds, users).
+    """
+    csv_path = os.path.join(directory, f'{name}.csv')
+    cache_directory = os.path.join(directory, CACHE_DIRECTORY)
+    cache_path = os.path.join(cache_directory, f'{name}.{file_hash(csv_path)[:16]}.npy')
+    if not os.path.exists(cache_path):
+        os.makedirs(cache_directory, exist_ok=True)
+        convert(csv_path, cache_path)
+    return np.load(cache_path, mmap_mode='r')
+
+
+def rounds(data, N=None):
+    """Yields values of users at each round.
+
+    Args:
+        data (int[][]): Dataset of shape (rounds, users).
+        N (int): Number of users to take from the beginning of each round. All users are
+            taken if it is not given.
+
+    Yields:
+        int[]: Values of users at a round which is a view of the dataset.
+    """
+    for values in data:
+        yield values[:N]
+
+
+def chunks(values, chunk_size):
+    """Yields values of a round in chunks of users.
+
+    Args:
+        values (int[]): Values of users at a round.
+        chunk_size (int): Number of users of each chunk.
+
+    Yields:
+        (int, int, int[]): Range of users of the chunk and their values.
+    """
+    for start in range(0, len(values), chunk_size):
+        stop = min(start + chunk_size, len(values))
+        yield start, stop, values[start:stop]
@@ -0,0 +1,65 @@
+"""Evaluation of estimations of Privacy Flow tests against the ground truth of datasets.
+    Everything is computed over the whole (rounds, levels, bits) tensor of estimations at
+    once, where bits are ordered from the most significant one like reports of clients.
+"""
+import numpy as np
+
+
+def bit_frequencies(data, M):
+    """Computes the frequency of 1 at each bit of values of users.
+
+    Args:
+        data (int[][]): Values of shape (rounds, users).
+        M (int): Number of bits of values.
+
+    Returns:
+        float[][]: Frequencies of shape (rounds, M).
+    """
+    data = np.asarray(data)
+    frequencies = np.empty([data.shape[0], M])
+    for bit in range(M):
+        frequencies[:, bit] = np.count_nonzero((data >> (M - 1 - bit)) & 1, axis=1)
+    return frequencies / data.shape[1]
+
+
+def estimated_means(estimations):
+    """Reconstructs the mean of values from estimated frequency of their bits.
+
+    Args:
+        estimations (float[][][]): Estimations of shape (rounds, levels, M).
+
+    Returns:
+        float[][]: Means of shape (rounds, levels).
+    """
+    estimations = np.asarray(estimations, dtype=np.float64)
+    M = estimations.shape[-1]
+    return estimations @ (2.0 ** np.arange(M - 1, -1, -1))
+
+
+def evaluate(estimations, data):
+    """Computes errors of estimations of every level at every round.
+
+    Args:
+        estimations (float[][][]): Estimations of shape (rounds, levels, M).
+        data (int[][]): Values of users of shape (rounds, users).
+
+    Returns:
+        {str: float[][]}: Matrices of shape (levels, rounds) of mean squared error (MSE) and
+            mean absolute error (MAE) of bit frequencies, absolute error of reconstructed
+            mean (ME), along with true frequencies (truth), true means (mean) and
+            reconstructed means (estimatedMean).
+    """
+    estimations = np.asarray(estimations, dtype=np.float64)
+    data = np.asarray(data)
+    truth = bit_frequencies(data, estimations.shape[-1])
+    difference = estimations - truth[:, np.newaxis, :]
+    mean = np.mean(data, axis=1)
+    estimated_mean = estimated_means(estimations)
+    return {
+        'MSE': np.mean(difference ** 2, axis=2).T,
+        'MAE': np.mean(np.abs(difference), axis=2).T,
+        'ME': np.abs(estimated_mean - mean[:, np.newaxis]).T,
+        'truth': truth,
+        'mean': mean,
+        'estimatedMean': estimated_mean,
+    }
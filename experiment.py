@@ -0,0 +1,137 @@
+"""Runs independent repetitions of an experiment on a pool of processes and aggregates
+    their metrics while they finish.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+
+class StreamingStats:
+    """Running mean, variance, min and max of a metric which can be a scalar or an array.
+        Two aggregators can be merged, so results do not depend on the order in which
+        repetitions finish (up to floating point rounding).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        # Sum of squared distances from mean.
+        self.m2 = None
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        """Adds a single observation.
+
+        Args:
+            value (float|float[]): The observed metric.
+        """
+        value = np.asarray(value, dtype=np.float64)
+        single = StreamingStats()
+        single.count = 1
+        single.mean = value
+        single.m2 = np.zeros_like(value)
+        single.min = value
+        single.max = value
+        self.merge(single)
+
+    def merge(self, other):
+        """Merges observations of other aggregator into this one.
+
+        Args:
+            other (StreamingStats): Aggregator of the same metric.
+        """
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.min, self.max = other.min, other.max
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.count / count
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * other.count / count
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        self.count = count
+
+    @property
+    def variance(self):
+        """Sample variance of observations."""
+        if self.count < 2:
+            return np.zeros_like(self.mean)
+        return self.m2 / (self.count - 1)
+
+    def summary(self):
+        """Returns the current state of aggregation.
+
+        Returns:
+            {str: object}: count, mean, variance, min and max of observations.
+        """
+        return {'count': self.count, 'mean': self.mean, 'variance': self.variance,
+                'min': self.min, 'max': self.max}
+
+
+class Experiment:
+    """Runs repetitions of an experiment concurrently and merges their metrics.
+    """
+
+    def __init__(self, repetition, repetitions, workers=None, seed=None):
+        """Initialize the experiment.
+
+        Args:
+            repetition (callable): A picklable function which gets an integer seed and returns
+                a dictionary of metrics where each metric is a scalar or an array.
+            repetitions (int): Number of repetitions.
+            workers (int): Number of processes. Defaults to number of cores and with one
+                worker, repetitions run in this process.
+            seed (int): Seed of the experiment which determines seeds of repetitions.
+        """
+        self.repetition = repetition
+        self.repetitions = repetitions
+        self.workers = workers or os.cpu_count()
+        self.seeds = np.random.SeedSequence(seed).generate_state(repetitions).tolist()
+        self.completed = 0
+        self.metrics = {}
+
+    def add(self, result):
+        """Merges metrics of a finished repetition.
+
+        Args:
+            result ({str: object}): Metrics of the repetition.
+        """
+        for name, value in result.items():
+            self.metrics.setdefault(name, StreamingStats()).add(value)
+        self.completed += 1
+
+    def summary(self):
+        """Returns partial or final results.
+
+        Returns:
+            {str: {str: object}}: Summary of each metric.
+        """
+        return {name: stats.summary() for name, stats in self.metrics.items()}
+
+    def run(self, on_progress=None):
+        """Runs all repetitions.
+
+        Args:
+            on_progress (callable): Called with this experiment after each repetition finishes
+                so partial results can be inspected.
+
+        Returns:
+            {str: {str: object}}: Summary of each metric.
+        """
+        if self.workers <= 1:
+            for seed in self.seeds:
+                self.add(self.repetition(seed))
+                if on_progress:
+                    on_progress(self)
+            return self.summary()
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.repetition, seed) for seed in self.seeds]
+            for future in as_completed(futures):
+                self.add(future.result())
+                if on_progress:
+                    on_progress(self)
+        return self.summary()
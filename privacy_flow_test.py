@@ -1,18 +1,18 @@
 """Contains test of Privacy Flow algorithm and result evaluation for it.
 """
-import math
+import os
 import sys
-from sklearn.metrics import mean_squared_error
-from sklearn.metrics import mean_absolute_error
+from functools import partial
 import numpy as np
-import pandas as pd
+import dataset
+import evaluation
 from server.manager import PrivacyFlow
-from WrappedClient import WrappeedClient
+from simulation import ShardedSimulation
+from experiment import Experiment
+from randomness import RandomSource
 from time import time
 from datetime import datetime
 
-print("Script runned with arguments:", sys.argv)
-
 #Overal Algorithm Execution Rounds:
 OAER = 50
 # Number of rounds to run the code:
@@ -20,17 +20,24 @@ ROUND_CHANGES = 20
 # Privacy Budget Levels:
 # levels = [(i+1)/10 for i in range(0, 10)]
 levels = [0.1, 0.3, 0.5, 0.7, 0.9]
-averageMSE = [[0] * ROUND_CHANGES for i in levels]
-averageMAE = [[0] * ROUND_CHANGES for i in levels]
-averageME = [[0] * ROUND_CHANGES for i in levels]
-avgBudget = 0
-maxBudget = 0
-minBudget = 0
-
-for oaer in range(OAER):
-    print(f'Start of round {oaer} at:', datetime.now())
-    # Number of users:
-    N = int(sys.argv[1]) * 1000
+
+
+def run_repetition(seed, N, datasetName, workers=1, verbose=True):
+    """Runs a single repetition of the test and evaluates its results.
+
+    Args:
+        seed (int): Seed of the simulation of clients and the server.
+        N (int): Number of users.
+        datasetName (str): Name of dataset file in hpcDatasets directory.
+        workers (int): Number of processes which simulate clients.
+        verbose (bool): Prints timings and results of each round. Repetitions which run
+            at the same time should not print them since their lines are interleaved.
+
+    Returns:
+        {str: object}: MSE, MAE and ME of each level at each round and budget usage of users.
+    """
+    log = print if verbose else lambda *args: None
+    log(f'Start of repetition with seed {seed} at:', datetime.now())
     # Determines how many different value types are available in dataset: 
     # (Each bit is responsible for a separate value)
     DATA_SET_SIZE = 8
@@ -38,107 +45,104 @@ for oaer in range(OAER):
     # dataSet = [[i for i in np.random.randint(2 ** DATA_SET_SIZE - 1, size=N)]]
     # dataSet = [[math.floor(i) for i in np.random.normal(100, 10, size=N)]]
     # Read dataset from file:
-    csvContent = pd.read_csv(f'./hpcDatasets/{sys.argv[2]}.csv')
-    dataSet = np.transpose(csvContent.to_numpy())
+    dataSet = dataset.load(datasetName)
     # Determine selected privacy level of each client:
     # clientSelectedLevel = np.random.randint(len(levels), size=N)
     clientSelectedLevel = [0] * int(N/len(levels)) + [1] * int(N/len(levels)) + [2] * int(N/len(levels)) + [3] * int(N/len(levels)) + [4] * int(N/len(levels))
+    clientSeed, serverSeed = np.random.SeedSequence(seed).spawn(2)
     # Creates actual clients:
-    clients = [WrappeedClient(DATA_SET_SIZE, levels, clientSelectedLevel[i], ROUND_CHANGES) for i in range(N)]
-    # Initialize Server:
-    server = PrivacyFlow(None, levels, DATA_SET_SIZE)
-    # Prepare to keep results of estimations:
-    estimations = []
-
-    startRoundTime = time()
-    
-    # Start the test
-    for i in range(ROUND_CHANGES):
-        print(f'round {i} started')
-        startTimestamp = time()
-        # Prepare server data:
-        serverData = {i: [] for i in levels}
-        for j in range(N):
-            # Report the data by client:
-            [allV, allH] = clients[j].report(dataSet[i][j])
-            # Gather reports for server:
-            serverData[levels[clientSelectedLevel[j]]].append({
-                'userID': j,
-                'value': {
-                    'v': allV,
-                    'h': allH
-                }
-            })
-
-        endTimestamp = time()
-        print(f'Clients reported at {(endTimestamp-startTimestamp)/60} minutes')
-        startTimestamp = time()
-        # Give the results to the server:
-        server.new_data_set(serverData)
-        # Call this method if you want to get estimation of data:
-        estimations.append([])
-        for l in levels:
-            estimations[i].append(server.estimate(l))
-        # Always call this method when you are going to the next round:
-        server.next_round()
-        endTimestamp = time()
-        print(f'Server estimated at {(endTimestamp-startTimestamp)/60} minutes')
-        startTimestamp = time()
-
-    endRoundTime = time()
-    print(f'Round took {(endRoundTime - startRoundTime) / 60} minutes.')
-    # print(server.finish())
-    # Compute bit frequency of real values:
-    frequencies = []
-    for singleRound in dataSet:
-        bitRepresentationOfDataSet = [bin(i)[2:].zfill(DATA_SET_SIZE) for i in singleRound]
-        numericalBitRepresentationDataSet = [[int(char) for char in list(data)] \
-                                            for data in bitRepresentationOfDataSet]
-        frequencies.append(np.sum(numericalBitRepresentationDataSet, axis=0))
-    normalized = np.array(frequencies) / N
-
-    # Evaluate mean error:
-    for r in range(ROUND_CHANGES):
-        print(f'\n\n\n ========================================== \nResults of Round {r}:\n==========================================')
-        error = []
+    clients = ShardedSimulation(DATA_SET_SIZE, levels, clientSelectedLevel, ROUND_CHANGES,
+                                seed=clientSeed, workers=workers)
+    try:
+        # Initialize Server:
+        server = PrivacyFlow(None, levels, DATA_SET_SIZE, rng=RandomSource(serverSeed))
+        # Prepare to keep results of estimations:
+        estimations = []
+
+        startRoundTime = time()
+
+        # Start the test
+        for i, roundValues in enumerate(dataset.rounds(dataSet[:ROUND_CHANGES], N)):
+            log(f'round {i} started')
+            startTimestamp = time()
+            # Report the data by all clients and gather reports for server:
+            serverData = clients.report(roundValues)
+
+            endTimestamp = time()
+            log(f'Clients reported at {(endTimestamp-startTimestamp)/60} minutes')
+            startTimestamp = time()
+            # Give the results to the server:
+            server.ingest_batch(serverData)
+            # Close the round after its last report to get estimation of data:
+            estimations.append(list(server.close_round()))
+            endTimestamp = time()
+            log(f'Server estimated at {(endTimestamp-startTimestamp)/60} minutes')
+            startTimestamp = time()
+
+        endRoundTime = time()
+        log(f'Round took {(endRoundTime - startRoundTime) / 60} minutes.')
+        # print(server.finish())
+        consumedBudgets = clients.budget_consumption()
+    finally:
+        clients.close()
+    # Evaluate estimations against the values of simulated users:
+    evaluated = evaluation.evaluate(estimations, dataSet[:len(estimations), :N])
+    MSE, MAE, ME = evaluated['MSE'], evaluated['MAE'], evaluated['ME']
+    normalized = evaluated['truth']
+    for r in range(len(estimations)):
+        log(f'\n\n\n ========================================== \nResults of Round {r}:\n==========================================')
         for index, estimation in enumerate(estimations[r]):
-            print(f'Evaluation for level eps = {levels[index]}')
+            log(f'Evaluation for level eps = {levels[index]}')
             for i, _ in enumerate(normalized[r]):  # calculating errors
-                error.append(abs(estimation[i] - normalized[r][i]) * 100)
-                print("index:", i, "-> Estimated:", estimation[i], " Real:", normalized[r][i], " Error: %", int(error[-1]))
-            print("Global Mean Square Error:", mean_squared_error(normalized[r], estimation))
-            print("Global Mean Absolute Error:", mean_absolute_error(normalized[r], estimation))
-            averageMSE[index][r] = (averageMSE[index][r] * oaer + mean_squared_error(normalized[r], estimation))/(oaer+1)
-            averageMAE[index][r] = (averageMAE[index][r] * oaer + mean_absolute_error(normalized[r], estimation))/(oaer+1)
-            
-
-
-    meanOfRounds = np.mean(dataSet, axis=1)
-    print('Real Mean of rounds is:', meanOfRounds)
-    outputMean = []
-    for r in range(ROUND_CHANGES):
-        outputMean.append([])
-        for index, estimationAtL in enumerate(estimations[r]):
-            ROUND_MEAN = 0
-            REAL_ROUND_MEAN = 0
-            for index2, number in enumerate(estimationAtL):
-                ROUND_MEAN += (number*(N) * 2 ** (len(estimationAtL) - 1 - index2))
-                REAL_ROUND_MEAN += (normalized[r][index2]*(N) * 2 ** (len(estimationAtL) - 1 - index2))
-            ROUND_MEAN /= N
-            REAL_ROUND_MEAN /= N
-            print(f'Mean Difference at round {r} and level {levels[index]}:', abs(ROUND_MEAN - meanOfRounds[r]), abs(meanOfRounds[r] - REAL_ROUND_MEAN))
-            averageME[index][r] = (averageME[index][r] * oaer + abs(ROUND_MEAN - meanOfRounds[r]))/(oaer+1)
-            outputMean[r].append(ROUND_MEAN)
-    print("Estimated Mean is:", outputMean)
-    consumedBudgets = [clients[i].budget_consumption() for i in range(N)]
-    avgBudget = (avgBudget * oaer + np.mean(consumedBudgets))/(oaer + 1)
-    maxBudget = (maxBudget * oaer + np.max(consumedBudgets))/(oaer + 1)
-    minBudget = (minBudget * oaer + np.min(consumedBudgets))/(oaer + 1)
-
-print("Results for Averaged MSE:", averageMSE)
-print("Results for Averaged MAE:", averageMAE)
-print("Results for Averaged ME:", averageME)
-
-print("Averaged mean budget usage:", avgBudget)
-print("Averaged max budget usage:", maxBudget)
-print("Averaged min budget usage:", minBudget)
\ No newline at end of file
+                log("index:", i, "-> Estimated:", estimation[i], " Real:", normalized[r][i], " Error: %", int(abs(estimation[i] - normalized[r][i]) * 100))
+            log("Global Mean Square Error:", MSE[index][r])
+            log("Global Mean Absolute Error:", MAE[index][r])
+
+    log('Real Mean of rounds is:', evaluated['mean'])
+    for r in range(len(estimations)):
+        for index in range(len(levels)):
+            log(f'Mean Difference at round {r} and level {levels[index]}:', ME[index][r])
+    log("Estimated Mean is:", evaluated['estimatedMean'].tolist())
+    return {
+        'MSE': MSE,
+        'MAE': MAE,
+        'ME': ME,
+        'meanBudget': np.mean(consumedBudgets),
+        'maxBudget': np.max(consumedBudgets),
+        'minBudget': np.min(consumedBudgets),
+    }
+
+
+def report_progress(experiment):
+    """Prints partial results of the experiment.
+
+    Args:
+        experiment (Experiment): The running experiment.
+    """
+    summary = experiment.summary()
+    print(f'{experiment.completed}/{experiment.repetitions} repetitions finished at:',
+          datetime.now())
+    print("Partial averaged MSE of each level:", np.mean(summary['MSE']['mean'], axis=1).tolist())
+
+
+if __name__ == '__main__':
+    print("Script runned with arguments:", sys.argv)
+    # Number of processes which simulate clients of each repetition:
+    WORKERS = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    # Number of repetitions which run at the same time:
+    PARALLEL_REPETITIONS = int(sys.argv[4]) if len(sys.argv) > 4 else None
+    # Results of each round are only printed if repetitions run one after another:
+    VERBOSE = (PARALLEL_REPETITIONS or os.cpu_count()) <= 1
+    experiment = Experiment(partial(run_repetition, N=int(sys.argv[1]) * 1000,
+                                    datasetName=sys.argv[2], workers=WORKERS,
+                                    verbose=VERBOSE),
+                            OAER, workers=PARALLEL_REPETITIONS)
+    results = experiment.run(on_progress=report_progress)
+
+    print("Results for Averaged MSE:", results['MSE']['mean'].tolist())
+    print("Results for Averaged MAE:", results['MAE']['mean'].tolist())
+    print("Results for Averaged ME:", results['ME']['mean'].tolist())
+
+    print("Averaged mean budget usage:", results['meanBudget']['mean'])
+    print("Averaged max budget usage:", results['maxBudget']['mean'])
+    print("Averaged min budget usage:", results['minBudget']['mean'])
@@ -0,0 +1,112 @@
+"""Registry of privacy levels of Privacy Flow framework which precomputes level-dependent
+    constants of clients, estimators, replicators and combiners.
+"""
+import numpy as np
+from randomness import RandomSource
+
+
+class PrivacyLevels:
+    """Sorted list of privacy levels along with constants of each level.
+        It behaves like the list of levels (indexing, iteration, len and index), but index
+        is a dictionary lookup.
+    """
+
+    # Registries which are already built, keyed by tuple of levels.
+    _registries = {}
+
+    def __init__(self, levels):
+        """Build the registry.
+
+        Args:
+            levels (float[]): The sorted array of privacy budgets.
+        """
+        levels = list(levels)
+        if levels != sorted(levels):
+            raise ValueError('Error! Level array should be sorted in order\
+                 to consider a mapping between each level and its position.')
+        self.levels = levels
+        self.index_of = {lvl: index for index, lvl in enumerate(levels)}
+        self.epsilon = np.array(levels, dtype=np.float64)
+        exp = np.exp(self.epsilon)
+        # Randomized response bias of clients: (e^eps - 1) / (e^eps + 1)
+        self.bias = (exp - 1) / (exp + 1)
+        # Calibration coefficient of reports: (e^eps + 1) / (e^eps - 1)
+        self.coefficient = (exp + 1) / (exp - 1)
+        self.coefficient_squared = self.coefficient ** 2
+        # Thresholds of reporting 1 for nodes with value -1, 0 and 1 at each level.
+        self.set_to_one_thresholds = RandomSource.thresholds(
+            0.5 + np.outer(self.bias, [-0.5, 0, 0.5]))
+        # q value of DR algorithm: (e^(eps/2) - 1) / (e^(eps/2) + 1)
+        half_exp = np.exp(self.epsilon / 2)
+        self.q = (half_exp - 1) / (half_exp + 1)
+        # Denominator of noise term of AC weights: e^(eps/2) + e^(-eps/2) - 2
+        self.ac_noise = half_exp + 1 / half_exp - 2
+
+    @classmethod
+    def of(cls, levels):
+        """Returns the shared registry of given levels.
+
+        Args:
+            levels (float[]|PrivacyLevels): The sorted array of privacy budgets.
+
+        Returns:
+            PrivacyLevels: The registry which is built once for each list of levels.
+        """
+        if isinstance(levels, PrivacyLevels):
+            return levels
+        key = tuple(levels)
+        if key not in cls._registries:
+            cls._registries[key] = cls(key)
+        return cls._registries[key]
+
+    def index(self, level):
+        """Finds position of a level.
+
+        Args:
+            level (float): The privacy budget.
+
+        Returns:
+            int: Index of the level.
+        """
+        if level not in self.index_of:
+            raise ValueError(f'{level} is not a privacy level')
+        return self.index_of[level]
+
+    def indices(self, levels):
+        """Finds positions of many levels at once.
+
+        Args:
+            levels (float[]): The privacy budgets.
+
+        Returns:
+            int64[]: Index of each level.
+        """
+        levels = np.asarray(levels, dtype=np.float64)
+        indices = np.minimum(np.searchsorted(self.epsilon, levels), len(self.levels) - 1)
+        if np.any(self.epsilon[indices] != levels):
+            unknown = levels[self.epsilon[indices] != levels]
+            raise ValueError(f'{unknown[0]} is not a privacy level')
+        return indices.astype(np.int64)
+
+    def __contains__(self, level):
+        return level in self.index_of
+
+    def __getitem__(self, index):
+        return self.levels[index]
+
+    def __iter__(self):
+        return iter(self.levels)
+
+    def __len__(self):
+        return len(self.levels)
+
+    def __eq__(self, other):
+        if isinstance(other, (PrivacyLevels, list, tuple)):
+            return self.levels == list(other)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(tuple(self.levels))
+
+    def __repr__(self):
+        return f'PrivacyLevels({self.levels})'
@@ -0,0 +1,169 @@
+"""Source of randomness which is shared by clients, replicators and samplers of Privacy Flow.
+"""
+import math
+import numpy as np
+
+# Number of distinct random words:
+WORD_RANGE = 1 << 32
+
+
+class RandomSource:
+    """Hands out random words and bits from blocks which are pre-generated by a
+        np.random.Generator, so small draws do not pay the overhead of a generator call.
+        A uniform draw u is represented by a 32 bit word w = floor(u * 2^32), so the event
+        u < p is tested as w < threshold(p) without any float computation per draw.
+    """
+
+    def __init__(self, seed=None, block_size=1 << 16):
+        """Initialize the source.
+
+        Args:
+            seed (int|np.random.SeedSequence|np.random.Generator): Seed of the source or a
+                generator to draw from.
+            block_size (int): Number of words generated at once.
+        """
+        if isinstance(seed, np.random.Generator):
+            self.generator = seed
+        else:
+            self.generator = np.random.default_rng(seed)
+        self.block_size = block_size
+        # Pre-generated words for array draws and the position of the first unused one.
+        self.block = np.zeros(0, dtype=np.uint32)
+        self.position = 0
+        # Pre-generated words for scalar draws.
+        self.scalars = []
+
+    @staticmethod
+    def threshold(p):
+        """Converts a probability to a threshold for random words.
+
+        Args:
+            p (float): Probability of the event.
+
+        Returns:
+            int: Threshold t where w < t happens with probability p (rounded to 2^-32).
+        """
+        return min(max(math.ceil(p * WORD_RANGE), 0), WORD_RANGE)
+
+    @staticmethod
+    def thresholds(p):
+        """Converts an array of probabilities to thresholds for random words.
+
+        Args:
+            p (float[]): Probabilities of events.
+
+        Returns:
+            int64[]: Thresholds of events.
+        """
+        return np.clip(np.ceil(np.asarray(p) * WORD_RANGE), 0, WORD_RANGE).astype(np.int64)
+
+    def words(self, shape):
+        """Draws random 32 bit words.
+
+        Args:
+            shape (int|tuple): Shape of the result.
+
+        Returns:
+            uint32[]: Random words.
+        """
+        size = int(np.prod(shape))
+        if size > self.block_size:
+            return self.generator.integers(0, WORD_RANGE, size=shape, dtype=np.uint32)
+        if self.position + size > len(self.block):
+            self.block = self.generator.integers(0, WORD_RANGE, size=self.block_size,
+                                                 dtype=np.uint32)
+            self.position = 0
+        result = self.block[self.position:self.position + size]
+        self.position += size
+        return result.reshape(shape)
+
+    def bits(self, shape):
+        """Draws random bits.
+
+        Args:
+            shape (int|tuple): Shape of the result.
+
+        Returns:
+            bool[]: Random bits.
+        """
+        size = int(np.prod(shape))
+        words = self.words(-(-size // 32))
+        bits = np.unpackbits(words.view(np.uint8))[:size]
+        return bits.reshape(shape).astype(bool)
+
+    def word(self):
+        """Draws a single random word.
+
+        Returns:
+            int: A random word.
+        """
+        if not self.scalars:
+            self.scalars = self.generator.integers(0, WORD_RANGE, size=self.block_size,
+                                                   dtype=np.uint32).tolist()
+        return self.scalars.pop()
+
+    def bit(self):
+        """Draws a single random bit.
+
+        Returns:
+            int: Either 0 or 1.
+        """
+        return self.word() >> 31
+
+    def permutation(self, n):
+        """Draws a random permutation.
+
+        Args:
+            n (int): Number of elements.
+
+        Returns:
+            int[]: A permutation of range(n).
+        """
+        return self.generator.permutation(n)
+
+    def get_state(self):
+        """Returns state of the source which continues the same stream when restored.
+
+        Returns:
+            {str: object}: State of the generator and words which are not used yet.
+        """
+        return {'generator': self.generator.bit_generator.state,
+                'block': self.block[self.position:].copy(),
+                'scalars': np.array(self.scalars, dtype=np.uint32)}
+
+    def set_state(self, state):
+        """Restores a state which is returned by get_state.
+
+        Args:
+            state ({str: object}): The state.
+        """
+        self.generator.bit_generator.state = state['generator']
+        self.block = np.array(state['block'], dtype=np.uint32)
+        self.position = 0
+        self.scalars = np.asarray(state['scalars']).tolist()
+
+
+# The source which is used when no source is given.
+_default_source = None
+
+
+def default_source():
+    """Returns the shared source of randomness.
+
+    Returns:
+        RandomSource: The shared source.
+    """
+    global _default_source
+    if _default_source is None:
+        _default_source = RandomSource()
+    return _default_source
+
+
+def seed(value):
+    """Reset the shared source of randomness with given seed.
+
+    Args:
+        value (int): The seed.
+    """
+    global _default_source
+    _default_source = RandomSource(value)
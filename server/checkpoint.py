@@ -0,0 +1,192 @@
+"""This module implements the binary format of checkpoints of server state.
+    A checkpoint is a single file which starts with a magic number and the length of a JSON
+    header followed by the header and raw data of arrays. The header keeps scalar values
+    of the state and dtype, shape and offset of each array, so arrays can be memory mapped
+    on load instead of being parsed.
+"""
+import io
+import json
+import os
+import struct
+import numpy as np
+
+# Magic number of checkpoint files which also denotes the version of the format.
+MAGIC = b'PFLOWCK1'
+FORMAT_VERSION = 1
+# Arrays start at multiples of this many bytes.
+ALIGNMENT = 64
+
+
+def aligned(offset):
+    """Rounds an offset up to the next multiple of ALIGNMENT.
+
+    Args:
+        offset (int): The offset in bytes.
+
+    Returns:
+        int: The aligned offset.
+    """
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def with_prefix(prefix, state):
+    """Puts keys of a component state under a prefix.
+
+    Args:
+        prefix (str): Name of the component.
+        state ({str: object}): State of the component.
+
+    Returns:
+        {str: object}: The same state with keys `prefix.key`.
+    """
+    return {f'{prefix}.{key}': value for key, value in state.items()}
+
+
+def strip_prefix(prefix, state):
+    """Selects state of a component which is saved with with_prefix.
+
+    Args:
+        prefix (str): Name of the component.
+        state ({str: object}): The whole state.
+
+    Returns:
+        {str: object}: State of the component with its own keys.
+    """
+    start = len(prefix) + 1
+    return {key[start:]: value for key, value in state.items() if key.startswith(prefix + '.')}
+
+
+def write(file, state):
+    """Writes a state in checkpoint format to the beginning of a binary file.
+
+    Args:
+        file (file): A seekable binary file.
+        state ({str: object}): Flat state where each value is either a numpy array or a value
+            which can be encoded as JSON.
+    """
+    header = {'version': FORMAT_VERSION, 'values': {}, 'arrays': {}}
+    arrays = []
+    offset = 0
+    for key, value in state.items():
+        if isinstance(value, np.ndarray):
+            # ascontiguousarray turns scalars into arrays of one element.
+            value = np.ascontiguousarray(value).reshape(value.shape)
+            offset = aligned(offset)
+            header['arrays'][key] = {'dtype': value.dtype.str, 'shape': list(value.shape),
+                                     'offset': offset}
+            arrays.append((offset, value))
+            offset += value.nbytes
+        else:
+            header['values'][key] = value
+    encoded = json.dumps(header).encode()
+    start = aligned(len(MAGIC) + 8 + len(encoded))
+    end = start + offset
+    file.write(MAGIC + struct.pack('<Q', len(encoded)) + encoded)
+    for array_offset, value in arrays:
+        file.seek(start + array_offset)
+        file.write(value.tobytes())
+    file.truncate(end)
+
+
+def save(path, state):
+    """Writes a state to a checkpoint file. The file is written next to path and then moved
+        to path, so an interrupted save never leaves a broken checkpoint.
+
+    Args:
+        path (str): Path of the checkpoint.
+        state ({str: object}): Flat state where each value is either a numpy array or a value
+            which can be encoded as JSON.
+    """
+    temporary = f'{path}.tmp'
+    with open(temporary, 'wb') as file:
+        write(file, state)
+    os.replace(temporary, path)
+
+
+def dumps(state):
+    """Encodes a state in checkpoint format.
+
+    Args:
+        state ({str: object}): Flat state like the one of save.
+
+    Returns:
+        bytes: The encoded state.
+    """
+    buffer = io.BytesIO()
+    write(buffer, state)
+    return buffer.getvalue()
+
+
+def read_header(prefix, name):
+    """Decodes the header of a checkpoint.
+
+    Args:
+        prefix (bytes): The beginning of checkpoint which contains at least its header.
+        name (str): Name of the checkpoint in errors.
+
+    Returns:
+        ({str: object}, int): The header and the offset where arrays start.
+    """
+    if prefix[:len(MAGIC)] != MAGIC:
+        raise ValueError(f'Error! {name} is not a checkpoint of Privacy Flow')
+    length, = struct.unpack_from('<Q', prefix, len(MAGIC))
+    header = json.loads(bytes(prefix[len(MAGIC) + 8:len(MAGIC) + 8 + length]))
+    if header['version'] != FORMAT_VERSION:
+        raise ValueError(f'Error! Version {header["version"]} of checkpoints is not supported')
+    return header, aligned(len(MAGIC) + 8 + length)
+
+
+def load(path, mmap=True):
+    """Reads a state from a checkpoint file.
+
+    Args:
+        path (str): Path of the checkpoint.
+        mmap (bool): If true, arrays are copy-on-write memory maps of the file, so they are
+            read on demand and changing them does not change the file.
+
+    Returns:
+        {str: object}: The state which is saved.
+    """
+    with open(path, 'rb') as file:
+        prefix = file.read(len(MAGIC) + 8)
+        if len(prefix) < len(MAGIC) + 8 or prefix[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'Error! {path} is not a checkpoint of Privacy Flow')
+        length, = struct.unpack_from('<Q', prefix, len(MAGIC))
+        header, start = read_header(prefix + file.read(length), path)
+        state = dict(header['values'])
+        for key, info in header['arrays'].items():
+            dtype = np.dtype(info['dtype'])
+            shape = tuple(info['shape'])
+            count = int(np.prod(shape))
+            if count == 0:
+                state[key] = np.zeros(shape, dtype=dtype)
+            elif mmap:
+                # np.memmap maps scalars as arrays of one element.
+                state[key] = np.memmap(path, dtype=dtype, mode='c', offset=start + info['offset'],
+                                       shape=shape or (1,)).reshape(shape)
+            else:
+                file.seek(start + info['offset'])
+                state[key] = np.fromfile(file, dtype=dtype, count=count).reshape(shape)
+    return state
+
+
+def loads(buffer):
+    """Decodes a state which is encoded by dumps. Arrays are read-only views of buffer.
+
+    Args:
+        buffer (bytes): The encoded state.
+
+    Returns:
+        {str: object}: The state.
+    """
+    header, start = read_header(buffer, 'buffer')
+    state = dict(header['values'])
+    for key, info in header['arrays'].items():
+        dtype = np.dtype(info['dtype'])
+        shape = tuple(info['shape'])
+        count = int(np.prod(shape))
+        if count == 0:
+            state[key] = np.zeros(shape, dtype=dtype)
+        else:
+            state[key] = np.frombuffer(buffer, dtype, count, start + info['offset']).reshape(shape)
+    return state
@@ -1,8 +1,9 @@
 """
     Implements Advanced Combination (AC) Algorithms
 """
-import math
 import numpy as np
+from privacy_levels import PrivacyLevels
+from server.instrumentation import Instrumentation
 
 
 class AC:
@@ -10,14 +11,16 @@ class AC:
         This class
     """
 
-    def __init__(self, estimations, privacy_levels, population):
+    def __init__(self, estimations, privacy_levels, population, instrumentation=None):
         # Contains estimated histograms. It should be a 2D numpy array.
         # E.g. if we have 4 category and 5 leve then it is a 5 * 4 matrix
         self.estimations = np.array(estimations)
         # Contains array of levels. For example: [0.1, 0.3, 0.6, 0.9, 1]
-        self.privacy_levels = privacy_levels
+        self.privacy_levels = PrivacyLevels.of(privacy_levels)
         # Contains the number of users in each level: [300, 400, 200, 100, 50]
         self.population = population
+        # Collector of metrics.
+        self.instrumentation = instrumentation or Instrumentation()
 
     def weighted_estimate(self, level_index):
         """
@@ -44,13 +47,12 @@ class AC:
             sum_of_users_at_last_allowed_level += self.population[len(self.privacy_levels) - i - 1]
         # Compute main weights which are weights without any normalization.
         for i in range(level_index + 1):
-            eps = self.privacy_levels[i]
             n = self.population[i]
             k = len(self.estimations[i])
             if i == level_index:
                 n = sum_of_users_at_last_allowed_level
             main_weight[i] = n / (1 - np.sum(self.estimations[i] ** 2 +
-                                          k/(math.exp(eps/2) + math.exp(-eps/2) - 2)))
+                                          k/self.privacy_levels.ac_noise[i]))
         # Apply normalization on each weight:
         denominator = np.sum(main_weight)
         for i in range(level_index + 1):
@@ -59,3 +61,45 @@ class AC:
                 print(weights)
                 raise ValueError('Error! Negative weight detected')
         return weights
+
+    def weighted_estimate_all(self, replicated_estimations):
+        """
+            Computes the estimation at every level at once. Estimation at level l combines
+                estimations of all stricter levels with the replicated estimation at l.
+
+            replicated_estimations: L * M matrix where l'th row is the estimation at level l
+                including replicated data of looser levels.
+        """
+        with self.instrumentation.stage('ac.weights'):
+            weights = self.compute_weight_matrix(replicated_estimations)
+        replicated_estimations = np.array(replicated_estimations)
+        L = len(self.privacy_levels)
+        # Only estimations of stricter levels are combined, so a non-finite estimation of a
+        #   level does not leak into the estimations of looser levels:
+        stricter = np.tri(L, k=-1, dtype=bool)[:, :, np.newaxis]
+        own = np.where(stricter, weights[:, :, np.newaxis] * self.estimations, 0)
+        return own.sum(axis=1) + np.diag(weights)[:, np.newaxis] * replicated_estimations
+
+    def compute_weight_matrix(self, replicated_estimations):
+        """
+            Computes a lower-triangular L * L matrix where l'th row contains the weights
+                of compute_weights(l).
+        """
+        replicated_estimations = np.array(replicated_estimations)
+        L = len(self.privacy_levels)
+        k = self.estimations.shape[1]
+        population = np.array(self.population, dtype=np.float64)
+        noise = k / self.privacy_levels.ac_noise
+        own_weight = population / (1 - np.sum(self.estimations ** 2 + noise[:, np.newaxis],
+                                              axis=1))
+        # Population at replicated level is the population of that level and all upper levels:
+        sum_of_users_at_last_allowed_level = np.cumsum(population[::-1])[::-1]
+        replicated_weight = sum_of_users_at_last_allowed_level / \
+            (1 - np.sum(replicated_estimations ** 2 + noise[:, np.newaxis], axis=1))
+        main_weight = np.tril(np.broadcast_to(own_weight, (L, L)), k=-1) + \
+            np.diag(replicated_weight)
+        # Apply normalization on each row:
+        weights = main_weight / np.sum(main_weight, axis=1, keepdims=True)
+        if np.any(weights < 0):
+            raise ValueError(f'Error! Negative weight detected in {weights.tolist()}')
+        return weights
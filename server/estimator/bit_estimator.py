@@ -1,15 +1,37 @@
 """Frequency Estimator per Bit for Continual Reports
  """
 import math
+import os
 import numpy as np 
 
 
 class Server:
     """This class estimates frequency of a single bit.
+        With history='full' frequencies and variances of every round are kept in lists and
+        a round refers to f[t - 2**last_root] where last_root is the largest height reported
+        so far. With history='dyadic' a round t refers to the root of its own difference
+        tree, f[t - 2**ctz(t)], so only frequencies of rounds which are t with some of its
+        lowest set bits cleared can be referred later. Only these O(log t) checkpoints are
+        kept and the full history can be appended to a file.
     """
-    def __init__(self, epsilon):
+    def __init__(self, epsilon, levels=None, history='full', spill_path=None):
+        """Initialize the server.
+
+        Args:
+            epsilon (float): The privacy budget of reports.
+            levels (PrivacyLevels): Registry which provides coefficients of replicated values.
+            history (str): Either 'full' or 'dyadic'.
+            spill_path (str): If given in dyadic mode, frequency and variance of every round
+                are written to this file as pairs of float64. Rows after the current round
+                are overwritten, so a resumed server continues the file of the saved one.
+        """
+        if history not in ('full', 'dyadic'):
+            raise ValueError('Error! History should be either full or dyadic')
         self.epsilon = epsilon
+        # Registry of privacy levels which provides coefficients of replicated values.
+        self.levels = levels
         self.coef = (1 + math.exp(self.epsilon))/(math.exp(self.epsilon) - 1)
+        self.coef_squared = self.coef ** 2
         self.sum_v_of1 = 0
         self.sum_of_users_of1 = 0
         self.sum_v_ofh = 0
@@ -20,14 +42,77 @@ class Server:
         self.replica_sum_of_users_ofh = 0
         self.f1 = 0
         self.f2 = 0
-        self.f = [0]
-        self.variance_f = [0]
+        self.history = history
+        self.spill_path = spill_path
+        # Frequency and variance of finished rounds. They are lists of all rounds in full
+        #   mode and dictionaries of checkpoints keyed by round in dyadic mode.
+        if history == 'full':
+            self.f = [0]
+            self.variance_f = [0]
+        else:
+            self.f = {0: 0}
+            self.variance_f = {0: 0}
         self.t = 0
         self.last_root = 0
         self.replica_last_root = 0
         self.replica_activated = False
 
+    def t_prime(self):
+        """Finds the round which the root node of current round refers to.
+
+        Returns:
+            int: The round before the first leaf of the root node.
+        """
+        if self.history == 'full':
+            return self.t - 2**self.last_root
+        return self.t - (self.t & -self.t)
+
+    def record(self, freq, variance):
+        """Stores frequency and variance of the round which is finished.
+
+        Args:
+            freq (float): The frequency of round t.
+            variance (float): Its variance.
+        """
+        if self.history == 'full':
+            self.f.append(freq)
+            self.variance_f.append(variance)
+            return
+        self.f[self.t] = freq
+        self.variance_f[self.t] = variance
+        if self.spill_path is not None:
+            with open(self.spill_path, 'r+b' if os.path.exists(self.spill_path) else 'wb') as spill:
+                spill.seek((self.t - 1) * 2 * 8)
+                spill.write(np.array([freq, variance], dtype=np.float64).tobytes())
+                spill.truncate()
+        # Keep t with its k lowest set bits cleared for every k:
+        checkpoints = {self.t}
+        t = self.t
+        while t:
+            t &= t - 1
+            checkpoints.add(t)
+        for index in [index for index in self.f if index not in checkpoints]:
+            del self.f[index]
+            del self.variance_f[index]
+
+    def history_f(self):
+        """Frequency of every finished round.
+
+        Returns:
+            float[]: Unclipped frequency of rounds 0 to t.
+        """
+        if self.history == 'full':
+            return self.f
+        if self.spill_path is None:
+            raise ValueError('Error! Full history is only kept in full mode or with spill_path')
+        spilled = np.fromfile(self.spill_path, dtype=np.float64).reshape(-1, 2)
+        return np.concatenate(([0], spilled[:, 0]))
+
     def coefficient(self, eps):
+        if eps == self.epsilon:
+            return self.coef
+        if self.levels is not None and eps in self.levels:
+            return self.levels.coefficient[self.levels.index(eps)]
         return (1 + math.exp(eps))/(math.exp(eps) - 1)
     def new_value(self, v, h):
         """Get values of clients and after callibrating them, it will store their value.
@@ -98,8 +183,8 @@ class Server:
         Returns:
             float: The varience of users who are reporting leaf node.
         """
-        var_f1 = self.variance_f[len(self.variance_f) - 1] + \
-                (((math.exp(self.epsilon) + 1)/(math.exp(self.epsilon) - 1))**2) / \
+        var_f1 = self.variance_f[self.t - 1] + \
+                self.coef_squared / \
                     self.sum_of_users_of1
         return var_f1
 
@@ -109,9 +194,9 @@ class Server:
         Returns:
             float: The varience of users who are reporting root node.
         """
-        t_prime = self.t - 2**self.last_root
+        t_prime = self.t_prime()
         var_f2 = self.variance_f[t_prime] + \
-                (((math.exp(self.epsilon) + 1)/(math.exp(self.epsilon) - 1)) ** 2) / \
+                self.coef_squared / \
                     self.sum_of_users_ofh
         return var_f2
     def compute_variance(self):
@@ -125,8 +210,8 @@ class Server:
             vf2 = self.variance_f2()
             return (vf1 * vf2)/(vf1 + vf2)
         else:
-            return self.variance_f[len(self.variance_f) - 1] + \
-                    (((math.exp(self.epsilon) + 1)/(math.exp(self.epsilon) - 1)) ** 2) / \
+            return self.variance_f[self.t - 1] + \
+                    self.coef_squared / \
                         self.sum_of_users_of1
     def compute_w1(self):
         """Computes w1 weight.
@@ -158,13 +243,13 @@ class Server:
         """
         self.t += 1
         if self.t % 2 == 0:
-            self.f1 = self.f[len(self.f) - 1] + \
+            self.f1 = self.f[self.t - 1] + \
                         (self.sum_v_of1 / self.sum_of_users_of1)
-            t_prime = self.t - 2**self.last_root
+            t_prime = self.t_prime()
             self.f2 = self.f[t_prime] + \
                         (self.sum_v_ofh / self.sum_of_users_ofh)
         else:
-            self.f1 = self.f2 = self.f[len(self.f) - 1] + \
+            self.f1 = self.f2 = self.f[self.t - 1] + \
                         (self.sum_v_of1 / self.sum_of_users_of1)
         if self.t % 2 == 0:
             w = self.compute_w()
@@ -189,22 +274,21 @@ class Server:
             raise ValueError('Error! Replica should be deactive to go to next round!')
         self.t += 1
         if self.t % 2 == 0:
-            self.f1 = self.f[len(self.f) - 1] + \
+            self.f1 = self.f[self.t - 1] + \
                         (self.sum_v_of1 / self.sum_of_users_of1)
-            t_prime = self.t - 2**self.last_root
+            t_prime = self.t_prime()
             self.f2 = self.f[t_prime] + \
                         (self.sum_v_ofh / self.sum_of_users_ofh)
         else:
-            self.f1 = self.f2 = self.f[len(self.f) - 1] + \
+            self.f1 = self.f2 = self.f[self.t - 1] + \
                         (self.sum_v_of1 / self.sum_of_users_of1)
         if self.t % 2 == 0:
             w = self.compute_w()
         else:
             w = 0.5 #Just to neutralize its effect.
         freq = w * self.f1 + (1 - w) * self.f2
-        self.f.append(freq)
         varF = self.compute_variance()
-        self.variance_f.append(varF)
+        self.record(freq, varF)
         #Reset state of server.
         self.sum_v_of1 = 0
         self.sum_of_users_of1 = 0
@@ -218,7 +302,7 @@ class Server:
         Returns:
             float[]: final frequency of this bit.
         """
-        result = np.clip(self.f, 0, 1)
+        result = np.clip(self.history_f(), 0, 1)
         return result
 
     def finish(self):
@@ -227,5 +311,7 @@ class Server:
         Returns:
             float[]: final frequency of this bit.
         """
+        if self.history == 'dyadic':
+            return np.clip(self.history_f(), 0, 1)
         self.f = np.clip(self.f, 0, 1)
         return self.f 
\ No newline at end of file
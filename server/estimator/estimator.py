@@ -1,20 +1,97 @@
-"""This module encapsulate bit_estimator to provide a server for estimating multivalue
+"""This module provides a server for estimating multivalue data which keeps the state of
+    all bits as arrays.
 """
+import math
+import os
 import numpy as np
-from server.estimator.bit_estimator import Server
+from server.instrumentation import Instrumentation
 
 
 class WrappedServer:
-    """WrapperServer for bit_estimator servers which wrap them in order to provide
-        support for multi-value estimations.
+    """Frequency estimator of all bits of a multi-value data for continual reports.
+        It follows bit_estimator.Server but holds the sufficient statistics, frequency
+        history and variance history of all M bits in arrays so each step is computed
+        for every bit in one pass.
+        With history='full' frequencies and variances of every round are kept and a round
+        refers to f[t - 2**last_root] where last_root is the largest height reported so far.
+        With history='dyadic' a round t refers to the root of its own difference tree,
+        f[t - 2**ctz(t)], so only rounds which are t with some of its lowest set bits
+        cleared are kept. These are O(log t) rows and the full history can be written to
+        a spill file.
     """
-    def __init__(self, M, epsilon):
+
+    # Arrays of statistics which are kept in checkpoints.
+    STATE_ARRAYS = ('sum_v_of1', 'sum_of_users_of1', 'sum_v_ofh', 'sum_of_users_ofh',
+                    'replica_sum_v_of1', 'replica_sum_of_users_of1', 'replica_sum_v_ofh',
+                    'replica_sum_of_users_ofh', 'last_root', 'replica_last_root')
+
+    def __init__(self, M, epsilon, levels=None, instrumentation=None, history='full',
+                 spill_path=None):
+        """Initialize the server.
+
+        Args:
+            M (int): Number of bits of data.
+            epsilon (float): The privacy budget of reports.
+            levels (PrivacyLevels): Registry which provides coefficients of replicated values.
+            instrumentation (Instrumentation): Collector of metrics.
+            history (str): Either 'full' or 'dyadic'.
+            spill_path (str): If given in dyadic mode, frequency and variance of every round
+                are written to this file as rows of 2 * M float64, so finish can return them.
+                Rows after the current round are overwritten, so a resumed server continues
+                the file of the saved one.
+        """
+        if history not in ('full', 'dyadic'):
+            raise ValueError('Error! History should be either full or dyadic')
         self.M = M
         self.epsilon = epsilon
-        self.servers = [Server(epsilon) for i in range(M)]
+        # Registry of privacy levels which provides coefficients of replicated values.
+        self.levels = levels
+        # Collector of metrics.
+        self.instrumentation = instrumentation or Instrumentation()
+        self.coef = self.coefficient(epsilon)
+        self.coef_squared = self.coef ** 2
+        # Calibrated sums and number of users who reported leaf (of1) or root (ofh) of each bit:
+        self.sum_v_of1 = np.zeros(M)
+        self.sum_of_users_of1 = np.zeros(M, dtype=np.int64)
+        self.sum_v_ofh = np.zeros(M)
+        self.sum_of_users_ofh = np.zeros(M, dtype=np.int64)
+        # The same values for replicated reports:
+        self.replica_sum_v_of1 = np.zeros(M)
+        self.replica_sum_of_users_of1 = np.zeros(M, dtype=np.int64)
+        self.replica_sum_v_ofh = np.zeros(M)
+        self.replica_sum_of_users_ofh = np.zeros(M, dtype=np.int64)
+        self.last_root = np.zeros(M, dtype=np.int64)
+        self.replica_last_root = np.zeros(M, dtype=np.int64)
+        self.replica_activated = False
+        # Number of finished rounds.
+        self.t = 0
+        self.history = history
+        self.spill_path = spill_path
+        if history == 'full':
+            # f[i] and variance_f[i] are frequencies and their variances at round i where the
+            #   first t + 1 rows are valid and the rest is preallocated room for next rounds.
+            self.f = np.zeros([16, M])
+            self.variance_f = np.zeros([16, M])
+        else:
+            # Frequencies and their variances of checkpoint rounds keyed by round.
+            self.f = {0: np.zeros(M)}
+            self.variance_f = {0: np.zeros(M)}
+
+    def coefficient(self, eps):
+        """Computes calibration coefficient of reports with given epsilon.
+
+        Args:
+            eps (float): The epsilon of reports.
+
+        Returns:
+            float: (e^eps + 1) / (e^eps - 1)
+        """
+        if self.levels is not None and eps in self.levels:
+            return self.levels.coefficient[self.levels.index(eps)]
+        return (1 + math.exp(eps))/(math.exp(eps) - 1)
 
     def new_value(self, v, h, m, replicated, eps = 0):
-        """Transfer given value to corresponding bit_estimator
+        """Transfer given value to corresponding bit
 
         Args:
             v (int): The reported value
@@ -23,53 +100,222 @@ class WrappedServer:
             replicated (bool): Determines if this is original value or a replicated one.
         """
         if replicated is False:
-            self.servers[m].new_value(v, h)
+            callibrated_v = v * self.coef
+            self.last_root[m] = max(self.last_root[m], h)
+            if h == 0:
+                self.sum_of_users_of1[m] += 1
+                self.sum_v_of1[m] += callibrated_v
+            else:
+                self.sum_of_users_ofh[m] += 1
+                self.sum_v_ofh[m] += callibrated_v
         else:
             if eps == 0:
                 raise Exception('Error! epsilon is not provided')
-            self.servers[m].replica_new_value(v, h, eps)
+            callibrated_v = v * self.coefficient(eps)
+            self.replica_last_root[m] = max(self.replica_last_root[m], h)
+            if h == 0:
+                self.replica_sum_of_users_of1[m] += 1
+                self.replica_sum_v_of1[m] += callibrated_v
+            else:
+                self.replica_sum_of_users_ofh[m] += 1
+                self.replica_sum_v_ofh[m] += callibrated_v
+
+    def new_values(self, sums):
+        """Get statistics of many reports and after callibrating them, it will store them.
+
+        Args:
+            sums (BitSums): Statistics of reports for each of M bits.
+        """
+        self.last_root = np.maximum(self.last_root, sums.last_root)
+        self.sum_of_users_of1 += sums.sum_of_users_of1
+        self.sum_v_of1 += sums.sum_v_of1 * self.coef
+        self.sum_of_users_ofh += sums.sum_of_users_ofh
+        self.sum_v_ofh += sums.sum_v_ofh * self.coef
+
+    def replica_new_values(self, sums, eps):
+        """Get statistics of many replicated reports and after callibrating them, it will store them.
+
+        Args:
+            sums (BitSums): Statistics of replicated reports for each of M bits.
+            eps (float): The epsilon of these reports.
+        """
+        coef = self.coefficient(eps)
+        self.replica_last_root = np.maximum(self.replica_last_root, sums.last_root)
+        self.replica_sum_of_users_of1 += sums.sum_of_users_of1
+        self.replica_sum_v_of1 += sums.sum_v_of1 * coef
+        self.replica_sum_of_users_ofh += sums.sum_of_users_ofh
+        self.replica_sum_v_ofh += sums.sum_v_ofh * coef
 
     def replica_activasion(self, status):
-        """Change the activasion of replica data in underlying servers.
+        """Change the activasion of replica data.
 
         Args:
             status (bool): True activates the replica and false deactivates it.
         """
         if status is True:
-            for server in self.servers:
-                server.activate_replica()
+            self.sum_of_users_of1 += self.replica_sum_of_users_of1
+            self.sum_v_of1 += self.replica_sum_v_of1
+            self.sum_of_users_ofh += self.replica_sum_of_users_ofh
+            self.sum_v_ofh += self.replica_sum_v_ofh
+            self.replica_activated = True
         else:
-            for server in self.servers:
-                server.deactivate_replica()
+            self.sum_of_users_of1 -= self.replica_sum_of_users_of1
+            self.sum_v_of1 -= self.replica_sum_v_of1
+            self.sum_of_users_ofh -= self.replica_sum_of_users_ofh
+            self.sum_v_ofh -= self.replica_sum_v_ofh
+            self.replica_sum_of_users_of1 = np.zeros(self.M, dtype=np.int64)
+            self.replica_sum_of_users_ofh = np.zeros(self.M, dtype=np.int64)
+            self.replica_sum_v_of1 = np.zeros(self.M)
+            self.replica_sum_v_ofh = np.zeros(self.M)
+            self.replica_activated = False
+        self.last_root, self.replica_last_root = self.replica_last_root, self.last_root
+
+    def estimate(self):
+        """Computes frequency and its variance for the current round without changing the state.
+            Bits without leaf or root reports leave that part out of the combination, and
+            bits without any report keep the frequency and variance of the previous round.
+
+        Returns:
+            (float[], float[]): Unclipped frequency and variance of each bit.
+        """
+        t = self.t + 1
+        previous_f, previous_variance = self.f[self.t], self.variance_f[self.t]
+        leaf = self.sum_of_users_of1 > 0
+        f1 = previous_f + np.divide(self.sum_v_of1, self.sum_of_users_of1,
+                                    out=np.zeros(self.M), where=leaf)
+        var_f1 = previous_variance + np.divide(self.coef_squared, self.sum_of_users_of1,
+                                               out=np.full(self.M, np.inf), where=leaf)
+        if t % 2 != 0:
+            return f1, np.where(leaf, var_f1, previous_variance)
+        if self.history == 'full':
+            t_prime = t - 2 ** self.last_root
+            bits = np.arange(self.M)
+            f_prime, variance_prime = self.f[t_prime, bits], self.variance_f[t_prime, bits]
+        else:
+            t_prime = t & (t - 1)
+            f_prime, variance_prime = self.f[t_prime], self.variance_f[t_prime]
+        root = self.sum_of_users_ofh > 0
+        f2 = f_prime + np.divide(self.sum_v_ofh, self.sum_of_users_ofh,
+                                 out=np.zeros(self.M), where=root)
+        var_f2 = variance_prime + np.divide(self.coef_squared, self.sum_of_users_ofh,
+                                            out=np.full(self.M, np.inf), where=root)
+        w1 = 1 / var_f1
+        w2 = 1 / var_f2
+        reported = leaf | root
+        w = np.divide(w1, w1 + w2, out=np.zeros(self.M), where=reported)
+        freq = np.where(reported, w * f1 + (1 - w) * f2, previous_f)
+        variance = np.divide(var_f1 * var_f2, var_f1 + var_f2, out=np.zeros(self.M),
+                             where=leaf & root)
+        variance = np.where(leaf & root, variance, np.where(
+            leaf, var_f1, np.where(root, var_f2, previous_variance)))
+        return freq, variance
 
     def predicate(self, go_next):
         """Predicate the current value and prepare servers for next round if called with true
 
         Args:
             go_next (bool): Should go to next round or not?
+
+        Returns:
+            float[]: Clipped frequency of each bit.
         """
-        estimation = []
+        with self.instrumentation.stage('estimator.estimate'):
+            freq, variance = self.estimate()
         if go_next is True:
-            for server in self.servers:
-                result = server.go_to_next_round()
-                estimation.append(result)
+            if self.replica_activated:
+                raise ValueError('Error! Replica should be deactive to go to next round!')
+            self.t += 1
+            self.record(freq, variance)
+            #Reset state of server.
+            self.sum_v_of1 = np.zeros(self.M)
+            self.sum_of_users_of1 = np.zeros(self.M, dtype=np.int64)
+            self.sum_v_ofh = np.zeros(self.M)
+            self.sum_of_users_ofh = np.zeros(self.M, dtype=np.int64)
+        return np.clip(freq, 0, 1)
+
+    def record(self, freq, variance):
+        """Stores frequency and variance of the round which is finished.
+
+        Args:
+            freq (float[]): The frequency of each bit at round t.
+            variance (float[]): Its variance.
+        """
+        if self.history == 'full':
+            if self.t == len(self.f):
+                self.f = np.concatenate((self.f, np.zeros_like(self.f)))
+                self.variance_f = np.concatenate((self.variance_f, np.zeros_like(self.variance_f)))
+            self.f[self.t] = freq
+            self.variance_f[self.t] = variance
+            return
+        self.f[self.t] = freq
+        self.variance_f[self.t] = variance
+        if self.spill_path is not None:
+            with open(self.spill_path, 'r+b' if os.path.exists(self.spill_path) else 'wb') as spill:
+                spill.seek((self.t - 1) * 2 * self.M * 8)
+                spill.write(np.concatenate((freq, variance)).astype(np.float64).tobytes())
+                spill.truncate()
+        # Keep t with its k lowest set bits cleared for every k:
+        checkpoints = {self.t}
+        t = self.t
+        while t:
+            t &= t - 1
+            checkpoints.add(t)
+        for index in [index for index in self.f if index not in checkpoints]:
+            del self.f[index]
+            del self.variance_f[index]
+
+    def get_state(self):
+        """Returns the state of server which is needed to continue estimation.
+
+        Returns:
+            {str: object}: Round number, sums and the history of finished rounds.
+        """
+        state = {'t': self.t, 'replica_activated': self.replica_activated,
+                 'history': self.history}
+        if self.history == 'full':
+            state['f'] = self.f[:self.t + 1]
+            state['variance_f'] = self.variance_f[:self.t + 1]
+        else:
+            rounds = sorted(self.f)
+            state['rounds'] = np.array(rounds, dtype=np.int64)
+            state['f'] = np.stack([self.f[index] for index in rounds])
+            state['variance_f'] = np.stack([self.variance_f[index] for index in rounds])
+        for name in self.STATE_ARRAYS:
+            state[name] = getattr(self, name)
+        return state
+
+    def set_state(self, state):
+        """Restores a state which is returned by get_state.
+
+        Args:
+            state ({str: object}): The state.
+        """
+        if state['history'] != self.history:
+            raise ValueError(f'Error! State has {state["history"]} history but server has '
+                             f'{self.history} history')
+        self.t = state['t']
+        self.replica_activated = state['replica_activated']
+        if self.history == 'full':
+            self.f = state['f']
+            self.variance_f = state['variance_f']
         else:
-            for server in self.servers:
-                result = server.predicate()
-                estimation.append(result)
-        return estimation
+            rounds = state['rounds'].tolist()
+            self.f = {index: np.array(row) for index, row in zip(rounds, state['f'])}
+            self.variance_f = {index: np.array(row)
+                               for index, row in zip(rounds, state['variance_f'])}
+        for name in self.STATE_ARRAYS:
+            setattr(self, name, state[name])
 
     def finish(self):
-        """Get the results from the underlying bit_estimators and reports the frequency of data
-        
+        """Reports the frequency of data in every finished round.
 
         Returns:
             float[][]: The estimation of each bit in each round.
         """
-        to_determine_shape = self.servers[0].finish()
-        result = np.zeros([len(to_determine_shape), self.M])
-        for index, server in enumerate(self.servers):
-            result[:, index] = server.finish()
-        # The first row is initialized 0 values of f array inside underlying servers.
-        return result[1:]
-        
\ No newline at end of file
+        if self.history == 'dyadic':
+            if self.spill_path is None:
+                raise ValueError('Error! Full history is only kept in full mode or with spill_path')
+            spilled = np.fromfile(self.spill_path, dtype=np.float64, count=self.t * 2 * self.M)
+            return np.clip(spilled.reshape(self.t, 2, self.M)[:, 0], 0, 1)
+        # The first row is initialized 0 values of f array.
+        return np.clip(self.f[1:self.t + 1], 0, 1)
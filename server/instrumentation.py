@@ -0,0 +1,162 @@
+"""This module implements timers, counters and memory samples of server stages.
+    Components of server receive an Instrumentation object and wrap their stages with it.
+    A disabled object returns a shared no-op context and ignores counts, so hooks cost only
+    a method call when instrumentation is not needed.
+"""
+import contextlib
+import cProfile
+import sys
+import tracemalloc
+from time import perf_counter, process_time
+
+try:
+    import resource
+except ImportError:
+    # resource is not available on Windows, so peak memory is not sampled there.
+    resource = None
+
+# Context which is returned by stages of a disabled instrumentation.
+_NO_STAGE = contextlib.nullcontext()
+
+
+class StageTimer:
+    """Context which adds wall and CPU time of a block to a stage.
+    """
+
+    def __init__(self, stats):
+        # [calls, wall time, CPU time] of the stage.
+        self.stats = stats
+        self.wall = 0
+        self.cpu = 0
+
+    def __enter__(self):
+        self.wall = perf_counter()
+        self.cpu = process_time()
+        return self
+
+    def __exit__(self, *args):
+        self.stats[0] += 1
+        self.stats[1] += perf_counter() - self.wall
+        self.stats[2] += process_time() - self.cpu
+        return False
+
+
+class Instrumentation:
+    """Collects per-stage timers, counters and peak memory of a server and optionally
+        profiles whole rounds with cProfile.
+    """
+
+    def __init__(self, enabled=False):
+        """Initialize empty metrics.
+
+        Args:
+            enabled (bool): Whether metrics are collected.
+        """
+        self.enabled = enabled
+        # [calls, wall time, CPU time] of each stage by name.
+        self.timers = {}
+        # Counters by name.
+        self.counters = {}
+        # Peak resident memory of process and traced memory in bytes at last sample.
+        self.memory = {}
+        # Profiler of current round and the hook which gets it at end of round.
+        self.profiler = None
+        self.profile_hook = None
+        # Profiles of finished rounds by round number if no hook is given.
+        self.profiles = {}
+
+    def enable(self):
+        """Start collecting metrics."""
+        self.enabled = True
+
+    def disable(self):
+        """Stop collecting metrics. Collected metrics are kept."""
+        self.enabled = False
+
+    def stage(self, name):
+        """Measures a block of code.
+
+        Args:
+            name (str): Name of the stage.
+
+        Returns:
+            context: Context manager which measures the block.
+        """
+        if not self.enabled:
+            return _NO_STAGE
+        if name not in self.timers:
+            self.timers[name] = [0, 0.0, 0.0]
+        return StageTimer(self.timers[name])
+
+    def count(self, name, value=1):
+        """Adds to a counter.
+
+        Args:
+            name (str): Name of the counter.
+            value (int): The amount to add.
+        """
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def sample_memory(self):
+        """Samples peak memory of the process and memory traced by tracemalloc if it is on.
+        """
+        if not self.enabled:
+            return
+        if resource is not None:
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+            self.memory['peak_rss'] = peak if sys.platform == 'darwin' else peak * 1024
+        if tracemalloc.is_tracing():
+            self.memory['traced'], self.memory['traced_peak'] = tracemalloc.get_traced_memory()
+
+    def profile_round(self, hook=None):
+        """Profiles everything which runs from now until the end of current round.
+
+        Args:
+            hook (callable): Called with round number and the cProfile.Profile at end of round.
+                The profile is kept in profiles if it is not given.
+        """
+        if self.profiler is not None:
+            return
+        self.profile_hook = hook
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def end_round(self, t):
+        """Annotates end of a round to finish its profile and sample memory.
+
+        Args:
+            t (int): Number of the round which is finished.
+        """
+        self.count('rounds')
+        self.sample_memory()
+        if self.profiler is None:
+            return
+        self.profiler.disable()
+        if self.profile_hook is not None:
+            self.profile_hook(t, self.profiler)
+        else:
+            self.profiles[t] = self.profiler
+        self.profiler = None
+        self.profile_hook = None
+
+    def snapshot(self):
+        """Returns collected metrics.
+
+        Returns:
+            {str: object}: Calls, wall and CPU seconds of each stage, counters and memory.
+        """
+        return {
+            'timers': {name: {'calls': calls, 'wall': wall, 'cpu': cpu}
+                       for name, (calls, wall, cpu) in self.timers.items()},
+            'counters': dict(self.counters),
+            'memory': dict(self.memory),
+        }
+
+    def reset(self):
+        """Forgets collected metrics."""
+        self.timers = {}
+        self.counters = {}
+        self.memory = {}
+        self.profiles = {}
@@ -1,55 +1,195 @@
 """This is main entrypoint to run server side of Privacy Flow algorithm which combines both
     Estimator and Replicator and Combiner Algorithms.
 """
-from typing import List
+import os
 import numpy as np
+from privacy_levels import PrivacyLevels
+from randomness import RandomSource
+from server import checkpoint
+from server.checkpoint import with_prefix, strip_prefix
 from server.replicator.drs import DRS
+from server.replicator.drpp import DRPP
 from server.combiner.ac import AC
 from server.estimator.estimator import WrappedServer
+from server.report_batch import ReportBatch
+from server.instrumentation import Instrumentation
+
+# Replication algorithms by name which is kept in checkpoints.
+REPLICATORS = {'DRS': DRS, 'DRPP': DRPP}
 
 
 class PrivacyFlow:
     """This class is responsible for managing different modules of server.
     """
 
-    def __init__(self, data, levels, M):
+    def __init__(self, data, levels, M, replicator=DRS, rng=None, batch_size=4096,
+                 instrumentation=None, history='full', spill_directory=None):
         """Initialize underlying modules
 
         Args:
             data ({eps: [{userID: id, value: {v: int[], h: int[]}}, ...]}): Contains a dictionary of
                 privacy budget where each privacy budget is a list of users and values which
                 are selected that leve.
-            levels (float[]): The array of privacy budgets which denotes available levels.
+            levels (float[]|PrivacyLevels): The array of privacy budgets which denotes
+                available levels.
+            M (int): Number of bits of data.
+            replicator (type): The replication algorithm which is either DRS or DRPP. Options
+                of replicator can be bound with functools.partial, e.g.
+                partial(DRS, reservoir_size=65536) for bounded-memory replication.
+            rng (RandomSource): Source of randomness of replication.
+            batch_size (int): Number of reports given to ingest which are buffered before
+                they are added to the statistics of the round.
+            instrumentation (Instrumentation): Collector of metrics of all modules. A disabled
+                one is created if it is not given.
+            history (str): History of estimators which is either 'full' or 'dyadic'. Dyadic
+                estimators keep O(log t) rounds instead of all of them.
+            spill_directory (str): If given in dyadic mode, estimators write the history of
+                each level to a file of this directory, so finish can return it.
         """
         if data:
             raise ValueError('Error! `data` is not supported in constructor \
                 anymore, please use `new_data_set` function')
-        self.data = data
-        if levels != sorted(levels):
-            raise ValueError('Error! Level array should be sorted in order\
-                 to consider a mapping between each level and its position.')
-        self.levels: List[float] = levels
-        self.servers:List[WrappedServer] = [WrappedServer(M, lvl) for lvl in self.levels]
+        # Registry of levels which also checks that levels are sorted.
+        self.levels = PrivacyLevels.of(levels)
+        self.M = M
+        # Metrics of this server which are shared with its modules.
+        self.instrumentation = instrumentation or Instrumentation()
+        self.history = history
+        self.spill_directory = spill_directory
+        self.servers = [WrappedServer(M, lvl, self.levels, self.instrumentation, history,
+                                      self.spill_path(index))
+                        for index, lvl in enumerate(self.levels)]
+
+        self.replication = replicator(self.levels, rng, instrumentation=self.instrumentation)
+        # Number of reports of each level in current round.
+        self.population = np.zeros(len(self.levels), dtype=np.int64)
+        # Reports given to ingest which are not added to the statistics yet.
+        self.batch_size = batch_size
+        self.pending = []
+        # Estimations of all levels in current round which are computed by estimate_all.
+        self.estimations = None
 
-        # self.replication = DRS(self.data, self.levels)
-        self.replication = None
+    def spill_path(self, index):
+        """Path of the file where the estimator of a level writes its history.
+
+        Args:
+            index (int): Index of the level.
+
+        Returns:
+            str: The path or None if history is not spilled.
+        """
+        if self.spill_directory is None:
+            return None
+        return os.path.join(self.spill_directory, f'level-{index}.f64')
 
     def new_data_set(self, data):
-        """Get the data of new round and report it to underlying servers.
+        """Get the data of new round and report it to underlying servers. It should be the
+            first data of the round, reports of a round given in parts go through ingest,
+            ingest_batch or merge.
 
         Args:
-            data ({eps: [{userID: id, value: {v: int[], h: int[]}}, ...]}): Contains a dictionary of
+            data (ReportBatch|{eps: [{userID: id, value: {v: int[], h: int[]}}, ...]}): Contains
+                reports of the round either in columnar format or as a dictionary of
                 privacy budget where each privacy budget is a list of users and values which
                 are selected that leve. val is an array of 1 or -1 values
         """
-        self.data = data
-        for lvl in self.data:
-            for user in self.data[lvl]:
-                for index,_ in enumerate(user['value']['v']):
-                    self.servers[self.levels.index(lvl)].new_value(\
-                                user['value']['v'][index], user['value']['h'][index], index, False)
+        if self.pending or self.population.any():
+            raise ValueError('Error! Reports of this round are already ingested, please use '
+                             '`ingest_batch` or go to next round')
+        self.replication.new_round()
+        if not isinstance(data, ReportBatch):
+            data = ReportBatch.from_dict(data, self.levels, self.M)
+        self.ingest_batch(data)
+
+    def ingest(self, user_id, level, v, h):
+        """Get a single report of current round. Reports are buffered and added to the
+            statistics in batches of batch_size reports.
+
+        Args:
+            user_id (int): ID of the user.
+            level (float): Privacy budget of the report.
+            v (int[]): Reported value of each bit which is 1 or -1.
+            h (int[]): Reported height of each bit.
+        """
+        self.pending.append((user_id, self.levels.index(level), v, h))
+        self.estimations = None
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def ingest_many(self, user_ids, levels, v, h):
+        """Get reports of many users of current round.
 
-        self.replication = DRS(self.data, self.levels)
+        Args:
+            user_ids (int[]): ID of each user.
+            levels (float[]): Privacy budget of each report.
+            v (int[][]): Reported values of each user.
+            h (int[][]): Reported heights of each user.
+        """
+        self.ingest_batch(ReportBatch(user_ids, self.levels.indices(levels), v, h))
+
+    def ingest_batch(self, batch):
+        """Get reports of current round in columnar format and add them to statistics of
+            estimators and replicators. The batch is not kept after this call.
+
+        Args:
+            batch (ReportBatch): Reports of some users.
+        """
+        if len(batch) == 0:
+            return
+        with self.instrumentation.stage('ingest'):
+            sums = batch.level_sums(len(self.levels))
+            for index, server in enumerate(self.servers):
+                server.new_values(sums[index])
+            self.population += batch.level_counts(len(self.levels))
+        with self.instrumentation.stage('replication.ingest'):
+            self.replication.ingest(batch)
+        self.instrumentation.count('reports', len(batch))
+        self.instrumentation.count('bits', len(batch) * batch.M)
+        self.estimations = None
+
+    def merge(self, partial):
+        """Get reports of current round which are aggregated apart from this server, e.g. by
+            other processes or nodes. Statistics of estimators are added at once and
+            replicators get the reports of the aggregate.
+
+        Args:
+            partial (PartialAggregate): Merged aggregate of some reports of current round.
+        """
+        if list(partial.levels) != list(self.levels) or partial.M != self.M:
+            raise ValueError('Error! Partial aggregate has different levels or bits')
+        if partial.t is not None and partial.t != self.servers[0].t:
+            raise ValueError(f'Error! Partial aggregate of round {partial.t} cannot be merged '
+                             f'in round {self.servers[0].t}')
+        with self.instrumentation.stage('merge'):
+            for index, server in enumerate(self.servers):
+                server.new_values(partial.sums[index])
+            self.population += partial.population
+        with self.instrumentation.stage('replication.ingest'):
+            for batch in partial.batches():
+                self.replication.ingest(batch)
+        self.instrumentation.count('reports', len(partial))
+        self.instrumentation.count('bits', len(partial) * self.M)
+        self.estimations = None
+
+    def flush(self):
+        """Add reports which are buffered by ingest to statistics of the round.
+        """
+        if not self.pending:
+            return
+        user_ids, level_index, v, h = zip(*self.pending)
+        self.pending = []
+        self.ingest_batch(ReportBatch(user_ids, level_index, v, h))
+
+    def close_round(self):
+        """Finalize current round after its last report. It computes the estimations of the
+            round and prepares servers for the next round.
+
+        Returns:
+            float[][]: L * M matrix where l'th row is the estimation at l'th level.
+        """
+        estimations = self.estimate_all()
+        self.next_round()
+        return estimations
 
     def estimate(self, l):
         """Computes the result at given level.
@@ -57,37 +197,96 @@ class PrivacyFlow:
         Args:
             l (float): The budget of level
         """
-        level = self.levels.index(l)
-        _, replicated_group_data = self.replication.recycle(l)
-        for user in replicated_group_data:
-            for index,_ in enumerate(user['value']['v']):
-                self.servers[level].new_value(user['value']['v'][index],\
-                                                user['value']['h'][index], index, True, user['eps'])
-        self.servers[level].replica_activasion(True)
-        estimation_at_level = self.servers[level].predicate(False)
-        estimations = []
-        for lvl in self.data:
-            if lvl < l:
-                estimations.append(self.servers[self.levels.index(lvl)].predicate(False))
-        estimations.append(estimation_at_level)
-        # Fix estimations length:
-        for _ in range(len(self.levels) - len(estimations)):
-            estimations.append(np.array([0 for i in estimation_at_level]))
-        population = [len(self.data[lvl]) for lvl in self.data]
-        # print(estimations)
-        ac = AC(estimations, self.levels, population)
-        level_index = level
-        if level_index is None:
-            raise ValueError('Error! Unable to find index of level')
-        # print(level, level_index, self.levels)
-        answer = ac.weighted_estimate(level_index)
-        self.servers[level].replica_activasion(False)
-        return answer
+        return self.estimate_all()[self.levels.index(l)]
+
+    def estimate_all(self):
+        """Computes the result at every level. Results are kept until new data arrives or
+            next round starts.
+
+        Returns:
+            float[][]: L * M matrix where l'th row is the estimation at l'th level.
+        """
+        self.flush()
+        if self.estimations is not None:
+            return self.estimations
+        own_estimations = []
+        replicated_estimations = []
+        for level, l in enumerate(self.levels):
+            with self.instrumentation.stage('estimation'):
+                own_estimations.append(self.servers[level].predicate(False))
+            with self.instrumentation.stage('replication'):
+                replicas = self.replication.recycle(l)
+            with self.instrumentation.stage('estimation'):
+                for eps, sums in replicas:
+                    self.servers[level].replica_new_values(sums, eps)
+                    if self.instrumentation.enabled:
+                        self.instrumentation.count('replicas', int(sums.sum_of_users_of1[0] +
+                                                                   sums.sum_of_users_ofh[0]))
+                self.servers[level].replica_activasion(True)
+                replicated_estimations.append(self.servers[level].predicate(False))
+                self.servers[level].replica_activasion(False)
+        with self.instrumentation.stage('combination'):
+            ac = AC(own_estimations, self.levels, self.population, self.instrumentation)
+            self.estimations = ac.weighted_estimate_all(replicated_estimations)
+        return self.estimations
+
     def next_round(self):
         """Annotate next round to underlying servers.
         """
-        for server in self.servers:
-            server.predicate(True)
+        self.flush()
+        with self.instrumentation.stage('next_round'):
+            for server in self.servers:
+                server.predicate(True)
+            self.replication.new_round()
+        self.population = np.zeros(len(self.levels), dtype=np.int64)
+        self.estimations = None
+        self.instrumentation.end_round(self.servers[0].t)
+
+    def metrics(self):
+        """Returns metrics which are collected while instrumentation is enabled.
+
+        Returns:
+            {str: object}: Snapshot of timers, counters and memory of Instrumentation.
+        """
+        return self.instrumentation.snapshot()
+
+    def save(self, path):
+        """Write the state of server to a checkpoint file. Buffered reports are added to the
+            statistics first and estimations of current round are not kept.
+
+        Args:
+            path (str): Path of the checkpoint.
+        """
+        self.flush()
+        state = {'levels': list(self.levels), 'M': int(self.M), 'batch_size': self.batch_size,
+                 'replicator': type(self.replication).__name__, 'population': self.population,
+                 'history': self.history, 'spill_directory': self.spill_directory}
+        for index, server in enumerate(self.servers):
+            state.update(with_prefix(f'servers.{index}', server.get_state()))
+        state.update(with_prefix('replication', self.replication.get_state()))
+        checkpoint.save(path, state)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Restore a server from a checkpoint file which is written by save.
+
+        Args:
+            path (str): Path of the checkpoint.
+            mmap (bool): If true, arrays are memory mapped instead of being read at once.
+
+        Returns:
+            PrivacyFlow: The server which continues from the saved state.
+        """
+        state = checkpoint.load(path, mmap)
+        flow = cls(None, state['levels'], state['M'], REPLICATORS[state['replicator']],
+                   RandomSource(), state['batch_size'], history=state['history'],
+                   spill_directory=state['spill_directory'])
+        for index, server in enumerate(flow.servers):
+            server.set_state(strip_prefix(f'servers.{index}', state))
+        flow.replication.set_state(strip_prefix('replication', state))
+        flow.population = state['population']
+        return flow
+
     def finish(self):
         """Get all recorded frequencies from server and return them to client.
 
@@ -96,7 +295,7 @@ class PrivacyFlow:
                                 for each bit at each level and in each round.
         """
         result = {}
-        for index in enumerate(self.levels):
-            result[self.levels[index]] = self.servers[index].finish()
+        for index, level in enumerate(self.levels):
+            result[level] = self.servers[index].finish()
         return result
         
\ No newline at end of file
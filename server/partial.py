@@ -0,0 +1,269 @@
+"""This module implements partial aggregates of a round which ingestion workers or nodes build
+    independently and a coordinator which merges them into a PrivacyFlow.
+
+A partial aggregate keeps the sufficient statistics of its reports for the estimators along
+with the reports themselves in wire format for the replicators. Merging partials adds their
+statistics and joins their reports, so it is associative and commutative and partials of a
+round can be merged in any order and grouping.
+"""
+import asyncio
+import os
+import struct
+import numpy as np
+from privacy_levels import PrivacyLevels
+from server import checkpoint
+from server.checkpoint import with_prefix, strip_prefix
+from server.report_batch import BitSums, ReportBatch
+from server.wire import encode_batch, decode_frames
+
+# Extension of files of partial aggregates.
+PARTIAL_EXTENSION = '.partial'
+# Length prefix of partial aggregates which are sent over a connection.
+LENGTH = struct.Struct('<Q')
+
+
+class PartialAggregate:
+    """Statistics and reports of some users at a round.
+    """
+
+    def __init__(self, levels, M, t=None):
+        """Initialize an empty aggregate.
+
+        Args:
+            levels (float[]): The array of privacy budgets which denotes available levels.
+            M (int): Number of bits of reports.
+            t (int): Number of the round. It is checked when the aggregate is merged if given.
+        """
+        self.levels = PrivacyLevels.of(levels)
+        self.M = M
+        self.t = t
+        # Statistics of reports of each (level, bit) pair.
+        self.sums = BitSums.zeros((len(self.levels), M))
+        # Number of reports of each level.
+        self.population = np.zeros(len(self.levels), dtype=np.int64)
+        # Reports in wire format as a list of frames.
+        self.frames = []
+
+    def __len__(self):
+        return int(self.population.sum())
+
+    def ingest_batch(self, batch):
+        """Add reports in columnar format.
+
+        Args:
+            batch (ReportBatch): Reports of some users.
+        """
+        if batch.M != self.M:
+            raise ValueError(f'Error! Reports should have {self.M} bits')
+        if len(batch) == 0:
+            return
+        self.sums.add(batch.level_sums(len(self.levels)))
+        self.population += batch.level_counts(len(self.levels))
+        self.frames.append(encode_batch(batch))
+
+    def ingest_many(self, user_ids, levels, v, h):
+        """Add reports of many users.
+
+        Args:
+            user_ids (int[]): ID of each user.
+            levels (float[]): Privacy budget of each report.
+            v (int[][]): Reported values of each user.
+            h (int[][]): Reported heights of each user.
+        """
+        self.ingest_batch(ReportBatch(user_ids, self.levels.indices(levels), v, h))
+
+    def merge(self, other):
+        """Adds another aggregate of the same round to this one.
+
+        Args:
+            other (PartialAggregate): The other aggregate.
+
+        Returns:
+            PartialAggregate: This object.
+        """
+        if list(other.levels) != list(self.levels) or other.M != self.M:
+            raise ValueError('Error! Partial aggregates have different levels or bits')
+        if self.t is not None and other.t is not None and self.t != other.t:
+            raise ValueError(f'Error! Partial aggregate of round {other.t} cannot be merged '
+                             f'with round {self.t}')
+        if self.t is None:
+            self.t = other.t
+        self.sums.add(other.sums)
+        self.population += other.population
+        self.frames.extend(other.frames)
+        return self
+
+    def batches(self):
+        """Decodes the reports.
+
+        Yields:
+            ReportBatch: Reports of each ingested batch.
+        """
+        for frame in self.frames:
+            yield from decode_frames(frame)
+
+    def get_state(self):
+        """Returns the state of aggregate.
+
+        Returns:
+            {str: object}: Levels, statistics and reports.
+        """
+        state = {'levels': [float(level) for level in self.levels], 'M': self.M, 't': self.t,
+                 'population': self.population,
+                 'reports': np.frombuffer(b''.join(self.frames), dtype=np.uint8)}
+        state.update(with_prefix('sums', vars(self.sums)))
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        """Creates an aggregate from a state which is returned by get_state.
+
+        Args:
+            state ({str: object}): The state.
+
+        Returns:
+            PartialAggregate: The aggregate.
+        """
+        partial = cls(state['levels'], state['M'], state['t'])
+        partial.population = np.array(state['population'], dtype=np.int64)
+        partial.sums = BitSums(**strip_prefix('sums', state))
+        if len(state['reports']):
+            partial.frames = [memoryview(state['reports'])]
+        return partial
+
+    def to_bytes(self):
+        """Serializes the aggregate in checkpoint format.
+
+        Returns:
+            bytes: The aggregate.
+        """
+        return checkpoint.dumps(self.get_state())
+
+    @classmethod
+    def from_bytes(cls, buffer):
+        """Deserializes an aggregate which is returned by to_bytes.
+
+        Args:
+            buffer (bytes): The aggregate.
+
+        Returns:
+            PartialAggregate: The aggregate.
+        """
+        return cls.from_state(checkpoint.loads(buffer))
+
+    def save(self, path):
+        """Writes the aggregate to a file atomically.
+
+        Args:
+            path (str): Path of the file.
+        """
+        checkpoint.save(path, self.get_state())
+
+    @classmethod
+    def load(cls, path):
+        """Reads an aggregate which is written by save.
+
+        Args:
+            path (str): Path of the file.
+
+        Returns:
+            PartialAggregate: The aggregate.
+        """
+        return cls.from_state(checkpoint.load(path, mmap=False))
+
+
+class Coordinator:
+    """Merges partial aggregates of each round and closes rounds of a PrivacyFlow.
+        Partials can be added directly, read from files of a directory or received over
+        connections where each partial is a uint64 length followed by its bytes.
+    """
+
+    def __init__(self, flow):
+        """Initialize the coordinator.
+
+        Args:
+            flow (PrivacyFlow): The server which gets merged aggregates.
+        """
+        self.flow = flow
+        # Merge of partials of current round which are not given to flow yet.
+        self.partial = PartialAggregate(flow.levels, flow.M, self.round())
+
+    def round(self):
+        """Number of current round of flow."""
+        return self.flow.servers[0].t
+
+    def add(self, partial):
+        """Merge a partial aggregate of current round.
+
+        Args:
+            partial (PartialAggregate): The aggregate.
+        """
+        self.partial.merge(partial)
+
+    def collect_directory(self, directory):
+        """Merge partial aggregates of current round which are saved in a directory and
+            remove their files. Files of other rounds are left.
+
+        Args:
+            directory (str): The directory.
+
+        Returns:
+            int: Number of merged aggregates.
+        """
+        merged = 0
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(PARTIAL_EXTENSION):
+                continue
+            path = os.path.join(directory, name)
+            partial = PartialAggregate.load(path)
+            if partial.t is not None and partial.t != self.round():
+                continue
+            self.add(partial)
+            os.remove(path)
+            merged += 1
+        return merged
+
+    async def receive(self, reader, writer):
+        """Merge partial aggregates of a connection until it is closed. It can be given to
+            asyncio.start_server.
+
+        Args:
+            reader (asyncio.StreamReader): Stream of the connection.
+            writer (asyncio.StreamWriter): Stream of the connection.
+        """
+        try:
+            while True:
+                try:
+                    length, = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+                except asyncio.IncompleteReadError:
+                    return
+                self.add(PartialAggregate.from_bytes(await reader.readexactly(length)))
+        finally:
+            writer.close()
+
+    def close_round(self):
+        """Give the merged aggregate of current round to flow and close the round.
+
+        Returns:
+            float[][]: L * M matrix where l'th row is the estimation at l'th level.
+        """
+        self.flow.merge(self.partial)
+        estimations = self.flow.close_round()
+        self.partial = PartialAggregate(self.flow.levels, self.flow.M, self.round())
+        return estimations
+
+
+async def send_partial(host, port, partial):
+    """Send a partial aggregate to a coordinator.
+
+    Args:
+        host (str): Address of the coordinator.
+        port (int): Port of the coordinator.
+        partial (PartialAggregate): The aggregate.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    buffer = partial.to_bytes()
+    writer.write(LENGTH.pack(len(buffer)) + buffer)
+    await writer.drain()
+    writer.close()
+    await writer.wait_closed()
@@ -3,6 +3,8 @@ Implements Data Recycle (DR) Algorithm
 """
 import math
 import numpy as np
+from randomness import RandomSource, default_source
+from privacy_levels import PrivacyLevels
 
 
 class DR:
@@ -10,8 +12,12 @@ class DR:
     DR Class
     """
 
-    def __init__(self, levels):
-        self.levels = levels
+    def __init__(self, levels, rng=None):
+        self.levels = PrivacyLevels.of(levels)
+        # Source of randomness:
+        self.rng = rng or default_source()
+        # Thresholds of derivation cached by (target, infimum, supremum) levels.
+        self.thresholds = {}
 
     def compute_q(self, level):
         """Computes q value which is a specific value in DR Algorithm.
@@ -22,6 +28,8 @@ class DR:
         Returns:
             float: Computed q value
         """
+        if level in self.levels:
+            return self.levels.q[self.levels.index(level)]
         numerator = math.exp(level/2) - 1
         denominator = math.exp(level/2) + 1
         return numerator / denominator
@@ -96,32 +104,27 @@ class DR:
         z_inf = supremum['value']['v']
 
         derived_version = []
-        q_target = self.compute_q(target_level)
-        q_s = self.compute_q(infimum['level'])
         if supremum['level'] is None:
-            threshold = (q_s + q_target) / (2 * q_s)
+            (threshold,) = self.compute_thresholds(target_level, infimum['level'], None)
             for i in range(len(infimum['value']['v'])):
-                p = np.random.random()
-                if p <= threshold:
+                p = self.rng.word()
+                if p < threshold:
                     derived_version.append(z_sup[i])
                 else:
                     derived_version.append(z_sup[i] * -1)
         else:
-            q_i = self.compute_q(supremum['level'])
-            f_1, g_1 = self.compute_fg(q_s, q_target, q_i, 1)
-            threshold1 = (1 + f_1 + g_1) / 2
-            f_2, g_2 = self.compute_fg(q_s, q_target, q_i, 2)
-            threshold2 = (1 + f_2 - g_2) / 2
+            threshold1, threshold2 = self.compute_thresholds(
+                target_level, infimum['level'], supremum['level'])
             for j in range(len(supremum['value']['v'])):
                 if z_sup[j] == z_inf[j]:
-                    p = np.random.random()
-                    if p <= threshold1:
+                    p = self.rng.word()
+                    if p < threshold1:
                         derived_version.append(z_sup[j])
                     else:
                         derived_version.append(z_sup[j] * -1)
                 else:
-                    p = np.random.random()
-                    if p <= threshold2:
+                    p = self.rng.word()
+                    if p < threshold2:
                         derived_version.append(z_sup[j])
                     else:
                         derived_version.append(z_inf[j])
@@ -129,3 +132,56 @@ class DR:
             'h': infimum['value']['h'],
             'v': derived_version
         }
+
+    def compute_thresholds(self, target_level, source_level, bound_level):
+        """Computes thresholds of random words for keeping the value of source version when
+            deriving a version at target level. Thresholds are cached since they only depend
+            on the levels.
+
+        Args:
+            target_level (float): The target level to produce new version at it.
+            source_level (float): The nearest looser level which has a version.
+            bound_level (float): The nearest stricter level which has a version or None.
+
+        Returns:
+            (float,) | (float, float): Single threshold if there is no bounding version and
+                thresholds for equal and different values of versions otherwise.
+        """
+        key = (target_level, source_level, bound_level)
+        if key not in self.thresholds:
+            q_target = self.compute_q(target_level)
+            q_s = self.compute_q(source_level)
+            if bound_level is None:
+                probabilities = ((q_s + q_target) / (2 * q_s),)
+            else:
+                q_i = self.compute_q(bound_level)
+                f_1, g_1 = self.compute_fg(q_s, q_target, q_i, 1)
+                f_2, g_2 = self.compute_fg(q_s, q_target, q_i, 2)
+                probabilities = ((1 + f_1 + g_1) / 2, (1 + f_2 - g_2) / 2)
+            self.thresholds[key] = tuple(RandomSource.threshold(p) for p in probabilities)
+        return self.thresholds[key]
+
+    def derive_batch(self, target_level, source_level, z_sup, bound_level=None, z_inf=None):
+        """Derives versions at target level for many users at once.
+
+        Args:
+            target_level (float): The target level to produce new versions at it.
+            source_level (float): The nearest looser level which all users have a version at it.
+            z_sup (int8[][]): N * M matrix of versions at source level.
+            bound_level (float): The nearest stricter level which all users have a version at it
+                or None if there is no such level.
+            z_inf (int8[][]): N * M matrix of versions at bound level.
+
+        Returns:
+            int8[][]: N * M matrix of derived versions.
+        """
+        z_sup = np.asarray(z_sup)
+        p = self.rng.words(z_sup.shape)
+        if bound_level is None:
+            (threshold,) = self.compute_thresholds(target_level, source_level, None)
+            return np.where(p < threshold, z_sup, -z_sup)
+        threshold1, threshold2 = self.compute_thresholds(target_level, source_level, bound_level)
+        z_inf = np.asarray(z_inf)
+        return np.where(z_sup == z_inf,
+                        np.where(p < threshold1, z_sup, -z_sup),
+                        np.where(p < threshold2, z_sup, z_inf))
@@ -1,30 +1,96 @@
 """This module implements Data Recycle with Personalized Privacy (DRPP)
 """
+import numpy as np
+from privacy_levels import PrivacyLevels
 from server.replicator.dr import DR
+from server.replicator.version_store import VersionStore
+from server.report_batch import BitSums
+from server.checkpoint import with_prefix, strip_prefix
+from server.instrumentation import Instrumentation
 
 
 class DRPP:
     """This class implements DRPP algorithm.
     """
 
-    def __init__(self, data, levels):
+    def __init__(self, levels, rng=None, instrumentation=None):
         """Initialize the DRPP module
 
         Args:
-            data ({eps: [{userID: id, value: {v: val, h: heights}}, ...]}): Contains a dictionary of
-                privacy budget where each privacy budget is a list of users and values which
-                are selected that level. 
-
             levels (float[]): The array of privacy budgets which denotes available levels.
+            rng (RandomSource): Source of randomness of derivations.
+            instrumentation (Instrumentation): Collector of metrics.
+        """
+        self.levels = PrivacyLevels.of(levels)
+        # Collector of metrics.
+        self.instrumentation = instrumentation or Instrumentation()
+        self.recycle_module = DR(levels, rng)
+        # Private versions of users which is kept across rounds.
+        self.private_version_set = None
+        # Slot of user and level of each report of current round as lists of chunks.
+        self.slots = []
+        self.level_index = []
+
+    def new_data_set(self, data):
+        """Get the data of new round and reset private versions to reported ones.
+
+        Args:
+            data (ReportBatch): Reports of the round.
         """
-        self.data = data
-        self.recycle_module = DR(levels)
-        self.private_version_set = {}
-        for eps in self.data:
-            for element in self.data[eps]:
-                self.private_version_set[element['userID']] = {
-                    eps: element['value']
-                }
+        self.new_round()
+        self.ingest(data)
+
+    def new_round(self):
+        """Forget private versions of previous round.
+        """
+        if self.private_version_set is not None:
+            self.private_version_set.new_round()
+        self.slots = []
+        self.level_index = []
+
+    def ingest(self, data):
+        """Get some reports of current round and store them as private versions.
+
+        Args:
+            data (ReportBatch): Reports of some users.
+        """
+        if self.private_version_set is None:
+            self.private_version_set = VersionStore(len(self.levels), data.M)
+        slots = self.private_version_set.slots_of(data.user_ids)
+        self.private_version_set.add(slots, data.level_index, data.v, data.h)
+        self.slots.append(slots)
+        self.level_index.append(data.level_index)
+
+    def get_state(self):
+        """Returns the state of replicator in the current round.
+
+        Returns:
+            {str: object}: Private versions, reports of the round and state of randomness.
+        """
+        state = with_prefix('rng', self.recycle_module.rng.get_state())
+        if self.private_version_set is not None:
+            state['M'] = self.private_version_set.M
+            state.update(with_prefix('versions', self.private_version_set.get_state()))
+            state['slots'] = np.concatenate(self.slots or [np.zeros(0, dtype=np.int64)])
+            state['level_index'] = np.concatenate(self.level_index or
+                                                  [np.zeros(0, dtype=np.int64)])
+        return state
+
+    def set_state(self, state):
+        """Restores a state which is returned by get_state.
+
+        Args:
+            state ({str: object}): The state.
+        """
+        self.recycle_module.rng.set_state(strip_prefix('rng', state))
+        self.private_version_set = None
+        self.slots = []
+        self.level_index = []
+        if 'M' in state:
+            self.private_version_set = VersionStore(len(self.levels), state['M'])
+            self.private_version_set.set_state(strip_prefix('versions', state))
+            self.slots = [np.asarray(state['slots'])]
+            self.level_index = [np.asarray(state['level_index'])]
 
     def recycle(self, target_level):
         """derives level-dp version from data of users with looser privacy
@@ -32,16 +98,35 @@ class DRPP:
 
         Args:
             level (float): The target level to expand it.
+
+        Returns:
+            [(float, BitSums)]: Statistics of derived versions along with their epsilon
+                which is the target level.
         """
-        expanded_group = self.data[target_level].copy()
-        replicated_group = []
-        for level in self.data:
-            if level > target_level:
-                for user in self.data[level]:
-                    derived_version = self.recycle_module.derive(
-                        self.private_version_set[user['userID']], target_level)
-                    self.private_version_set[user['userID']][target_level] = derived_version
-                    expanded_group.append(
-                        {'userID': user['userID'], 'value': derived_version})
-                    replicated_group.append({'userID': user['userID'], 'value': derived_version})
-        return expanded_group, replicated_group
+        target = self.levels.index(target_level)
+        store = self.private_version_set
+        # No report is ingested in this round:
+        if store is None or not self.slots:
+            return []
+        if len(self.slots) > 1:
+            self.slots = [np.concatenate(self.slots)]
+            self.level_index = [np.concatenate(self.level_index)]
+        slots = self.slots[0][self.level_index[0] > target]
+        supremum, infimum = store.nearest(slots, target)
+        missing = infimum != supremum
+        # Users with the same nearest versions are derived together:
+        pairs, group_of = np.unique(infimum[missing] * (len(self.levels) + 1) + supremum[missing] + 1,
+                                    return_inverse=True)
+        for group, pair in enumerate(pairs.tolist()):
+            group_slots = slots[missing][group_of == group]
+            inf_level, sup_level = divmod(pair, len(self.levels) + 1)
+            sup_level -= 1
+            self.instrumentation.count('drpp.derived_versions', len(group_slots))
+            with self.instrumentation.stage('drpp.derive'):
+                derived = self.recycle_module.derive_batch(
+                    target_level, self.levels[inf_level], store.get(group_slots, inf_level),
+                    None if sup_level < 0 else self.levels[sup_level],
+                    None if sup_level < 0 else store.get(group_slots, sup_level))
+            store.put(group_slots, target, derived)
+        sums = BitSums.from_reports(store.get(slots, target), store.h[slots])
+        return [(target_level, sums)]
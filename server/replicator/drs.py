@@ -1,27 +1,148 @@
 """This module implements Data Recycle by Sampling (DRS)
 """
-import numpy as np
 import math
+import numpy as np
+from privacy_levels import PrivacyLevels
+from randomness import default_source
+from server.report_batch import BitSums
+from server.replicator.reservoir import Reservoir
+from server.replicator.report_store import ReportStore
+from server.checkpoint import with_prefix, strip_prefix
+from server.instrumentation import Instrumentation
 
 
 class DRS:
     """This class implements DRS algorithm.
     """
 
-    def __init__(self, data, levels):
+    def __init__(self, levels, rng=None, reservoir_size=None, instrumentation=None):
         """Initialize the DRS module
 
         Args:
-            data ({eps: [{userID: id, value: {v: val, h: heights}}, ...]}): Contains a dictionary of
-                privacy budget where each privacy budget is a list of users and values which
-                are selected that level. 
-
             levels (float[]): The array of privacy budgets which denotes available levels.
+            rng (RandomSource): Source of randomness of sampling.
+            reservoir_size (int): If given, each level only keeps a Reservoir of this size
+                instead of all of its reports, so memory does not grow with population.
+                Samples are exact while either the sample or the rest of the level fits in
+                the reservoir. Otherwise the reservoir sample of reservoir_size reports is
+                used, so its statistics carry the real number of sampled reports.
+            instrumentation (Instrumentation): Collector of metrics.
+        """
+        self.levels = PrivacyLevels.of(levels)
+        self.rng = rng or default_source()
+        self.reservoir_size = reservoir_size
+        # Collector of metrics.
+        self.instrumentation = instrumentation or Instrumentation()
+        # Reservoir of each level in bounded-memory mode.
+        self.reservoirs = None
+        # Bit-packed reports of each level in current round.
+        self.stores = None
+        # Replicated statistics of each target level as a list of (eps, BitSums) pairs.
+        self.sampledData = {}
+
+    def new_data_set(self, data):
+        """Get the data of new round and forget samples of previous round.
+
+        Args:
+            data (ReportBatch): Reports of the round.
+        """
+        self.new_round()
+        self.ingest(data)
+
+    def new_round(self):
+        """Forget reports and samples of previous round.
+        """
+        self.stores = None
+        self.reservoirs = None
+        self.sampledData = {}
+
+    def ingest(self, data):
+        """Get some reports of current round.
+
+        Args:
+            data (ReportBatch): Reports of some users.
         """
-        self.data = data
+        if self.reservoir_size is not None and self.reservoirs is None:
+            self.reservoirs = [Reservoir(data.M, self.reservoir_size, self.rng)
+                               for _ in self.levels]
+        if self.reservoir_size is None and self.stores is None:
+            self.stores = [ReportStore(data.M) for _ in self.levels]
+        for level in np.flatnonzero(data.level_counts(len(self.levels))).tolist():
+            rows = np.flatnonzero(data.level_index == level)
+            v, h = np.take(data.v, rows, axis=0), np.take(data.h, rows, axis=0)
+            if self.reservoirs is not None:
+                self.reservoirs[level].add(v, h)
+            else:
+                self.stores[level].add(v, h)
         self.sampledData = {}
-        for eps in self.data:
-            self.sampledData[eps] = np.array([])
+
+    def get_state(self):
+        """Returns the state of replicator in the current round.
+
+        Returns:
+            {str: object}: Stores or reservoirs of each level and state of randomness.
+        """
+        state = with_prefix('rng', self.rng.get_state())
+        state['reservoir_size'] = self.reservoir_size
+        state['reservoirs'] = self.reservoirs is not None
+        state['M'] = self.stores[0].M if self.stores is not None else None
+        for level in range(len(self.levels)):
+            if self.reservoirs is not None:
+                state.update(with_prefix(f'reservoirs.{level}', self.reservoirs[level].get_state()))
+            elif self.stores is not None:
+                state.update(with_prefix(f'stores.{level}', self.stores[level].get_state()))
+        return state
+
+    def set_state(self, state):
+        """Restores a state which is returned by get_state.
+
+        Args:
+            state ({str: object}): The state.
+        """
+        self.rng.set_state(strip_prefix('rng', state))
+        self.new_round()
+        self.reservoir_size = state['reservoir_size']
+        if state['reservoirs']:
+            self.reservoirs = []
+            for level in range(len(self.levels)):
+                reservoir_state = strip_prefix(f'reservoirs.{level}', state)
+                reservoir = Reservoir(reservoir_state['low_v'].shape[1], self.reservoir_size,
+                                      self.rng)
+                reservoir.set_state(reservoir_state)
+                self.reservoirs.append(reservoir)
+        elif state['M'] is not None:
+            self.stores = [ReportStore(state['M']) for _ in self.levels]
+            for level, store in enumerate(self.stores):
+                store.set_state(strip_prefix(f'stores.{level}', state))
+
+    def sample(self):
+        """Samples reports of every level for all stricter target levels.
+            A single random permutation is drawn for each source level and since sample
+            sizes floor(target/level * n) grow with target, samples of all targets are nested
+            prefixes of it. So statistics of each target are computed from statistics of the
+            previous target and the reports which are newly added to the prefix.
+        """
+        self.sampledData = {lvl: [] for lvl in self.levels}
+        if self.reservoirs is not None:
+            for source, level in enumerate(self.levels):
+                reservoir = self.reservoirs[source]
+                for target_level in self.levels[:source]:
+                    sampleSize = math.floor(target_level/level * reservoir.count)
+                    self.sampledData[target_level].append((level, reservoir.sample(sampleSize)))
+            return
+        if self.stores is None:
+            return
+        for source, level in enumerate(self.levels):
+            store = self.stores[source]
+            order = self.rng.permutation(len(store))
+            sums = BitSums.zeros(store.M)
+            taken = 0
+            for target_level in self.levels[:source]:
+                sampleSize = math.floor(target_level/level * len(store))
+                added = order[taken:sampleSize]
+                sums = store.sums(added).add(sums)
+                taken = sampleSize
+                self.sampledData[target_level].append((level, sums))
 
     def recycle(self, target_level):
         """derives level-dp version from data of users with looser privacy
@@ -29,22 +150,12 @@ class DRS:
 
         Args:
             level (float): The target level to expand it.
-        """
-
-        expanded_group = self.data[target_level].copy()
-        if self.sampledData[target_level].size != 0:
-            # We already runned this algorithm for this target_level:
-            return expanded_group + self.sampledData[target_level].tolist(), self.sampledData[target_level].tolist()
-
-        sampledGroup = np.array([])
-        for level in self.data:
-            if level > target_level:
-                levelData = np.array(self.data[level])
-                sampleSize = math.floor(target_level/level * len(self.data[level]))
-                sampledDataAtThisLevel = np.random.choice(levelData, sampleSize, replace=False)
-                for user in sampledDataAtThisLevel:
-                    user['eps'] = level
-                sampledGroup = np.concatenate((sampledGroup, sampledDataAtThisLevel))
-        self.sampledData[target_level] = sampledGroup
-        return expanded_group + self.sampledData[target_level].tolist(), self.sampledData[target_level].tolist()
 
+        Returns:
+            [(float, BitSums)]: Statistics of sampled reports of each looser level along
+                with epsilon of that level.
+        """
+        if not self.sampledData:
+            with self.instrumentation.stage('drs.sample'):
+                self.sample()
+        return self.sampledData[target_level]
@@ -0,0 +1,172 @@
+"""This module implements a bit-packed store of the reports of a level which DRS keeps for
+    sampling.
+"""
+import numpy as np
+from server.report_batch import BIT_TABLE, BitSums, pack_rows
+
+
+def bit_counts(packed, M):
+    """Counts set bits of each column of packed rows.
+
+    Args:
+        packed (uint8[][]): Rows of bits which are packed by np.packbits along the rows.
+        M (int): Number of bits of each row.
+
+    Returns:
+        int[]: Number of rows where each of M bits is set.
+    """
+    histograms = np.stack([np.bincount(column, minlength=256) for column in packed.T])
+    return (histograms @ BIT_TABLE).ravel()[:M]
+
+
+class ReportStore:
+    """Reports of a level where values are kept as bits which are 1 for v = 1, and heights
+        are kept as bits which are 1 for roots (h > 0) along with the height of roots.
+        Clients report every root of a round at the same height, so the height is a single
+        number and this keeps 2 bits per reported bit instead of 2 bytes. Otherwise the
+        height of roots of each report is kept, and reports whose roots have different
+        heights switch the store to keeping full heights.
+    """
+
+    # Arrays of reports which are kept in checkpoints.
+    STATE_ARRAYS = ('v', 'root', 'height')
+
+    def __init__(self, M):
+        """Initialize an empty store.
+
+        Args:
+            M (int): Number of bits of reports.
+        """
+        self.M = M
+        # Number of reports.
+        self.count = 0
+        # Packed values, packed roots and height of roots as lists of chunks. Height of a
+        #   chunk is a scalar if all of its roots have the same height.
+        self.v = []
+        self.root = []
+        self.height = []
+        # Full heights as a list of chunks if roots of a report have different heights.
+        self.h = None
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        """Number of bytes of kept reports."""
+        chunks = self.v + self.root + self.height + (self.h or [])
+        return sum(chunk.nbytes for chunk in chunks)
+
+    def add(self, v, h):
+        """Add some reports.
+
+        Args:
+            v (int8[][]): Reported values which are either 1 or -1.
+            h (uint8[][]): Reported heights.
+        """
+        if len(v) == 0:
+            return
+        self.count += len(v)
+        self.v.append(pack_rows(v > 0))
+        self.root.append(pack_rows(h > 0))
+        shared = h.max()
+        if np.all((h == 0) | (h == shared)):
+            # Clients report every root of a round at the same height:
+            self.height.append(np.asarray(shared, dtype=np.uint8))
+            if self.h is not None:
+                self.h.append(np.asarray(h, dtype=np.uint8))
+            return
+        height = np.max(h, axis=1)
+        roots = np.unique(height[height > 0])
+        self.height.append(np.asarray(roots[0] if len(roots) else 0, dtype=np.uint8)
+                           if len(roots) <= 1 else height)
+        if self.h is None and np.any((h > 0) & (h != height[:, np.newaxis])):
+            self.h = [np.unpackbits(root, axis=1, count=self.M) *
+                      np.broadcast_to(height, len(root))[:, np.newaxis]
+                      for root, height in zip(self.root[:-1], self.height[:-1])]
+        if self.h is not None:
+            self.h.append(np.asarray(h, dtype=np.uint8))
+
+    def compact(self):
+        """Joins chunks, so rows of the store can be selected.
+        """
+        if len(self.height) > 1:
+            shared = {int(height) for height in self.height if height.ndim == 0 and height > 0}
+            if len(shared) <= 1 and all(height.ndim == 0 for height in self.height):
+                self.height = [np.asarray(shared.pop() if shared else 0, dtype=np.uint8)]
+            else:
+                self.height = [np.concatenate([
+                    np.broadcast_to(height, len(v)) for v, height in zip(self.v, self.height)])]
+        for name in ('v', 'root') + (('h',) if self.h is not None else ()):
+            chunks = getattr(self, name)
+            if len(chunks) > 1:
+                setattr(self, name, [np.concatenate(chunks)])
+
+    def arrays(self):
+        """Returns all kept reports.
+
+        Returns:
+            {str: ndarray}: The single chunk of each array of reports.
+        """
+        self.compact()
+        packed = (len(self.v[0]) if self.v else 0, (self.M + 7) // 8)
+        arrays = {
+            'v': self.v[0] if self.v else np.zeros(packed, dtype=np.uint8),
+            'root': self.root[0] if self.root else np.zeros(packed, dtype=np.uint8),
+            'height': self.height[0] if self.height else np.zeros((), dtype=np.uint8),
+        }
+        if self.h is not None:
+            arrays['h'] = self.h[0]
+        return arrays
+
+    def sums(self, rows):
+        """Statistics of some reports which are computed from the packed bits.
+
+        Args:
+            rows (int[]): Rows of the reports.
+
+        Returns:
+            BitSums: Statistics of the selected reports.
+        """
+        arrays = self.arrays()
+        if 'h' in arrays:
+            v = np.unpackbits(arrays['v'][rows], axis=1, count=self.M).view(np.int8) * 2 - 1
+            return BitSums.from_reports(v, arrays['h'][rows])
+        v = arrays['v'][rows]
+        root = arrays['root'][rows]
+        N = len(v)
+        positive = bit_counts(v, self.M)
+        roots = bit_counts(root, self.M)
+        positive_roots = bit_counts(v & root, self.M)
+        last_root = np.zeros(self.M, dtype=np.int64)
+        if arrays['height'].ndim == 0:
+            last_root[roots > 0] = arrays['height']
+        else:
+            height = arrays['height'][rows]
+            # Larger heights come later and overwrite smaller ones.
+            for value in np.unique(height[height > 0]).tolist():
+                selected = height == value
+                last_root[bit_counts(root[selected], self.M) > 0] = value
+        return BitSums(2 * (positive - positive_roots) - (N - roots), N - roots,
+                       2 * positive_roots - roots, roots, last_root)
+
+    def get_state(self):
+        """Returns the state of store.
+
+        Returns:
+            {str: object}: Kept reports.
+        """
+        state = {'count': self.count, 'full_heights': self.h is not None}
+        state.update(self.arrays())
+        return state
+
+    def set_state(self, state):
+        """Restores a state which is returned by get_state.
+
+        Args:
+            state ({str: object}): The state.
+        """
+        self.count = state['count']
+        for name in self.STATE_ARRAYS:
+            setattr(self, name, [state[name]] if self.count else [])
+        self.h = [state['h']] if state['full_heights'] else None
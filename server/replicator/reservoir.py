@@ -0,0 +1,142 @@
+"""This module implements a bounded-memory sample of the reports of a level which DRS
+    uses instead of keeping every report of the round.
+"""
+import numpy as np
+from server.report_batch import BitSums
+
+
+class Reservoir:
+    """Online sample of a stream of reports.
+        Each report gets a random key and the reports with the `size` smallest and the
+        `size` largest keys are kept along with statistics of all reports. Sorting reports
+        by key is a uniformly random order, so the reports with the s smallest keys are a
+        uniform sample of size s. Such a sample is exact if s <= size (the smallest keys)
+        or s >= count - size (all reports except the largest keys). Larger samples are
+        replaced by the sample of the `size` smallest keys, whose counts are the real
+        number of reports, so the estimator does not understate their variance.
+    """
+
+    # Arrays of kept reports which are kept in checkpoints.
+    STATE_ARRAYS = ('low_keys', 'low_v', 'low_h', 'high_keys', 'high_v', 'high_h')
+
+    def __init__(self, M, size, rng):
+        """Initialize an empty reservoir.
+
+        Args:
+            M (int): Number of bits of reports.
+            size (int): Number of reports which are kept at each end of the order.
+            rng (RandomSource): Source of random keys.
+        """
+        if size < 1:
+            raise ValueError('Error! Size of reservoir should be positive')
+        self.M = M
+        self.size = size
+        self.rng = rng
+        # Number of reports which are added.
+        self.count = 0
+        # Statistics of all reports which are added.
+        self.total = BitSums.zeros(M)
+        # Keys, values and heights of reports with smallest (low) and largest (high) keys:
+        self.low_keys = np.zeros(0, dtype=np.uint32)
+        self.low_v = np.zeros([0, M], dtype=np.int8)
+        self.low_h = np.zeros([0, M], dtype=np.uint8)
+        self.high_keys = np.zeros(0, dtype=np.uint32)
+        self.high_v = np.zeros([0, M], dtype=np.int8)
+        self.high_h = np.zeros([0, M], dtype=np.uint8)
+
+    def add(self, v, h):
+        """Add some reports to the stream.
+
+        Args:
+            v (int8[][]): Reported values.
+            h (uint8[][]): Reported heights.
+        """
+        if len(v) == 0:
+            return
+        keys = self.rng.words(len(v))
+        self.count += len(v)
+        self.total.add(BitSums.from_reports(v, h))
+        self.low_keys, self.low_v, self.low_h = self.keep(
+            self.low_keys, self.low_v, self.low_h, keys, v, h, True)
+        self.high_keys, self.high_v, self.high_h = self.keep(
+            self.high_keys, self.high_v, self.high_h, keys, v, h, False)
+
+    def keep(self, kept_keys, kept_v, kept_h, keys, v, h, smallest):
+        """Merges new reports with kept reports of one end of the order.
+
+        Args:
+            kept_keys (uint32[]): Keys of kept reports.
+            kept_v (int8[][]): Values of kept reports.
+            kept_h (uint8[][]): Heights of kept reports.
+            keys (uint32[]): Keys of new reports.
+            v (int8[][]): Values of new reports.
+            h (uint8[][]): Heights of new reports.
+            smallest (bool): Keeps smallest keys if true and largest keys otherwise.
+
+        Returns:
+            (uint32[], int8[][], uint8[][]): Keys, values and heights which are kept.
+        """
+        if len(kept_keys) == self.size:
+            # Only new reports beyond the current bound can enter a full reservoir.
+            candidates = keys < kept_keys.max() if smallest else keys > kept_keys.min()
+            keys, v, h = keys[candidates], v[candidates], h[candidates]
+            if len(keys) == 0:
+                return kept_keys, kept_v, kept_h
+        keys = np.concatenate((kept_keys, keys))
+        v = np.concatenate((kept_v, v))
+        h = np.concatenate((kept_h, h))
+        if len(keys) <= self.size:
+            return keys, v, h
+        if smallest:
+            rows = np.argpartition(keys, self.size - 1)[:self.size]
+        else:
+            rows = np.argpartition(keys, len(keys) - self.size)[len(keys) - self.size:]
+        return keys[rows], v[rows], h[rows]
+
+    def sample(self, sample_size):
+        """Statistics of the reports with sample_size smallest keys.
+
+        Args:
+            sample_size (int): Size of the sample.
+
+        Returns:
+            BitSums: Statistics of the sample, or of the reports with the smallest keys
+                if the sample cannot be computed exactly.
+        """
+        if sample_size <= len(self.low_keys):
+            rows = np.argsort(self.low_keys, kind='stable')[:sample_size]
+            return BitSums.from_reports(self.low_v[rows], self.low_h[rows])
+        excluded = self.count - sample_size
+        if excluded <= len(self.high_keys):
+            rows = np.argsort(self.high_keys, kind='stable')[len(self.high_keys) - excluded:]
+            high = BitSums.from_reports(self.high_v[rows], self.high_h[rows])
+            return BitSums(self.total.sum_v_of1 - high.sum_v_of1,
+                           self.total.sum_of_users_of1 - high.sum_of_users_of1,
+                           self.total.sum_v_ofh - high.sum_v_ofh,
+                           self.total.sum_of_users_ofh - high.sum_of_users_ofh,
+                           self.total.last_root)
+        return BitSums.from_reports(self.low_v, self.low_h)
+
+    def get_state(self):
+        """Returns the state of reservoir.
+
+        Returns:
+            {str: object}: Count, statistics and kept reports.
+        """
+        state = {'count': self.count}
+        for name in self.STATE_ARRAYS:
+            state[name] = getattr(self, name)
+        for name, value in vars(self.total).items():
+            state['total_' + name] = value
+        return state
+
+    def set_state(self, state):
+        """Restores a state which is returned by get_state.
+
+        Args:
+            state ({str: object}): The state.
+        """
+        self.count = state['count']
+        for name in self.STATE_ARRAYS:
+            setattr(self, name, state[name])
+        self.total = BitSums(*(state['total_' + name] for name in vars(self.total)))
@@ -0,0 +1,186 @@
+"""This module implements a compact store of private versions of users which is used by DRPP.
+"""
+import numpy as np
+
+
+def highest_set_bit(masks):
+    """Finds position of the highest set bit of each mask.
+
+    Args:
+        masks (int[]): Bit masks smaller than 2^53.
+
+    Returns:
+        int[]: Position of highest set bit or -1 if mask is zero.
+    """
+    return np.frexp(np.asarray(masks, dtype=np.float64))[1].astype(np.int64) - 1
+
+
+def lowest_set_bit(masks):
+    """Finds position of the lowest set bit of each mask.
+
+    Args:
+        masks (int[]): Bit masks smaller than 2^53.
+
+    Returns:
+        int[]: Position of lowest set bit or -1 if mask is zero.
+    """
+    masks = np.asarray(masks, dtype=np.int64)
+    return highest_set_bit(masks & -masks)
+
+
+class VersionStore:
+    """Keeps versions of every user at every level in dense arrays indexed by user slot.
+        Versions of a level are rows of an int8 matrix, heights are shared among versions
+        of a user and a bit mask per user tells at which levels a version exists.
+    """
+
+    def __init__(self, L, M, capacity=1024):
+        """Initialize an empty store.
+
+        Args:
+            L (int): Number of levels which should be at most 53.
+            M (int): Number of bits of each version.
+            capacity (int): Number of slots to allocate at first.
+        """
+        if L > 53:
+            raise ValueError(f'Error! At most 53 levels are supported: {L}')
+        self.L = L
+        self.M = M
+        # Sorted IDs of known users and their slots.
+        self.user_ids = np.zeros(0, dtype=np.int64)
+        self.user_slots = np.zeros(0, dtype=np.int64)
+        # Number of used slots.
+        self.size = 0
+        # v[l][slot] is the version of user at l'th level.
+        self.v = np.zeros([L, capacity, M], dtype=np.int8)
+        # Heights of reports of each user which are the same for all of its versions.
+        self.h = np.zeros([capacity, M], dtype=np.uint8)
+        # Bit l of present[slot] is set if user has a version at l'th level.
+        self.present = np.zeros(capacity, dtype=np.int64)
+
+    def grow(self, capacity):
+        """Reallocate arrays to have room for given number of slots.
+
+        Args:
+            capacity (int): The new number of slots.
+        """
+        v = np.zeros([self.L, capacity, self.M], dtype=np.int8)
+        v[:, :self.size] = self.v[:, :self.size]
+        h = np.zeros([capacity, self.M], dtype=np.uint8)
+        h[:self.size] = self.h[:self.size]
+        present = np.zeros(capacity, dtype=np.int64)
+        present[:self.size] = self.present[:self.size]
+        self.v, self.h, self.present = v, h, present
+
+    def get_state(self):
+        """Returns versions of used slots.
+
+        Returns:
+            {str: object}: Known users, their slots and versions.
+        """
+        return {'size': self.size, 'user_ids': self.user_ids, 'user_slots': self.user_slots,
+                'v': self.v[:, :self.size], 'h': self.h[:self.size],
+                'present': self.present[:self.size]}
+
+    def set_state(self, state):
+        """Restores a state which is returned by get_state.
+
+        Args:
+            state ({str: object}): The state.
+        """
+        self.size = 0
+        self.grow(max(state['size'], 1))
+        self.size = state['size']
+        self.user_ids = np.asarray(state['user_ids'])
+        self.user_slots = np.asarray(state['user_slots'])
+        self.v[:, :self.size] = state['v']
+        self.h[:self.size] = state['h']
+        self.present[:self.size] = state['present']
+
+    def slots_of(self, user_ids):
+        """Finds slots of users and assigns new slots to unknown users.
+
+        Args:
+            user_ids (int[]): Distinct IDs of users.
+
+        Returns:
+            int[]: Slot of each user.
+        """
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        position = np.searchsorted(self.user_ids, user_ids)
+        known = position < len(self.user_ids)
+        known[known] = self.user_ids[position[known]] == user_ids[known]
+        slots = np.empty(len(user_ids), dtype=np.int64)
+        slots[known] = self.user_slots[position[known]]
+        if known.all():
+            return slots
+        new_ids = user_ids[~known]
+        new_slots = np.arange(self.size, self.size + len(new_ids), dtype=np.int64)
+        slots[~known] = new_slots
+        if self.size + len(new_ids) > len(self.present):
+            self.grow(max(2 * len(self.present), self.size + len(new_ids)))
+        self.size += len(new_ids)
+        ids = np.concatenate((self.user_ids, new_ids))
+        order = np.argsort(ids, kind='stable')
+        self.user_ids = ids[order]
+        self.user_slots = np.concatenate((self.user_slots, new_slots))[order]
+        return slots
+
+    def new_round(self):
+        """Forgets versions of previous round.
+        """
+        self.present[:self.size] = 0
+
+    def add(self, slots, level_index, v, h):
+        """Stores reported versions of this round.
+
+        Args:
+            slots (int[]): Slot of each reporting user.
+            level_index (int[]): Level of each report.
+            v (int8[][]): Reported versions.
+            h (uint8[][]): Reported heights.
+        """
+        self.h[slots] = h
+        for level in np.flatnonzero(np.bincount(level_index, minlength=self.L)).tolist():
+            rows = np.flatnonzero(level_index == level)
+            self.put(slots[rows], level, np.take(v, rows, axis=0))
+
+    def put(self, slots, level, v):
+        """Stores versions of users at given level.
+
+        Args:
+            slots (int[]): Slots of users.
+            level (int): Index of level of versions.
+            v (int8[][]): The versions.
+        """
+        self.v[level, slots] = v
+        self.present[slots] |= 1 << level
+
+    def get(self, slots, level):
+        """Returns versions of users at given level.
+
+        Args:
+            slots (int[]): Slots of users.
+            level (int): Index of level of versions.
+
+        Returns:
+            int8[][]: The versions.
+        """
+        return self.v[level, slots]
+
+    def nearest(self, slots, level):
+        """Finds the nearest existing versions around given level for each user.
+
+        Args:
+            slots (int[]): Slots of users.
+            level (int): Index of the level.
+
+        Returns:
+            (int[], int[]): Index of nearest level at or below given level and nearest level at
+                or above it respectively where -1 means there is no such version.
+        """
+        present = self.present[slots]
+        lower = highest_set_bit(present & ((2 << level) - 1))
+        upper = lowest_set_bit(present >> level)
+        upper[upper >= 0] += level
+        return lower, upper
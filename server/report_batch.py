@@ -0,0 +1,264 @@
+"""This module implements columnar containers for reports of a round and the per bit
+    sufficient statistics which the estimators need from them.
+"""
+import numpy as np
+from privacy_levels import PrivacyLevels
+
+# BIT_TABLE[byte, k] is the k'th bit of byte in the order of np.packbits.
+BIT_TABLE = np.unpackbits(np.arange(256, dtype=np.uint8)[:, np.newaxis], axis=1).astype(np.int64)
+
+
+def pack_rows(bits):
+    """Packs bits of each row like np.packbits(bits, axis=1), which is much slower than
+        packing a flat array.
+
+    Args:
+        bits (bool[][]): N * M matrix of bits.
+
+    Returns:
+        uint8[][]: N * ceil(M / 8) matrix of packed rows.
+    """
+    N, M = bits.shape
+    if M % 8:
+        padded = np.zeros((N, M + 8 - M % 8), dtype=bool)
+        padded[:, :M] = bits
+        bits = padded
+    return np.packbits(np.ascontiguousarray(bits).ravel()).reshape(N, bits.shape[1] // 8)
+
+
+def level_bit_counts(packed, level_index, L, M):
+    """Counts set bits of each column of packed rows for each level.
+
+    Args:
+        packed (uint8[][]): Rows of bits which are packed by pack_rows.
+        level_index (int[]): Index of the level of each row.
+        L (int): Number of levels.
+        M (int): Number of bits of each row.
+
+    Returns:
+        int[][]: L * M matrix of number of rows of each level where each bit is set.
+    """
+    key = level_index * 256
+    counts = np.empty((L, packed.shape[1] * 8), dtype=np.int64)
+    for column in range(packed.shape[1]):
+        histograms = np.bincount(key + packed[:, column], minlength=L * 256).reshape(L, 256)
+        counts[:, column * 8:(column + 1) * 8] = histograms @ BIT_TABLE
+    return counts[:, :M]
+
+
+class BitSums:
+    """Sufficient statistics of reports for each bit (or each level and bit).
+        Leaf reports (h = 0) and root reports (h > 0) are kept separately and values are
+        not calibrated yet since calibration depends on the epsilon of reports.
+    """
+
+    def __init__(self, sum_v_of1, sum_of_users_of1, sum_v_ofh, sum_of_users_ofh, last_root):
+        # Sum of values of users who reported leaf node.
+        self.sum_v_of1 = np.asarray(sum_v_of1, dtype=np.float64)
+        # Number of users who reported leaf node.
+        self.sum_of_users_of1 = np.asarray(sum_of_users_of1, dtype=np.int64)
+        # Sum of values of users who reported root node.
+        self.sum_v_ofh = np.asarray(sum_v_ofh, dtype=np.float64)
+        # Number of users who reported root node.
+        self.sum_of_users_ofh = np.asarray(sum_of_users_ofh, dtype=np.int64)
+        # The largest reported height.
+        self.last_root = np.asarray(last_root, dtype=np.int64)
+
+    @classmethod
+    def zeros(cls, shape):
+        """Creates empty statistics.
+
+        Args:
+            shape (int|tuple): Shape of each statistic.
+
+        Returns:
+            BitSums: Statistics of no report.
+        """
+        return cls(np.zeros(shape), np.zeros(shape), np.zeros(shape), np.zeros(shape),
+                   np.zeros(shape))
+
+    @classmethod
+    def from_reports(cls, v, h):
+        """Reduces reports to statistics of each bit.
+
+        Args:
+            v (int8[][]): N * M matrix of reported values which are either 1 or -1.
+            h (uint8[][]): N * M matrix of reported heights.
+
+        Returns:
+            BitSums: Statistics of each of M bits.
+        """
+        root = h > 0
+        sum_of_users_ofh = np.count_nonzero(root, axis=0)
+        sum_v_ofh = np.sum(v, axis=0, where=root, dtype=np.int64)
+        sum_v_of1 = np.sum(v, axis=0, dtype=np.int64) - sum_v_ofh
+        last_root = np.max(h, axis=0, initial=0)
+        return cls(sum_v_of1, len(v) - sum_of_users_ofh, sum_v_ofh, sum_of_users_ofh, last_root)
+
+    def __getitem__(self, index):
+        return BitSums(self.sum_v_of1[index], self.sum_of_users_of1[index],
+                       self.sum_v_ofh[index], self.sum_of_users_ofh[index],
+                       self.last_root[index])
+
+    def add(self, other):
+        """Adds statistics of other reports to this one.
+
+        Args:
+            other (BitSums): Statistics with the same shape.
+
+        Returns:
+            BitSums: This object.
+        """
+        self.sum_v_of1 = self.sum_v_of1 + other.sum_v_of1
+        self.sum_of_users_of1 = self.sum_of_users_of1 + other.sum_of_users_of1
+        self.sum_v_ofh = self.sum_v_ofh + other.sum_v_ofh
+        self.sum_of_users_ofh = self.sum_of_users_ofh + other.sum_of_users_ofh
+        self.last_root = np.maximum(self.last_root, other.last_root)
+        return self
+
+
+class ReportBatch:
+    """Reports of a round stored as contiguous arrays where the i'th row belongs to
+        the i'th report.
+    """
+
+    def __init__(self, user_ids, level_index, v, h):
+        """Initialize the batch.
+
+        Args:
+            user_ids (int[]): ID of the user of each report.
+            level_index (int[]): Index of the privacy level of each report.
+            v (int8[][]): N * M matrix of reported values which are either 1 or -1.
+            h (uint8[][]): N * M matrix of reported heights.
+        """
+        self.user_ids = np.asarray(user_ids)
+        self.level_index = np.asarray(level_index, dtype=np.int64)
+        self.v = np.asarray(v, dtype=np.int8)
+        self.h = np.asarray(h, dtype=np.uint8)
+        if self.v.ndim != 2 or self.v.shape != self.h.shape:
+            raise ValueError('Error! `v` and `h` should be N * M matrices of the same shape')
+        if len(self.user_ids) != len(self.v) or len(self.level_index) != len(self.v):
+            raise ValueError('Error! All columns of a batch should have the same length')
+
+    @property
+    def M(self):
+        """Number of bits of each report."""
+        return self.v.shape[1]
+
+    def __len__(self):
+        return len(self.v)
+
+    @classmethod
+    def from_dict(cls, data, levels, M=None):
+        """Builds a batch from the dictionary format of reports.
+
+        Args:
+            data ({eps: [{userID: id, value: {v: int[], h: int[]}}, ...]}): Contains a dictionary
+                of privacy budget where each privacy budget is a list of users and values which
+                are selected that level.
+            levels (float[]): The array of privacy budgets which denotes available levels.
+            M (int): Number of bits which is only needed if there is no report at all.
+
+        Returns:
+            ReportBatch: The same reports in columnar format.
+        """
+        index_of = PrivacyLevels.of(levels).index_of
+        users = [user for lvl in data for user in data[lvl]]
+        level_index = [index_of[lvl] for lvl in data for _ in data[lvl]]
+        if not users:
+            return cls(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+                       np.zeros([0, M or 0]), np.zeros([0, M or 0]))
+        return cls([user['userID'] for user in users], level_index,
+                   [user['value']['v'] for user in users],
+                   [user['value']['h'] for user in users])
+
+    def to_dict(self, levels):
+        """Converts the batch to the dictionary format of reports.
+
+        Args:
+            levels (float[]): The array of privacy budgets which denotes available levels.
+
+        Returns:
+            {eps: [{userID: id, value: {v: int[], h: int[]}}, ...]}: The same reports.
+        """
+        data = {lvl: [] for lvl in levels}
+        for row, user_id in enumerate(self.user_ids.tolist()):
+            data[levels[self.level_index[row]]].append({
+                'userID': user_id,
+                'value': {
+                    'v': self.v[row].tolist(),
+                    'h': self.h[row].tolist()
+                }
+            })
+        return data
+
+    def take(self, rows):
+        """Selects some reports of the batch.
+
+        Args:
+            rows (slice|int[]): Rows of the selected reports.
+
+        Returns:
+            ReportBatch: The selected reports.
+        """
+        return ReportBatch(self.user_ids[rows], self.level_index[rows], self.v[rows],
+                           self.h[rows])
+
+    @classmethod
+    def concatenate(cls, batches):
+        """Joins batches with the same number of bits.
+
+        Args:
+            batches ([ReportBatch]): The batches.
+
+        Returns:
+            ReportBatch: All reports of batches in order.
+        """
+        if len(batches) == 1:
+            return batches[0]
+        return cls(np.concatenate([batch.user_ids for batch in batches]),
+                   np.concatenate([batch.level_index for batch in batches]),
+                   np.concatenate([batch.v for batch in batches]),
+                   np.concatenate([batch.h for batch in batches]))
+
+    def level_counts(self, L):
+        """Counts reports of each level.
+
+        Args:
+            L (int): Number of levels.
+
+        Returns:
+            int[]: Number of reports at each level.
+        """
+        return np.bincount(self.level_index, minlength=L)
+
+    def level_sums(self, L):
+        """Reduces reports to statistics of each (level, bit) pair. Values and roots are
+            packed to bits and counted with a histogram of bytes of each level.
+
+        Args:
+            L (int): Number of levels.
+
+        Returns:
+            BitSums: Statistics with shape L * M.
+        """
+        M = self.M
+        positive = pack_rows(self.v > 0)
+        root = pack_rows(self.h > 0)
+        positives = level_bit_counts(positive, self.level_index, L, M)
+        roots = level_bit_counts(root, self.level_index, L, M)
+        positive_roots = level_bit_counts(positive & root, self.level_index, L, M)
+        leaves = self.level_counts(L)[:, np.newaxis] - roots
+        last_root = np.zeros((L, M), dtype=np.int64)
+        height = int(self.h.max()) if len(self) else 0
+        if np.all((self.h == 0) | (self.h == height)):
+            # Clients report every root of a round at the same height:
+            last_root[roots > 0] = height
+        else:
+            heights = np.flatnonzero(np.bincount(self.h.ravel(), minlength=256))
+            # Larger heights come later and overwrite smaller ones.
+            for value in heights[heights > 0].tolist():
+                selected = level_bit_counts(pack_rows(self.h == value), self.level_index, L, M)
+                last_root[selected > 0] = value
+        return BitSums(2 * (positives - positive_roots) - leaves, leaves,
+                       2 * positive_roots - roots, roots, last_root)
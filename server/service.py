@@ -0,0 +1,432 @@
+"""This module implements an asyncio service which collects reports of clients over the
+    network and feeds them to a PrivacyFlow.
+
+Each message is a line of JSON with the ID of a user, its privacy budget and the output of
+WrappeedClient.report:
+
+    {"user": 12, "level": 0.5, "report": [[1, -1, ...], [0, 2, ...]]}
+
+Invalid messages are answered with a line `{"error": "..."}` and valid ones are not
+answered. A connection which starts with server.wire.MAGIC sends frames of server.wire
+instead of lines, where each frame is a batch of reports. Connections put parsed reports
+in a bounded queue, so when ingestion falls behind they stop reading their sockets and TCP
+pushes back on clients. A single collector takes every report which is waiting in the queue
+as one batch. Batches and rounds are processed by a single worker thread in the order they
+are taken, so the event loop never blocks on ingestion or estimation.
+
+Usage:
+    python -m server.service --levels 0.1 0.5 0.9 --M 8 [--port 8750] [--round-reports 10000]
+        [--round-deadline 60]
+"""
+import argparse
+import asyncio
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from server.manager import PrivacyFlow
+from server.report_batch import ReportBatch
+from server.wire import MAGIC, HEADER, encode_batch, decode_batch, frame_size
+
+
+class ReportService:
+    """Collects reports of clients and closes rounds of a PrivacyFlow after a number of
+        reports or a deadline.
+    """
+
+    def __init__(self, flow, host='127.0.0.1', port=0, max_batch=4096, queue_size=65536,
+                 round_reports=None, round_deadline=None, on_round=None):
+        """Initialize the service. It does not listen until start is called.
+
+        Args:
+            flow (PrivacyFlow): The server which gets the reports.
+            host (str): Address to listen on.
+            port (int): Port to listen on. A free port is chosen if it is 0.
+            max_batch (int): The largest number of reports which are ingested at once.
+            queue_size (int): Number of parsed messages which can wait for ingestion before
+                connections stop reading.
+            round_reports (int): Number of reports after which a round is closed.
+            round_deadline (float): Seconds after the start of a round when it is closed if
+                every level has a report. Otherwise the round stays open until every level
+                has one.
+            on_round (callable): Called with number of the round and its L * M matrix of
+                estimations when a round is closed.
+        """
+        if round_reports is None and round_deadline is None:
+            raise ValueError('Error! Either round_reports or round_deadline should be given')
+        self.flow = flow
+        self.host = host
+        self.port = port
+        self.max_batch = max_batch
+        self.round_reports = round_reports
+        self.round_deadline = round_deadline
+        self.on_round = on_round
+        # Parsed messages which are waiting for ingestion. Each one is either a report as
+        #   (user ID, level index, v, h) or a ReportBatch of a frame.
+        self.queue = asyncio.Queue(queue_size)
+        # Reports of a message which are taken from the queue but belong to the next round.
+        self.carry = None
+        # Whether the collector has taken None from the queue.
+        self.stopping = False
+        # Worker which ingests batches and closes rounds in order on behalf of the loop.
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # Number of rounds which are closed.
+        self.round = 0
+        # Number of reports of current round which are taken by the collector.
+        self.reports = 0
+        # Time of the loop when current round started.
+        self.round_start = None
+        self.server = None
+        self.collector = None
+
+    async def start(self):
+        """Start listening and collecting reports.
+        """
+        loop = asyncio.get_running_loop()
+        self.round_start = loop.time()
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.collector = asyncio.create_task(self.collect())
+
+    async def stop(self, close_round=True):
+        """Stop listening and ingest every queued report.
+
+        Args:
+            close_round (bool): Whether the last round is closed if it has any report.
+        """
+        self.server.close()
+        await self.server.wait_closed()
+        # None tells the collector to return after the reports which are queued before it.
+        await self.queue.put(None)
+        await self.collector
+        if close_round and self.reports > 0:
+            await self.close_round()
+        self.executor.shutdown()
+
+    async def handle(self, reader, writer):
+        """Read messages of a connection until it is closed.
+
+        Args:
+            reader (asyncio.StreamReader): Stream of the connection.
+            writer (asyncio.StreamWriter): Stream of the connection.
+        """
+        try:
+            try:
+                prefix = await reader.readexactly(len(MAGIC))
+            except asyncio.IncompleteReadError as error:
+                prefix = error.partial
+            if prefix == MAGIC:
+                await self.read_frames(reader, writer)
+            elif prefix:
+                await self.read_lines(reader, writer, prefix)
+        finally:
+            writer.close()
+
+    async def read_lines(self, reader, writer, prefix):
+        """Read lines of JSON until the connection is closed.
+
+        Args:
+            reader (asyncio.StreamReader): Stream of the connection.
+            writer (asyncio.StreamWriter): Stream of the connection.
+            prefix (bytes): Bytes of the connection which are read already.
+        """
+        lines = (prefix + await reader.readline()).splitlines(keepends=True)
+        while lines:
+            for line in lines:
+                try:
+                    report = self.parse(line)
+                except (ValueError, KeyError, TypeError) as error:
+                    await self.reply_error(writer, error)
+                    continue
+                await self.put(report)
+            line = await reader.readline()
+            lines = [line] if line else []
+
+    async def read_frames(self, reader, writer):
+        """Read frames of wire format until the connection is closed. The connection is
+            closed after an invalid header since the following frames cannot be found, and
+            after a truncated frame.
+
+        Args:
+            reader (asyncio.StreamReader): Stream of the connection.
+            writer (asyncio.StreamWriter): Stream of the connection.
+        """
+        try:
+            header = MAGIC + await reader.readexactly(HEADER.size - len(MAGIC))
+            while True:
+                try:
+                    size = frame_size(header)
+                except ValueError as error:
+                    await self.reply_error(writer, error)
+                    return
+                frame = header + await reader.readexactly(size - HEADER.size)
+                batch = decode_batch(frame)
+                if batch.M != self.flow.M:
+                    await self.reply_error(writer,
+                                           f'Error! A report should have {self.flow.M} bits')
+                elif len(batch) and batch.level_index.max() >= len(self.flow.levels):
+                    await self.reply_error(writer, 'Error! Level index is out of range')
+                elif len(batch):
+                    await self.put(batch)
+                try:
+                    header = await reader.readexactly(HEADER.size)
+                except asyncio.IncompleteReadError as error:
+                    # The connection is closed between frames:
+                    if not error.partial:
+                        return
+                    raise
+        except asyncio.IncompleteReadError as error:
+            self.report_failure('reading a frame', error)
+
+    async def reply_error(self, writer, error):
+        """Answer an invalid message.
+
+        Args:
+            writer (asyncio.StreamWriter): Stream of the connection.
+            error (Exception|str): The problem of the message.
+        """
+        writer.write(json.dumps({'error': str(error)}).encode() + b'\n')
+        await writer.drain()
+
+    async def put(self, message):
+        """Queue a parsed message and wait while the queue is full.
+
+        Args:
+            message (tuple|ReportBatch): A single report or a batch of reports.
+        """
+        if self.queue.full():
+            self.flow.instrumentation.count('service.backpressure')
+        await self.queue.put(message)
+
+    def parse(self, line):
+        """Parse and validate a message.
+
+        Args:
+            line (bytes): A line of JSON.
+
+        Returns:
+            (int, int, int[], int[]): User ID, level index, v and h of the report.
+        """
+        message = json.loads(line)
+        user_id = message['user']
+        if type(user_id) is not int or not -2 ** 63 <= user_id < 2 ** 63:
+            raise ValueError('Error! `user` should be a 64 bit integer')
+        v, h = message['report']
+        if len(v) != self.flow.M or len(h) != self.flow.M:
+            raise ValueError(f'Error! A report should have {self.flow.M} bits')
+        if any(type(value) is not int or value not in (-1, 1) for value in v):
+            raise ValueError('Error! Values of a report should be 1 or -1')
+        if any(type(height) is not int or not 0 <= height <= 255 for height in h):
+            raise ValueError('Error! Heights of a report should be integers in [0, 255]')
+        return user_id, self.flow.levels.index(message['level']), v, h
+
+    async def collect(self):
+        """Take messages from the queue in batches and ingest them until it gets None.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            # The deadline is checked before each batch, so a busy queue cannot delay it.
+            expired = self.round_deadline is not None and \
+                loop.time() >= self.round_start + self.round_deadline
+            if expired and self.reports == 0:
+                self.round_start = loop.time()
+                continue
+            # A round is not closed by the deadline while a level has no reports.
+            if expired and self.flow.population.all():
+                await self.close_round()
+                continue
+            if self.carry is not None:
+                message, self.carry = self.carry, None
+            else:
+                timeout = None
+                if self.round_deadline is not None and not expired:
+                    timeout = self.round_start + self.round_deadline - loop.time()
+                try:
+                    message = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    continue
+                self.queue.task_done()
+                if message is None:
+                    return
+            limit = self.max_batch
+            if self.round_reports is not None:
+                limit = min(limit, self.round_reports - self.reports)
+            messages = [message]
+            count = message_size(message)
+            while count < limit and not self.queue.empty():
+                message = self.queue.get_nowait()
+                self.queue.task_done()
+                if message is None:
+                    self.stopping = True
+                    break
+                messages.append(message)
+                count += message_size(message)
+            if count > limit and self.round_reports is not None:
+                # The rest of the last batch belongs to the next round.
+                rest = count - limit
+                batch = messages[-1]
+                messages[-1] = batch.take(slice(len(batch) - rest))
+                self.carry = batch.take(slice(len(batch) - rest, None))
+                count = limit
+            try:
+                await loop.run_in_executor(self.executor, self.ingest, messages)
+            except Exception as error:
+                # Reports of a failed batch are dropped, so the service keeps collecting.
+                self.report_failure('ingestion', error)
+                count = 0
+            self.reports += count
+            if self.round_reports is not None and self.reports >= self.round_reports:
+                await self.close_round()
+            if self.stopping and self.carry is None:
+                return
+
+    def ingest(self, messages):
+        """Add messages to the flow. It runs on the worker.
+
+        Args:
+            messages ([tuple|ReportBatch]): Parsed messages.
+        """
+        batches = []
+        reports = []
+        for message in messages + [None]:
+            if isinstance(message, tuple):
+                reports.append(message)
+                continue
+            if reports:
+                user_ids, level_index, v, h = zip(*reports)
+                batches.append(ReportBatch(user_ids, level_index, v, h))
+                reports = []
+            if message is not None:
+                batches.append(message)
+        self.flow.ingest_batch(ReportBatch.concatenate(batches))
+
+    async def close_round(self):
+        """Close current round on the worker and give its estimations to on_round.
+
+        Returns:
+            float[][]: L * M matrix where l'th row is the estimation at l'th level or None if
+                estimation fails.
+        """
+        loop = asyncio.get_running_loop()
+        estimations = None
+        try:
+            estimations = await loop.run_in_executor(self.executor, self.flow.estimate_all)
+        except Exception as error:
+            self.report_failure('estimation', error)
+        # Next round starts even if estimation fails, so later rounds are not blocked.
+        try:
+            await loop.run_in_executor(self.executor, self.flow.next_round)
+        except Exception as error:
+            self.report_failure('next round', error)
+        self.round += 1
+        self.reports = 0
+        self.round_start = loop.time()
+        if self.on_round is not None and estimations is not None:
+            self.on_round(self.round, estimations)
+        return estimations
+
+    def report_failure(self, stage, error):
+        """Report an error of the worker without stopping the service.
+
+        Args:
+            stage (str): The stage which failed.
+            error (Exception): The error.
+        """
+        self.flow.instrumentation.count('service.failures')
+        print(f'Error! {stage} of round {self.round + 1} failed: {error!r}', file=sys.stderr)
+
+
+def message_size(message):
+    """Number of reports of a queued message."""
+    return len(message) if isinstance(message, ReportBatch) else 1
+
+
+async def send_reports(host, port, user_ids, levels, reports):
+    """Send reports to a service over a single connection.
+
+    Args:
+        host (str): Address of the service.
+        port (int): Port of the service.
+        user_ids (int[]): ID of each user.
+        levels (float[]): Privacy budget of each user.
+        reports ([[int[], int[]]]): Output of WrappeedClient.report of each user.
+
+    Returns:
+        [str]: Errors of invalid reports.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    for user_id, level, report in zip(user_ids, levels, reports):
+        writer.write(json.dumps({'user': user_id, 'level': level, 'report': report}).encode()
+                     + b'\n')
+        await writer.drain()
+    writer.write_eof()
+    errors = [json.loads(line)['error'] async for line in reader]
+    writer.close()
+    await writer.wait_closed()
+    return errors
+
+
+async def send_frames(host, port, batches):
+    """Send batches of reports to a service in wire format over a single connection.
+
+    Args:
+        host (str): Address of the service.
+        port (int): Port of the service.
+        batches ([ReportBatch]): The reports.
+
+    Returns:
+        [str]: Errors of invalid batches.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    for batch in batches:
+        writer.write(encode_batch(batch))
+        await writer.drain()
+    writer.write_eof()
+    errors = [json.loads(line)['error'] async for line in reader]
+    writer.close()
+    await writer.wait_closed()
+    return errors
+
+
+async def serve(arguments):
+    """Run the service until it is interrupted.
+
+    Args:
+        arguments (argparse.Namespace): Parsed command line arguments.
+    """
+    flow = PrivacyFlow(None, arguments.levels, arguments.M)
+
+    def print_round(t, estimations):
+        print(f'Round {t}:', json.dumps(estimations.tolist()), flush=True)
+
+    service = ReportService(flow, arguments.host, arguments.port,
+                            round_reports=arguments.round_reports,
+                            round_deadline=arguments.round_deadline, on_round=print_round)
+    await service.start()
+    print(f'Listening on {arguments.host}:{service.port}', flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await service.stop()
+
+
+def main(arguments):
+    """Entrypoint of the command line.
+
+    Args:
+        arguments ([str]): Command line arguments.
+    """
+    parser = argparse.ArgumentParser(description='Report collection service of Privacy Flow.')
+    parser.add_argument('--levels', type=float, nargs='+', required=True)
+    parser.add_argument('--M', type=int, required=True)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8750)
+    parser.add_argument('--round-reports', type=int)
+    parser.add_argument('--round-deadline', type=float, default=60.0)
+    try:
+        asyncio.run(serve(parser.parse_args(arguments)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
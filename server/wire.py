@@ -0,0 +1,155 @@
+"""This module implements the binary wire format of reports.
+
+A frame holds a batch of reports and consists of a 16 byte little-endian header followed by
+columns of the batch:
+
+    header      magic b'PFWR', version (uint8), flags (uint8), M (uint16), N (uint32),
+                shared height (uint8) and 3 bytes of padding
+    user_ids    N * uint32, or N * int64 if flags has WIDE_IDS
+    level_index N * uint8
+    v           N * ceil(M / 8) bytes where bit m of a row is 1 if v is 1 and 0 if it is -1
+    h           N * ceil(M / 8) bytes of bits which are 1 where h is the shared height if
+                flags has SHARED_HEIGHT, otherwise N * M * uint8
+
+Clients report either the leaf (h = 0) or the root of their difference trees whose height
+is the same for every client at a round, so heights are usually shared.
+"""
+import struct
+import numpy as np
+from server.report_batch import ReportBatch
+
+MAGIC = b'PFWR'
+VERSION = 1
+# Flag of heights which are sent as a bit per bit of report along with a shared height.
+SHARED_HEIGHT = 1
+# Flag of user IDs which do not fit in uint32.
+WIDE_IDS = 2
+HEADER = struct.Struct('<4sBBHIB3x')
+
+
+def packed_size(M):
+    """Number of bytes of M packed bits."""
+    return (M + 7) // 8
+
+
+def payload_size(flags, M, N):
+    """Computes the size of columns which follow a header.
+
+    Args:
+        flags (int): Flags of the frame.
+        M (int): Number of bits of each report.
+        N (int): Number of reports.
+
+    Returns:
+        int: Number of bytes.
+    """
+    id_size = 8 if flags & WIDE_IDS else 4
+    h_size = packed_size(M) if flags & SHARED_HEIGHT else M
+    return N * (id_size + 1 + packed_size(M) + h_size)
+
+
+def encode_batch(batch):
+    """Encodes a batch of reports as a frame.
+
+    Args:
+        batch (ReportBatch): The reports.
+
+    Returns:
+        bytes: The frame.
+    """
+    N, M = batch.v.shape
+    if N > 0 and batch.level_index.max() > 255:
+        raise ValueError('Error! The wire format supports at most 256 levels')
+    flags = 0
+    user_ids = batch.user_ids.astype('<u4')
+    if N > 0 and (batch.user_ids.min() < 0 or batch.user_ids.max() >= 1 << 32):
+        flags |= WIDE_IDS
+        user_ids = batch.user_ids.astype('<i8')
+    roots = batch.h[batch.h > 0]
+    height = int(roots[0]) if len(roots) else 0
+    columns = [user_ids, batch.level_index.astype(np.uint8), np.packbits(batch.v > 0, axis=1)]
+    if np.all(roots == height):
+        flags |= SHARED_HEIGHT
+        columns.append(np.packbits(batch.h > 0, axis=1))
+    else:
+        columns.append(batch.h)
+    header = HEADER.pack(MAGIC, VERSION, flags, M, N, height)
+    return header + b''.join(column.tobytes() for column in columns)
+
+
+def decode_header(buffer):
+    """Decodes the header of a frame.
+
+    Args:
+        buffer (bytes): At least HEADER.size bytes of the beginning of a frame.
+
+    Returns:
+        (int, int, int, int): Flags, M, N and shared height.
+    """
+    if len(buffer) < HEADER.size:
+        raise ValueError('Error! Header of frame is truncated')
+    magic, version, flags, M, N, height = HEADER.unpack_from(buffer)
+    if magic != MAGIC:
+        raise ValueError('Error! Not a frame of reports')
+    if version != VERSION:
+        raise ValueError(f'Error! Unsupported version {version} of wire format')
+    return flags, M, N, height
+
+
+def frame_size(buffer):
+    """Computes the size of a frame from its header.
+
+    Args:
+        buffer (bytes): At least HEADER.size bytes of the beginning of a frame.
+
+    Returns:
+        int: Number of bytes of the whole frame.
+    """
+    flags, M, N, _ = decode_header(buffer)
+    return HEADER.size + payload_size(flags, M, N)
+
+
+def decode_batch(buffer):
+    """Decodes a frame.
+
+    Args:
+        buffer (bytes|memoryview): The frame.
+
+    Returns:
+        ReportBatch: The reports.
+    """
+    flags, M, N, height = decode_header(buffer)
+    if len(buffer) != HEADER.size + payload_size(flags, M, N):
+        raise ValueError('Error! Size of frame does not match its header')
+    offset = HEADER.size
+    id_type = np.dtype('<i8' if flags & WIDE_IDS else '<u4')
+    user_ids = np.frombuffer(buffer, id_type, N, offset)
+    offset += N * id_type.itemsize
+    level_index = np.frombuffer(buffer, np.uint8, N, offset)
+    offset += N
+    v = np.frombuffer(buffer, np.uint8, N * packed_size(M), offset).reshape(N, packed_size(M))
+    v = (np.unpackbits(v, axis=1, count=M).view(np.int8) << 1) - 1
+    offset += N * packed_size(M)
+    if flags & SHARED_HEIGHT:
+        h = np.frombuffer(buffer, np.uint8, N * packed_size(M), offset).reshape(N, packed_size(M))
+        h = np.unpackbits(h, axis=1, count=M) * np.uint8(height)
+    else:
+        h = np.frombuffer(buffer, np.uint8, N * M, offset).reshape(N, M)
+    return ReportBatch(user_ids, level_index, v, h)
+
+
+def decode_frames(buffer):
+    """Decodes consecutive frames.
+
+    Args:
+        buffer (bytes|memoryview): The frames one after another.
+
+    Yields:
+        ReportBatch: Reports of each frame.
+    """
+    buffer = memoryview(buffer)
+    offset = 0
+    while offset < len(buffer):
+        size = frame_size(buffer[offset:offset + HEADER.size])
+        yield decode_batch(buffer[offset:offset + size])
+        offset += size
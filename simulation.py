@@ -0,0 +1,184 @@
+"""Simulation of Privacy Flow clients which shards the population over a pool of processes.
+"""
+import multiprocessing
+import numpy as np
+from client_population import ClientPopulation
+from randomness import RandomSource
+from server.report_batch import ReportBatch
+
+
+def create_shard(M, privacy_levels, selected_levels, report_limit, seed):
+    """Creates population of a shard with its own stream of randomness.
+
+    Args:
+        M (int): Number of bits of data.
+        privacy_levels (float[]): An array of all levels of privacy.
+        selected_levels (int[]): Selected level of each user of the shard.
+        report_limit (int): Number of reports each user can spend its budget on.
+        seed (np.random.SeedSequence): Seed of the shard.
+
+    Returns:
+        ClientPopulation: Population of the shard.
+    """
+    return ClientPopulation(M, privacy_levels, selected_levels, report_limit,
+                            RandomSource(seed))
+
+
+def serve_shards(connection, shards):
+    """Entrypoint of worker processes which keeps populations of their shards resident and
+        handles requests of ShardedSimulation until None is received.
+
+    Args:
+        connection (Connection): The pipe to the simulation.
+        shards ({int: tuple}): Arguments of create_shard for each shard of this worker.
+    """
+    populations = {index: create_shard(*arguments) for index, arguments in shards.items()}
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        command, payload = message
+        if command == 'report':
+            connection.send({index: populations[index].report(values)
+                             for index, values in payload.items()})
+        else:
+            connection.send({index: getattr(population, command)()
+                             for index, population in populations.items()})
+    connection.close()
+
+
+class ShardedSimulation:
+    """Simulates a population of clients which is split into fixed size shards.
+        Each shard draws randomness from its own stream which is spawned from a single
+        np.random.SeedSequence, so for a given seed, reports are the same whatever the
+        number of workers is.
+    """
+
+    def __init__(self, M, privacy_levels, selected_levels, report_limit, seed=None, workers=1,
+                 shard_size=65536):
+        """Initialize shards and start worker processes.
+
+        Args:
+            M (int): Number of bits of data.
+            privacy_levels (float[]): An array of all levels of privacy.
+            selected_levels (int[]): For each user, an index of privacy_levels array which is
+                indicating selected level of privacy for that user.
+            report_limit (int): Number of reports each user can spend its budget on.
+            seed (int|np.random.SeedSequence): Seed of the whole simulation.
+            workers (int): Number of worker processes. With one worker, shards are kept in
+                this process.
+            shard_size (int): Number of users in each shard.
+        """
+        self.M = M
+        self.selected_levels = np.asarray(selected_levels, dtype=np.int64)
+        self.N = len(self.selected_levels)
+        self.bounds = [(start, min(start + shard_size, self.N))
+                       for start in range(0, self.N, shard_size)]
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        seeds = seed.spawn(len(self.bounds))
+        shards = [(M, privacy_levels, self.selected_levels[start:stop], report_limit, seeds[index])
+                  for index, (start, stop) in enumerate(self.bounds)]
+        self.workers = min(workers, len(shards))
+        self.populations = None
+        self.connections = []
+        self.processes = []
+        if self.workers <= 1:
+            self.populations = [create_shard(*arguments) for arguments in shards]
+            return
+        context = multiprocessing.get_context()
+        for worker in range(self.workers):
+            connection, worker_connection = context.Pipe()
+            assigned = {index: shards[index] for index in range(worker, len(shards), self.workers)}
+            process = context.Process(target=serve_shards, args=(worker_connection, assigned),
+                                      daemon=True)
+            process.start()
+            worker_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+    def gather(self, results):
+        """Concatenates results of shards in order of users.
+
+        Args:
+            results ({int: object}): Result of each shard.
+
+        Returns:
+            [object]: Results ordered by shard.
+        """
+        return [results[index] for index in range(len(self.bounds))]
+
+    def broadcast(self, command, payloads=None):
+        """Runs a command on every shard.
+
+        Args:
+            command (str): Either 'report' or name of a method of ClientPopulation.
+            payloads ([object]): Argument of each shard for 'report' command.
+
+        Returns:
+            [object]: Results ordered by shard.
+        """
+        if self.populations is not None:
+            if command == 'report':
+                return [population.report(values)
+                        for population, values in zip(self.populations, payloads)]
+            return [getattr(population, command)() for population in self.populations]
+        for worker, connection in enumerate(self.connections):
+            shards = range(worker, len(self.bounds), self.workers)
+            payload = {index: payloads[index] for index in shards} if payloads else None
+            connection.send((command, payload))
+        results = {}
+        for connection in self.connections:
+            results.update(connection.recv())
+        return self.gather(results)
+
+    def report(self, values):
+        """Report the current value of every user.
+
+        Args:
+            values (int[]): The value of each user.
+
+        Returns:
+            ReportBatch: Reports of all users which are ready to be ingested by server.
+        """
+        values = np.asarray(values, dtype=np.int64)
+        reports = self.broadcast('report', [values[start:stop] for start, stop in self.bounds])
+        v = np.empty([self.N, self.M], dtype=np.int8)
+        h = np.empty([self.N, self.M], dtype=np.uint8)
+        for (start, stop), (shard_v, shard_h) in zip(self.bounds, reports):
+            v[start:stop] = shard_v
+            h[start:stop] = shard_h
+        return ReportBatch(np.arange(self.N), self.selected_levels, v, h)
+
+    def how_many_changes(self):
+        """Returns number of changes in values of each user.
+
+        Returns:
+            int[]: Number of changes till now.
+        """
+        return np.concatenate(self.broadcast('how_many_changes'))
+
+    def budget_consumption(self):
+        """Returns the consumed budget of each user.
+
+        Returns:
+            float[]: The consumed budget till now.
+        """
+        return np.concatenate(self.broadcast('budget_consumption'))
+
+    def close(self):
+        """Stops worker processes.
+        """
+        for connection in self.connections:
+            connection.send(None)
+            connection.close()
+        for process in self.processes:
+            process.join()
+        self.connections = []
+        self.processes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
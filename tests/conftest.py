@@ -0,0 +1,42 @@
+"""Shared fixtures of tests. Modules of the repository are imported from its root.
+"""
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from client_population import ClientPopulation  # noqa: E402
+from randomness import RandomSource  # noqa: E402
+from server.report_batch import ReportBatch  # noqa: E402
+
+LEVELS = [0.1, 0.5, 0.9]
+M = 8
+
+
+def simulate_rounds(N, rounds, seed=0):
+    """Simulates reports of users whose values change every round.
+
+    Args:
+        N (int): Number of users.
+        rounds (int): Number of rounds.
+        seed (int): Seed of values and clients.
+
+    Returns:
+        [ReportBatch]: Reports of each round.
+    """
+    selected = np.arange(N) % len(LEVELS)
+    population = ClientPopulation(M, LEVELS, selected, rounds, RandomSource(seed))
+    values = np.random.default_rng(seed).integers(0, 2 ** M, (rounds, N))
+    batches = []
+    for round_values in values:
+        v, h = population.report(round_values)
+        batches.append(ReportBatch(np.arange(N), selected, v, h))
+    return batches
+
+
+@pytest.fixture(scope='session')
+def rounds():
+    """Reports of 6 rounds of 3000 users."""
+    return simulate_rounds(3000, 6)
@@ -0,0 +1,100 @@
+"""Tests of checkpoints of PrivacyFlow which are written by save and read by load.
+"""
+from functools import partial
+import numpy as np
+import pytest
+from conftest import LEVELS, M
+from randomness import RandomSource
+from server import checkpoint
+from server.manager import PrivacyFlow
+from server.replicator.drs import DRS
+from server.replicator.drpp import DRPP
+
+# Options of PrivacyFlow of each tested configuration.
+CONFIGURATIONS = {
+    'DRS': {'replicator': DRS},
+    'DRPP': {'replicator': DRPP},
+    'reservoir': {'replicator': partial(DRS, reservoir_size=200)},
+    'dyadic': {'replicator': DRS, 'history': 'dyadic'},
+}
+
+
+def run(flow, batches, first_round=0):
+    """Gives reports of rounds to a flow in two parts and closes the rounds. The first part
+        has the reports of the strictest level, so the population of a round is not
+        uniform before the round is complete.
+
+    Args:
+        flow (PrivacyFlow): The flow.
+        batches ([ReportBatch]): Reports of every round.
+        first_round (int): The round which flow starts from. Its first part is ingested.
+
+    Returns:
+        [float[][]]: Estimations of each closed round.
+    """
+    estimations = []
+    for index, batch in enumerate(batches[first_round:], first_round):
+        strictest = batch.level_index == 0
+        if index != first_round:
+            flow.ingest_batch(batch.take(strictest))
+        flow.ingest_batch(batch.take(~strictest))
+        estimations.append(flow.close_round())
+    return estimations
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+@pytest.mark.parametrize('name', list(CONFIGURATIONS))
+def test_resumed_flow_matches_uninterrupted_run(rounds, tmp_path, name, mmap):
+    options = dict(CONFIGURATIONS[name])
+    if options.get('history') == 'dyadic':
+        options['spill_directory'] = str(tmp_path / 'uninterrupted')
+        (tmp_path / 'uninterrupted').mkdir()
+    expected_flow = PrivacyFlow(None, LEVELS, M, rng=RandomSource(7), **options)
+    expected = run(expected_flow, rounds)
+
+    if options.get('history') == 'dyadic':
+        options['spill_directory'] = str(tmp_path / 'resumed')
+        (tmp_path / 'resumed').mkdir()
+    flow = PrivacyFlow(None, LEVELS, M, rng=RandomSource(7), **options)
+    middle = len(rounds) // 2
+    before = run(flow, rounds[:middle])
+    # Save in the middle of a round:
+    flow.ingest_batch(rounds[middle].take(rounds[middle].level_index == 0))
+    flow.save(str(tmp_path / 'flow.ckpt'))
+    del flow
+    resumed = PrivacyFlow.load(str(tmp_path / 'flow.ckpt'), mmap)
+    after = run(resumed, rounds, middle)
+
+    np.testing.assert_array_equal(np.array(before + after), np.array(expected))
+    assert np.all(np.isfinite(expected))
+    if options.get('history') == 'dyadic':
+        for level, history in resumed.finish().items():
+            np.testing.assert_array_equal(history, expected_flow.finish()[level])
+
+
+def test_checkpoint_keeps_values_and_arrays(tmp_path):
+    state = {'count': 3, 'name': 'flow', 'empty': np.zeros((0, 4), dtype=np.int8),
+             'scalar': np.asarray(5, dtype=np.uint8), 'matrix': np.arange(12.).reshape(3, 4)}
+    path = str(tmp_path / 'state.ckpt')
+    checkpoint.save(path, state)
+    for loaded in (checkpoint.load(path, mmap=True), checkpoint.load(path, mmap=False),
+                   checkpoint.loads(checkpoint.dumps(state))):
+        assert loaded['count'] == 3 and loaded['name'] == 'flow'
+        for key in ('empty', 'scalar', 'matrix'):
+            assert loaded[key].dtype == state[key].dtype
+            np.testing.assert_array_equal(loaded[key], state[key])
+
+
+def test_memory_mapped_arrays_are_copy_on_write(tmp_path):
+    path = str(tmp_path / 'state.ckpt')
+    checkpoint.save(path, {'matrix': np.zeros((2, 3))})
+    loaded = checkpoint.load(path, mmap=True)
+    loaded['matrix'][0, 0] = 1
+    assert checkpoint.load(path, mmap=False)['matrix'][0, 0] == 0
+
+
+def test_corrupt_checkpoint_is_rejected(tmp_path):
+    path = tmp_path / 'state.ckpt'
+    path.write_bytes(b'not a checkpoint at all')
+    with pytest.raises(ValueError):
+        checkpoint.load(str(path))
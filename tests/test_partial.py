@@ -0,0 +1,120 @@
+"""Tests of partial aggregates and the coordinator which merges them.
+"""
+import asyncio
+import numpy as np
+import pytest
+from conftest import LEVELS, M
+from randomness import RandomSource
+from server.manager import PrivacyFlow
+from server.partial import Coordinator, PartialAggregate, send_partial
+from server.replicator.drs import DRS
+from server.replicator.drpp import DRPP
+
+
+def split(batch, t, parts=4):
+    """Splits reports of a round into partial aggregates.
+
+    Args:
+        batch (ReportBatch): Reports of the round.
+        t (int): Number of the round.
+        parts (int): Number of aggregates.
+
+    Returns:
+        [PartialAggregate]: Aggregates of consecutive reports.
+    """
+    bounds = np.linspace(0, len(batch), parts + 1).astype(int)
+    partials = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        partial = PartialAggregate(LEVELS, M, t)
+        partial.ingest_batch(batch.take(slice(start, stop)))
+        partials.append(partial)
+    return partials
+
+
+def assert_same_state(actual, expected):
+    actual, expected = actual.get_state(), expected.get_state()
+    assert actual.keys() == expected.keys()
+    for key, value in expected.items():
+        np.testing.assert_array_equal(actual[key], value)
+
+
+@pytest.mark.parametrize('replicator', [DRS, DRPP])
+def test_merged_partials_match_direct_ingestion(rounds, tmp_path, replicator):
+    direct = PrivacyFlow(None, LEVELS, M, replicator=replicator, rng=RandomSource(3))
+    expected = []
+    for batch in rounds:
+        direct.ingest_batch(batch)
+        expected.append(direct.close_round())
+
+    coordinator = Coordinator(PrivacyFlow(None, LEVELS, M, replicator=replicator,
+                                          rng=RandomSource(3)))
+    estimations = []
+    for t, batch in enumerate(rounds):
+        first, second, third, fourth = split(batch, t)
+        # Partials arrive serialized, from files in the order of their names and merged by
+        #   other nodes:
+        coordinator.add(PartialAggregate.from_bytes(first.merge(second).to_bytes()))
+        third.save(str(tmp_path / '2.partial'))
+        PartialAggregate(LEVELS, M, t + 1).save(str(tmp_path / 'next.partial'))
+        fourth.save(str(tmp_path / '3.partial'))
+        assert coordinator.collect_directory(str(tmp_path)) == 2
+        assert len(coordinator.partial) == len(batch)
+        estimations.append(coordinator.close_round())
+        (tmp_path / 'next.partial').unlink()
+
+    np.testing.assert_array_equal(np.array(estimations), np.array(expected))
+
+
+def test_merge_is_associative(rounds):
+    a, b, c = split(rounds[0], 0, parts=3)
+    left = PartialAggregate.from_bytes(a.to_bytes()).merge(
+        PartialAggregate.from_bytes(b.to_bytes())).merge(c)
+    right = PartialAggregate.from_bytes(a.to_bytes()).merge(
+        PartialAggregate.from_bytes(b.to_bytes()).merge(c))
+    assert_same_state(left, right)
+    whole = PartialAggregate(LEVELS, M, 0)
+    whole.ingest_batch(rounds[0])
+    for name, value in vars(whole.sums).items():
+        np.testing.assert_array_equal(getattr(left.sums, name), value)
+    np.testing.assert_array_equal(left.population, whole.population)
+
+
+def test_serialization_round_trip(rounds, tmp_path):
+    partial = split(rounds[1], 1, parts=2)[0]
+    assert_same_state(PartialAggregate.from_bytes(partial.to_bytes()), partial)
+    partial.save(str(tmp_path / 'a.partial'))
+    assert_same_state(PartialAggregate.load(str(tmp_path / 'a.partial')), partial)
+    empty = PartialAggregate(LEVELS, M)
+    assert_same_state(PartialAggregate.from_bytes(empty.to_bytes()), empty)
+    decoded = list(PartialAggregate.from_bytes(partial.to_bytes()).batches())
+    np.testing.assert_array_equal(np.concatenate([batch.v for batch in decoded]),
+                                  rounds[1].take(slice(len(partial))).v)
+
+
+def test_partials_of_other_rounds_or_levels_are_rejected():
+    partial = PartialAggregate(LEVELS, M, 0)
+    with pytest.raises(ValueError):
+        partial.merge(PartialAggregate(LEVELS, M, 1))
+    with pytest.raises(ValueError):
+        partial.merge(PartialAggregate(LEVELS[:-1], M, 0))
+    with pytest.raises(ValueError):
+        partial.merge(PartialAggregate(LEVELS, M + 1, 0))
+
+
+def test_partials_are_received_over_connections(rounds):
+    coordinator = Coordinator(PrivacyFlow(None, LEVELS, M, rng=RandomSource(3)))
+
+    async def main():
+        server = await asyncio.start_server(coordinator.receive, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        for partial in split(rounds[0], 0):
+            await send_partial('127.0.0.1', port, partial)
+        while len(coordinator.partial) < len(rounds[0]):
+            await asyncio.sleep(0.01)
+        server.close()
+        await server.wait_closed()
+
+    asyncio.run(asyncio.wait_for(main(), 10))
+    whole = PartialAggregate(LEVELS, M, 0)
+    whole.ingest_batch(rounds[0])
+    np.testing.assert_array_equal(coordinator.partial.population, whole.population)
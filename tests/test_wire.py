@@ -0,0 +1,112 @@
+"""Tests of the binary wire format of reports.
+"""
+import numpy as np
+import pytest
+from server.report_batch import ReportBatch
+from server.wire import (HEADER, SHARED_HEIGHT, WIDE_IDS, decode_batch, decode_frames,
+                         decode_header, encode_batch)
+
+
+def random_batch(N, M, user_ids=None, heights=(0, 3), levels=3, seed=0):
+    """Creates a batch of random reports.
+
+    Args:
+        N (int): Number of reports.
+        M (int): Number of bits.
+        user_ids (int[]): IDs of users which are 0 to N - 1 if not given.
+        heights (int[]): Heights which are chosen for each bit.
+        levels (int): Number of levels.
+        seed (int): Seed of reports.
+
+    Returns:
+        ReportBatch: The reports.
+    """
+    rng = np.random.default_rng(seed)
+    return ReportBatch(np.arange(N) if user_ids is None else user_ids,
+                       rng.integers(0, levels, N), rng.integers(0, 2, (N, M)) * 2 - 1,
+                       rng.choice(heights, (N, M)))
+
+
+def assert_same_batch(actual, expected):
+    np.testing.assert_array_equal(actual.user_ids, expected.user_ids)
+    np.testing.assert_array_equal(actual.level_index, expected.level_index)
+    np.testing.assert_array_equal(actual.v, expected.v)
+    np.testing.assert_array_equal(actual.h, expected.h)
+
+
+@pytest.mark.parametrize('M', [1, 8, 13])
+def test_shared_heights_round_trip(M):
+    batch = random_batch(100, M)
+    frame = encode_batch(batch)
+    flags, decoded_M, N, height = decode_header(frame)
+    assert flags == SHARED_HEIGHT and (decoded_M, N, height) == (M, 100, 3)
+    assert_same_batch(decode_batch(frame), batch)
+
+
+def test_different_heights_round_trip():
+    batch = random_batch(100, 10, heights=(0, 1, 2, 5))
+    frame = encode_batch(batch)
+    assert not decode_header(frame)[0] & SHARED_HEIGHT
+    assert_same_batch(decode_batch(frame), batch)
+
+
+@pytest.mark.parametrize('user_ids', [[-1, 2, 3], [0, 2 ** 32, 2 ** 62]])
+def test_wide_ids_round_trip(user_ids):
+    batch = random_batch(3, 8, user_ids=np.array(user_ids))
+    frame = encode_batch(batch)
+    assert decode_header(frame)[0] & WIDE_IDS
+    assert_same_batch(decode_batch(frame), batch)
+
+
+def test_narrow_ids_are_not_wide():
+    frame = encode_batch(random_batch(3, 8, user_ids=np.array([0, 1, 2 ** 32 - 1])))
+    assert not decode_header(frame)[0] & WIDE_IDS
+
+
+def test_empty_batch_round_trip():
+    batch = random_batch(0, 6)
+    decoded = decode_batch(encode_batch(batch))
+    assert len(decoded) == 0 and decoded.M == 6
+
+
+def test_multiple_frames_round_trip():
+    batches = [random_batch(50, 8, seed=1), random_batch(0, 8),
+               random_batch(20, 8, heights=(0, 1, 4), seed=2),
+               random_batch(5, 8, user_ids=np.array([-5, 0, 1, 2, 3]), seed=3)]
+    decoded = list(decode_frames(b''.join(encode_batch(batch) for batch in batches)))
+    assert len(decoded) == len(batches)
+    for actual, expected in zip(decoded, batches):
+        assert_same_batch(actual, expected)
+
+
+def test_truncated_frame_is_rejected():
+    frame = encode_batch(random_batch(10, 8))
+    with pytest.raises(ValueError):
+        decode_batch(frame[:-1])
+    with pytest.raises(ValueError):
+        decode_batch(frame + b'\0')
+    with pytest.raises(ValueError):
+        decode_header(frame[:HEADER.size - 1])
+
+
+def test_truncated_stream_is_rejected():
+    frame = encode_batch(random_batch(10, 8))
+    for cut in (len(frame) + 5, 2 * len(frame) - 1):
+        with pytest.raises(ValueError):
+            list(decode_frames((frame + frame)[:cut]))
+
+
+def test_corrupt_header_is_rejected():
+    frame = bytearray(encode_batch(random_batch(10, 8)))
+    with pytest.raises(ValueError, match='Not a frame'):
+        decode_batch(b'XXXX' + bytes(frame[4:]))
+    frame[4] = 99
+    with pytest.raises(ValueError, match='version'):
+        decode_batch(bytes(frame))
+
+
+def test_too_many_levels_are_rejected():
+    batch = random_batch(10, 8)
+    batch.level_index[0] = 256
+    with pytest.raises(ValueError):
+        encode_batch(batch)